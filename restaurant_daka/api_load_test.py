@@ -0,0 +1,116 @@
+"""
+HTTP 接口压力测试
+多个客户端线程在保持连接的情况下循环请求接口，统计每秒请求数和响应时间。
+没有指定 --url 时在本进程中启动 api_server 并生成测试数据库。
+"""
+import argparse
+import http.client
+import os
+import random
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+DEFAULT_PATHS = [
+    '/records?limit=100',
+    '/records?limit=50&type=' + quote('火锅'),
+    '/records?limit=50&q=' + quote('餐厅1'),
+    '/stats/summary',
+    '/stats/histogram',
+    '/stats/daily?start=2024-01-01&end=2024-12-31',
+    '/version',
+]
+
+def _client(host, port, paths, deadline, conditional, results):
+    """单个客户端：保持一个连接，按随机顺序请求接口"""
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    etags = {}
+    latencies = []
+    statuses = {}
+    try:
+        while time.perf_counter() < deadline:
+            path = random.choice(paths)
+            headers = {'If-None-Match': etags[path]} if conditional and path in etags else {}
+            start = time.perf_counter()
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+            etag = response.getheader('ETag')
+            if etag:
+                etags[path] = etag
+    finally:
+        conn.close()
+        results.append((latencies, statuses))
+
+def run_load_test(url, clients=8, duration=5.0, paths=None, conditional=False):
+    """返回 (每秒请求数, 请求总数, 延迟列表, {状态码: 次数})"""
+    parts = urlsplit(url)
+    paths = paths or DEFAULT_PATHS
+    deadline = time.perf_counter() + duration
+    results = []
+    threads = [threading.Thread(target=_client, args=(parts.hostname, parts.port, paths, deadline, conditional, results))
+               for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    statuses = {}
+    for _, client_statuses in results:
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return len(latencies) / elapsed, len(latencies), latencies, statuses
+
+def _report(title, result):
+    rate, total, latencies, statuses = result
+    if not latencies:
+        print(f"{title}: 没有完成任何请求")
+        return
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f"{title}: {rate:.0f} 请求/秒 (共 {total} 次, P50 {p50:.1f}ms, P95 {p95:.1f}ms, 状态码 {statuses})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP 接口压力测试")
+    parser.add_argument("--url", help="已经运行的服务地址，例如 http://127.0.0.1:8765，默认在本进程中启动")
+    parser.add_argument("--rows", type=int, default=100000, help="本进程启动服务时生成的测试记录数")
+    parser.add_argument("--clients", type=int, default=8, help="并发客户端数")
+    parser.add_argument("--duration", type=float, default=5.0, help="每轮测试的秒数")
+    parser.add_argument("--pool-size", type=int, default=4, help="本进程启动服务时的读连接池大小")
+    args = parser.parse_args(argv)
+    
+    server = None
+    tmp = None
+    url = args.url
+    if url is None:
+        from api_server import DakaAPIServer
+        from parallel_statistics import _create_benchmark_database
+        
+        tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmp.name, "load_test.db")
+        print(f"生成 {args.rows} 条测试记录...")
+        _create_benchmark_database(db_path, args.rows)
+        server = DakaAPIServer(('127.0.0.1', 0), db_path, args.pool_size)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+    
+    try:
+        print(f"测试 {url}，{args.clients} 个客户端，每轮 {args.duration:g} 秒")
+        _report("完整响应", run_load_test(url, args.clients, args.duration))
+        _report("条件请求 (If-None-Match)", run_load_test(url, args.clients, args.duration, conditional=True))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            tmp.cleanup()
+    return 0
+
+# 命令行：python api_load_test.py [--url http://127.0.0.1:8765] [--clients 8] [--duration 5]
+if __name__ == "__main__":
+    raise SystemExit(main())
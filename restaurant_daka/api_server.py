@@ -0,0 +1,316 @@
+"""
+本地 HTTP/JSON 接口
+多个前端（图形界面、网页、脚本）通过这个服务共享同一个打卡数据库，不需要各自打开数据库文件。
+只使用标准库：ThreadingHTTPServer 每个请求一个线程，读请求从读连接池中取连接，写请求由一个写连接串行执行。
+数据库切换为 WAL 模式，读请求不会阻塞写请求。
+
+GET  /version                                       数据版本号
+GET  /records?limit=&after=&q=&name=&type=&start=&end=  分页读取记录（分块传输，按日期从新到旧）
+GET  /types                                         类型列表
+GET  /stats/summary                                 按餐厅和类型汇总
+GET  /stats/daily?start=&end=                       每日打卡次数和平均分
+GET  /stats/histogram?bin_width=&name=&type=        评分分布
+GET  /stats/percentiles?group_by=&min_count=        中位数和 P90
+GET  /stats/top?limit=&type=&prior_weight=          评分最高的餐厅
+POST /records                                       添加记录（JSON：name, type, date, score, comment, image_path）
+DELETE /records/<id>                                删除记录（可以在图形界面中撤销）
+
+所有 GET 响应都带有由数据版本号生成的 ETag，客户端带上 If-None-Match 时数据没有变化则返回 304；
+统计结果按数据版本缓存，数据不变时不会重复计算。
+"""
+import argparse
+import json
+import queue
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from database import DakaDatabase
+from statistics import get_percentile_summary, get_score_distribution, get_top_restaurants_from_summary
+
+# /records 每页的默认和最大记录数
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# 分块传输时每块包含的记录数
+STREAM_CHUNK_ROWS = 200
+
+RECORD_FIELDS = ('id', 'name', 'type', 'date', 'score', 'comment', 'image_path')
+
+class ReaderPool:
+    """只读查询使用的连接池，每个连接同一时间只被一个请求线程使用"""
+    
+    def __init__(self, db_name, size=4):
+        self._connections = queue.Queue()
+        for _ in range(size):
+            self._connections.put(DakaDatabase(db_name, check_same_thread=False))
+    
+    @contextmanager
+    def acquire(self):
+        """取出一个连接，并在一个读事务中使用它（同一请求内看到的数据与版本号一致）"""
+        db = self._connections.get()
+        try:
+            db.conn.execute('BEGIN')
+            try:
+                yield db
+            finally:
+                db.conn.rollback()
+        finally:
+            self._connections.put(db)
+    
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get().close()
+
+def _record_to_dict(record):
+    return dict(zip(RECORD_FIELDS, record))
+
+def _summary_to_list(rows):
+    return [{'name': name, 'count': count, 'average': average} for name, count, average in rows]
+
+def _stats_summary(db, query):
+    return {
+        'restaurants': _summary_to_list(db.get_restaurant_score_summary()),
+        'types': _summary_to_list(db.get_type_summary()),
+    }
+
+def _stats_daily(db, query):
+    start = query.get('start', '0000-01-01')
+    end = query.get('end', '9999-12-31')
+    return [{'day': day, 'count': count, 'average': average}
+            for day, (count, average) in sorted(db.get_daily_stats(start, end).items())]
+
+def _stats_histogram(db, query):
+    distribution = get_score_distribution(db, float(query.get('bin_width', 1.0)),
+                                          query.get('name'), query.get('type'))
+    return [{'bin': label, 'count': count, 'percentage': percentage, 'cumulative': cumulative}
+            for label, count, percentage, cumulative in distribution]
+
+def _stats_percentiles(db, query):
+    group_by = query.get('group_by', 'name')
+    if group_by not in ('name', 'type'):
+        raise ValueError(f"group_by 只能是 name 或 type: {group_by}")
+    rows = get_percentile_summary(db, group_by, int(query.get('min_count', 1)))
+    return [{'name': name, 'count': count, 'median': median, 'p90': p90} for name, count, median, p90 in rows]
+
+def _stats_top(db, query):
+    # 按汇总表排名，不读取全部记录
+    top = get_top_restaurants_from_summary(db.get_restaurant_stats(query.get('type')), int(query.get('limit', 5)),
+                                           prior_weight=float(query.get('prior_weight', 0)))
+    return [{'name': name, 'score': score} for name, score, _ in top]
+
+def _types(db, query):
+    return sorted(db.get_type_names().values())
+
+# 结果按数据版本缓存的只读接口
+_CACHED_ROUTES = {
+    '/types': _types,
+    '/stats/summary': _stats_summary,
+    '/stats/daily': _stats_daily,
+    '/stats/histogram': _stats_histogram,
+    '/stats/percentiles': _stats_percentiles,
+    '/stats/top': _stats_top,
+}
+
+class DakaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和分块分多次写出，关闭 Nagle 算法避免每个请求多等一次延迟确认（约 40ms）
+    disable_nagle_algorithm = True
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+    
+    def _parse(self):
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        return parts.path.rstrip('/') or '/', query
+    
+    def _send_json(self, status, data, etag=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_error(self, status, message):
+        self._send_json(status, {'error': message})
+    
+    def _not_modified(self, etag):
+        """客户端缓存的版本仍然有效时返回 304"""
+        if self.headers.get('If-None-Match') != etag:
+            return False
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return True
+    
+    def do_GET(self):
+        path, query = self._parse()
+        try:
+            with self.server.readers.acquire() as db:
+                version = db.get_data_version()
+                etag = f'"{version}"'
+                if path == '/version':
+                    self._send_json(200, {'version': version}, etag)
+                elif path == '/records':
+                    if not self._not_modified(etag):
+                        self._stream_records(db, query, version, etag)
+                elif path in _CACHED_ROUTES:
+                    if not self._not_modified(etag):
+                        data = self.server.cached(version, path, query, lambda: _CACHED_ROUTES[path](db, query))
+                        self._send_json(200, data, etag)
+                else:
+                    self._send_error(404, f"未知的接口: {path}")
+        except ValueError as e:
+            self._send_error(400, str(e))
+        except Exception as e:
+            print(f"处理请求失败: {e}")
+            self._send_error(500, str(e))
+    
+    def _stream_records(self, db, query, version, etag):
+        """分块传输一页记录，不需要先在内存中拼出完整的响应"""
+        limit = int(query.get('limit', DEFAULT_PAGE_SIZE))
+        if limit < 1:
+            raise ValueError(f"limit 必须大于 0: {limit}")
+        limit = min(limit, MAX_PAGE_SIZE)
+        after = None
+        if query.get('after'):
+            after_date, _, after_id = query['after'].rpartition('_')
+            after = (after_date, int(after_id))
+        cursor = db.iter_records_page(limit, after, query.get('q'), query.get('name'), query.get('type'),
+                                      query.get('start'), query.get('end'))
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        
+        # 响应头和部分内容发出之后出错时不能再发送错误响应：
+        # 不写结束块并关闭连接，客户端会发现响应不完整
+        try:
+            self._write_chunk(f'{{"version":{version},"records":[')
+            count = 0
+            last = None
+            while True:
+                rows = cursor.fetchmany(STREAM_CHUNK_ROWS)
+                if not rows:
+                    break
+                text = ','.join(json.dumps(_record_to_dict(row), ensure_ascii=False) for row in rows)
+                self._write_chunk(text if count == 0 else ',' + text)
+                count += len(rows)
+                last = rows[-1]
+            # 返回满一页时给出下一页的游标
+            next_cursor = f"{last[3]}_{last[0]}" if last is not None and count == limit else None
+            self._write_chunk(f'],"next":{json.dumps(next_cursor)}}}')
+            self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            print(f"传输记录失败: {e}")
+            self.close_connection = True
+    
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b'\r\n')
+    
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+    
+    def do_POST(self):
+        path, _ = self._parse()
+        if path != '/records':
+            self._send_error(404, f"未知的接口: {path}")
+            return
+        try:
+            data = self._read_json()
+            record = (data['name'], data['type'], data['date'], float(data['score']),
+                      data.get('comment', ''), data.get('image_path'))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_error(400, f"记录格式错误: {e}")
+            return
+        
+        with self.server.write_lock:
+            ok = self.server.writer.add_record(*record)
+            version = self.server.writer.get_data_version()
+        if ok:
+            self._send_json(201, {'version': version})
+        else:
+            self._send_error(500, "添加记录失败")
+    
+    def do_DELETE(self):
+        path, _ = self._parse()
+        prefix, _, record_id = path.rpartition('/')
+        if prefix != '/records' or not record_id.isdigit():
+            self._send_error(404, f"未知的接口: {path}")
+            return
+        
+        with self.server.write_lock:
+            batch_id = self.server.writer.delete_records([int(record_id)])
+            version = self.server.writer.get_data_version()
+        if batch_id is None:
+            self._send_error(404, f"记录不存在: {record_id}")
+        else:
+            self._send_json(200, {'version': version, 'batch_id': batch_id})
+
+class DakaAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    
+    def __init__(self, address, db_name='daka_records.db', pool_size=4, verbose=False):
+        self.db_name = db_name
+        self.verbose = verbose
+        self.writer = DakaDatabase(db_name, check_same_thread=False)
+        self.writer.cursor.execute('PRAGMA journal_mode = WAL').fetchone()
+        self.write_lock = threading.Lock()
+        self.readers = ReaderPool(db_name, pool_size)
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        super().__init__(address, DakaRequestHandler)
+    
+    def cached(self, version, path, query, compute):
+        """按 (接口, 参数) 缓存结果，数据版本变化后重新计算"""
+        key = (path, tuple(sorted(query.items())))
+        with self._cache_lock:
+            entry = self._cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        
+        data = compute()
+        with self._cache_lock:
+            # 旧版本的结果不会再被使用
+            if any(cached_version != version for cached_version, _ in self._cache.values()):
+                self._cache = {k: v for k, v in self._cache.items() if v[0] == version}
+            self._cache[key] = (version, data)
+        return data
+    
+    def server_close(self):
+        super().server_close()
+        self.readers.close()
+        self.writer.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="餐厅打卡数据库的本地 HTTP/JSON 接口")
+    parser.add_argument("--db", default="daka_records.db", help="数据库文件")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--pool-size", type=int, default=4, help="读连接池大小")
+    parser.add_argument("--verbose", action="store_true", help="输出每个请求的日志")
+    args = parser.parse_args(argv)
+    
+    server = DakaAPIServer((args.host, args.port), args.db, args.pool_size, args.verbose)
+    print(f"服务已启动: http://{args.host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+# 命令行：python api_server.py [--db 数据库文件] [--port 8765]
+if __name__ == "__main__":
+    raise SystemExit(main())
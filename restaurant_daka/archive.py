@@ -0,0 +1,284 @@
+"""
+按年份归档
+把早于截止日期的记录移入每年一个的 SQLite 文件（与主数据库放在同一目录），
+主数据库只保留近期的记录，日常的查询和 ORDER BY date DESC 只扫描这部分数据。
+按日期范围查询时，DakaDatabase 会自动附加与范围重叠的归档文件并 UNION 查询。
+
+归档和合并都在一个事务中完成（主数据库和归档文件通过 ATTACH 一起提交）。
+删除 / 插入记录时触发器会修改 daily_rollups、daily_stats、restaurant_stats 和 type_stats，
+这里再做一次反向补偿，让这些汇总表始终包含全部历史，日历热力图、趋势统计和报表不受归档影响。
+应在程序没有运行时执行。
+"""
+import argparse
+import os
+import sqlite3
+from datetime import date, timedelta
+from database import DakaDatabase, record_fingerprint
+
+_ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS archive.records (
+        id INTEGER PRIMARY KEY,
+        restaurant_id INTEGER NOT NULL,
+        type_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        score REAL NOT NULL,
+        comment TEXT,
+        image_path TEXT,
+        uuid TEXT,
+        fingerprint TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_records_date ON records (date)',
+    # 分组视图按餐厅分页读取归档的记录
+    'CREATE INDEX IF NOT EXISTS archive.idx_records_restaurant ON records (restaurant_id, date, id)',
+]
+
+# 归档记录的餐厅：归档之后被合并为别名的换成规范餐厅
+_CANONICAL_ID = '''IFNULL(
+    (SELECT canonical_id FROM main.restaurant_aliases WHERE alias_id = archive.records.restaurant_id),
+    archive.records.restaurant_id)'''
+
+# 把 temp.moving 中的记录在汇总表中的量加回（sign = 1，归档）或减去（sign = -1，合并）
+# executescript 会先提交当前事务，所以这里逐条执行
+_COMPENSATE_SQL = [
+    '''
+    INSERT INTO main.daily_rollups (day, restaurant_id, type_id, count, total_score)
+    SELECT date, restaurant_id, type_id, :sign * COUNT(*), :sign * SUM(score)
+    FROM temp.moving WHERE true
+    GROUP BY date, restaurant_id, type_id
+    ON CONFLICT (day, restaurant_id, type_id) DO UPDATE
+    SET count = count + excluded.count, total_score = total_score + excluded.total_score
+    ''',
+    'DELETE FROM main.daily_rollups WHERE count <= 0',
+    '''
+    INSERT INTO main.daily_stats (day, count, total_score)
+    SELECT date, :sign * COUNT(*), :sign * SUM(score)
+    FROM temp.moving WHERE true
+    GROUP BY date
+    ON CONFLICT (day) DO UPDATE
+    SET count = count + excluded.count, total_score = total_score + excluded.total_score
+    ''',
+    'DELETE FROM main.daily_stats WHERE count <= 0',
+    '''
+    INSERT INTO main.restaurant_stats (restaurant_id, count, total_score)
+    SELECT restaurant_id, :sign * COUNT(*), :sign * SUM(score)
+    FROM temp.moving WHERE true
+    GROUP BY restaurant_id
+    ON CONFLICT (restaurant_id) DO UPDATE
+    SET count = count + excluded.count, total_score = total_score + excluded.total_score
+    ''',
+    'DELETE FROM main.restaurant_stats WHERE count <= 0',
+    '''
+    INSERT INTO main.type_stats (type_id, count, total_score)
+    SELECT type_id, :sign * COUNT(*), :sign * SUM(score)
+    FROM temp.moving WHERE true
+    GROUP BY type_id
+    ON CONFLICT (type_id) DO UPDATE
+    SET count = count + excluded.count, total_score = total_score + excluded.total_score
+    ''',
+    'DELETE FROM main.type_stats WHERE count <= 0',
+]
+
+def _archive_file_name(db_name, year):
+    """归档文件名，例如 daka_records_2021.db"""
+    stem = os.path.splitext(os.path.basename(db_name))[0]
+    return f"{stem}_{year}.db"
+
+def _connect(db_name):
+    """打开主数据库（先确保表结构是最新的），使用显式事务"""
+    DakaDatabase(db_name).close()
+    return sqlite3.connect(db_name, isolation_level=None)
+
+def _compensate(conn, sign):
+    """补偿触发器对汇总表的修改"""
+    for statement in _COMPENSATE_SQL:
+        conn.execute(statement, {'sign': sign})
+
+def _add_missing_columns(conn):
+    """较早的归档文件没有 uuid、fingerprint 列时补上"""
+    columns = [row[1] for row in conn.execute('PRAGMA archive.table_info(records)')]
+    for column in ('uuid', 'fingerprint'):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE archive.records ADD COLUMN {column} TEXT')
+
+def _fill_fingerprints(conn):
+    """
+    为没有指纹的归档记录，以及餐厅在归档之后被合并为别名的记录，
+    按规范餐厅名称计算指纹（与 DakaDatabase 添加记录时相同）
+    """
+    rows = conn.execute(f'''
+        SELECT archive.records.id, restaurants.name, types.name, archive.records.date, archive.records.score,
+               archive.records.comment, archive.records.image_path
+        FROM archive.records
+        JOIN main.restaurants ON restaurants.id = {_CANONICAL_ID}
+        JOIN main.types ON types.id = archive.records.type_id
+        WHERE archive.records.fingerprint IS NULL
+           OR archive.records.restaurant_id IN (SELECT alias_id FROM main.restaurant_aliases)
+    ''').fetchall()
+    conn.executemany('UPDATE archive.records SET fingerprint = ? WHERE id = ?',
+                     [(record_fingerprint(*content), record_id) for record_id, *content in rows])
+
+def list_archives(db_name):
+    """获取归档列表 [(年份, 文件, 记录数, 最早日期, 最晚日期), ...]"""
+    conn = _connect(db_name)
+    try:
+        return conn.execute(
+            'SELECT year, path, record_count, min_date, max_date FROM archives ORDER BY year'
+        ).fetchall()
+    finally:
+        conn.close()
+
+def archive_records(db_name, cutoff_date, progress=None):
+    """
+    把 cutoff_date 之前的记录按年份移入归档文件，已有的归档文件会继续追加
+    progress(年份, 记录数) 在每个年份完成后调用，返回 {年份: 移动的记录数}
+    """
+    db_dir = os.path.dirname(os.path.abspath(db_name))
+    conn = _connect(db_name)
+    moved = {}
+    try:
+        years = [int(row[0]) for row in conn.execute(
+            'SELECT DISTINCT substr(date, 1, 4) FROM records WHERE date < ? ORDER BY 1', (cutoff_date,))]
+        
+        for year in years:
+            file_name = _archive_file_name(db_name, year)
+            conn.execute('ATTACH DATABASE ? AS archive', (os.path.join(db_dir, file_name),))
+            try:
+                for statement in _ARCHIVE_SCHEMA:
+                    conn.execute(statement)
+                _add_missing_columns(conn)
+                
+                conn.execute('BEGIN')
+                conn.execute('''
+                    CREATE TEMP TABLE moving AS
+                    SELECT id, restaurant_id, type_id, date, score FROM main.records
+                    WHERE date < ? AND date >= ? AND date < ?
+                ''', (cutoff_date, f"{year}-01-01", f"{year + 1}-01-01"))
+                conn.execute('''
+                    INSERT INTO archive.records
+                        (id, restaurant_id, type_id, date, score, comment, image_path, uuid, fingerprint)
+                    SELECT id, restaurant_id, type_id, date, score, comment, image_path, uuid, fingerprint
+                    FROM main.records WHERE id IN (SELECT id FROM temp.moving)
+                ''')
+                # 主数据库保留归档记录的指纹，之后添加内容相同的记录时不再插入
+                conn.execute('''
+                    INSERT OR IGNORE INTO main.archived_fingerprints (fingerprint, year, id)
+                    SELECT fingerprint, ?, id FROM main.records
+                    WHERE id IN (SELECT id FROM temp.moving) AND fingerprint IS NOT NULL
+                ''', (year,))
+                count = conn.execute('DELETE FROM main.records WHERE id IN (SELECT id FROM temp.moving)').rowcount
+                # 删除触发器减掉了这些记录，加回来
+                _compensate(conn, 1)
+                conn.execute('''
+                    INSERT OR REPLACE INTO main.archives (year, path, record_count, min_date, max_date)
+                    SELECT ?, ?, COUNT(*), MIN(date), MAX(date) FROM archive.records
+                ''', (year, file_name))
+                conn.execute('DROP TABLE temp.moving')
+                conn.execute('COMMIT')
+                moved[year] = count
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            finally:
+                conn.execute('DETACH DATABASE archive')
+            
+            if progress:
+                progress(year, count)
+    except Exception as e:
+        print(f"归档记录失败: {e}")
+    finally:
+        conn.close()
+    return moved
+
+def merge_archives(db_name, years=None, progress=None):
+    """
+    把归档文件中的记录合并回主数据库并删除归档文件
+    years 为 None 时合并全部归档，返回 {年份: 合并的记录数}
+    """
+    db_dir = os.path.dirname(os.path.abspath(db_name))
+    conn = _connect(db_name)
+    merged = {}
+    try:
+        archives = conn.execute('SELECT year, path FROM archives ORDER BY year').fetchall()
+        
+        for year, path in archives:
+            if years is not None and year not in years:
+                continue
+            if not os.path.isabs(path):
+                path = os.path.join(db_dir, path)
+            
+            conn.execute('ATTACH DATABASE ? AS archive', (path,))
+            try:
+                _add_missing_columns(conn)
+                conn.execute('BEGIN')
+                _fill_fingerprints(conn)
+                # 归档之后被合并为别名的餐厅换成规范餐厅（汇总表中已经记在规范餐厅下）
+                conn.execute(f'''
+                    CREATE TEMP TABLE moving AS
+                    SELECT id, {_CANONICAL_ID} AS restaurant_id, type_id, date, score FROM archive.records
+                ''')
+                # 归档之后又添加了内容相同的记录时保留主数据库中的那一条
+                count = conn.execute(f'''
+                    INSERT INTO main.records
+                        (id, restaurant_id, type_id, date, score, comment, image_path, uuid, fingerprint)
+                    SELECT id, {_CANONICAL_ID}, type_id, date, score, comment, image_path, uuid, fingerprint
+                    FROM archive.records WHERE true
+                    ON CONFLICT (fingerprint) DO NOTHING
+                ''').rowcount
+                # 插入触发器加上了合并回来的记录，汇总表中的归档部分全部减去（没有插入的重复记录不再计入）
+                _compensate(conn, -1)
+                conn.execute('DELETE FROM main.archives WHERE year = ?', (year,))
+                conn.execute('DELETE FROM main.archived_fingerprints WHERE year = ?', (year,))
+                conn.execute('DROP TABLE temp.moving')
+                conn.execute('COMMIT')
+                merged[year] = count
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            finally:
+                conn.execute('DETACH DATABASE archive')
+            
+            os.remove(path)
+            if progress:
+                progress(year, count)
+    except Exception as e:
+        print(f"合并归档失败: {e}")
+    finally:
+        conn.close()
+    return merged
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按年份归档打卡记录")
+    parser.add_argument("--db", default="daka_records.db", help="数据库文件")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    archive_parser = subparsers.add_parser("archive", help="把旧记录移入按年份划分的归档文件")
+    cutoff = archive_parser.add_mutually_exclusive_group(required=True)
+    cutoff.add_argument("--before", help="归档该日期（YYYY-MM-DD）之前的记录")
+    cutoff.add_argument("--keep-days", type=int, help="只在主数据库中保留最近多少天的记录")
+    
+    merge_parser = subparsers.add_parser("merge", help="把归档文件合并回主数据库")
+    merge_parser.add_argument("--year", type=int, action="append", help="只合并指定年份（可重复），默认全部")
+    
+    subparsers.add_parser("list", help="列出归档文件")
+    args = parser.parse_args(argv)
+    
+    if args.command == "archive":
+        cutoff_date = args.before or (date.today() - timedelta(days=args.keep_days)).strftime("%Y-%m-%d")
+        print(f"归档 {cutoff_date} 之前的记录...")
+        moved = archive_records(args.db, cutoff_date, lambda year, count: print(f"  {year}: {count} 条"))
+        print(f"共归档 {sum(moved.values())} 条记录")
+    elif args.command == "merge":
+        merged = merge_archives(args.db, args.year, lambda year, count: print(f"  {year}: {count} 条"))
+        print(f"共合并 {sum(merged.values())} 条记录")
+    else:
+        for year, path, count, min_date, max_date in list_archives(args.db):
+            print(f"{year}  {path}  {count} 条  {min_date} ~ {max_date}")
+    return 0
+
+# 命令行：python archive.py [--db 数据库文件] archive --before 2024-01-01 | merge [--year 2021] | list
+if __name__ == "__main__":
+    raise SystemExit(main())
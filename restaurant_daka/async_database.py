@@ -0,0 +1,216 @@
+"""
+DakaDatabase 的 asyncio 接口
+阻塞的数据库调用放到专用的线程池中执行，不会卡住事件循环：
+读操作由若干读线程执行（每个线程有自己的连接），写操作由唯一的写线程按提交顺序执行。
+同一时刻有多个协程等待 add_record 时，这些记录合并为一次 add_records，只提交一次事务；
+整批失败时逐条重新写入，只有出错的记录返回失败。
+"""
+import asyncio
+import functools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database import DakaDatabase
+
+# 在写线程中执行的方法（add_record 单独处理，会合并为批量写入）
+_WRITE_METHODS = (
+    'add_records', 'delete_record', 'delete_records', 'restore_deleted', 'purge_deleted',
+    'apply_changes', 'set_peer_mark', 'merge_restaurants', 'set_export_mark',
+)
+
+# 在读线程中执行的方法，返回游标的方法会在读线程中取出全部结果
+_READ_METHODS = (
+    'get_all_records', 'search_by_name', 'filter_by_type', 'get_records_sorted_by_score',
+    'get_records_by_date_range', 'get_records_by_restaurant', 'get_data_version', 'iter_records_page',
+    'get_restaurant_names', 'get_type_names', 'iter_record_keys', 'iter_record_details',
+    'get_restaurant_score_summary', 'get_type_summary', 'get_score_histogram', 'get_score_percentiles',
+    'get_visit_percentiles', 'get_date_bounds', 'get_daily_stats', 'get_checkin_series',
+    'get_rolling_average_series', 'get_type_mix_series', 'get_node_id', 'get_changes_since', 'get_peer_mark',
+    'get_restaurant_aliases', 'get_change_seq', 'get_export_mark', 'get_restaurant_stats',
+    'get_export_marks', 'get_type_stats', 'find_duplicate', 'get_records_ordered', 'iter_records_export',
+)
+
+def _resolve(future, result):
+    """把写入结果（或异常）交给等待的协程"""
+    if future.done():
+        return
+    if isinstance(result, Exception):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+
+class AsyncDakaDatabase:
+    """
+    用法：
+        async with AsyncDakaDatabase('daka_records.db') as db:
+            await db.add_record(...)
+            records = await db.search_by_name('火锅')
+            async for record in db.iter_records(type_='火锅'):
+                ...
+    """
+    
+    def __init__(self, db_name='daka_records.db', readers=2):
+        self.db_name = db_name
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # 线程在第一次提交任务时才创建，连接在各自的线程中打开
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="DakaWriter", initializer=self._open_connection,
+                                          initargs=(True,))
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix="DakaReader",
+                                           initializer=self._open_connection, initargs=(False,))
+        self._pending = []       # 等待写入的 (记录, Future)
+        self._flush_task = None  # 正在写入的批次
+    
+    def _open_connection(self, writer):
+        db = DakaDatabase(self.db_name, check_same_thread=False)
+        if writer:
+            # WAL 模式下读线程不会阻塞写线程
+            db.cursor.execute('PRAGMA journal_mode = WAL').fetchone()
+        self._local.db = db
+        with self._connections_lock:
+            self._connections.append(db)
+    
+    def _call(self, name, args, kwargs):
+        """在线程池的线程中调用本线程连接上的方法"""
+        result = getattr(self._local.db, name)(*args, **kwargs)
+        if isinstance(result, sqlite3.Cursor):
+            result = result.fetchall()
+        return result
+    
+    async def _run(self, executor, name, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(self._call, name, args, kwargs))
+    
+    async def _run_write(self, name, *args, **kwargs):
+        # 先写入此前排队的 add_record，保持写操作的先后顺序
+        await self._wait_pending()
+        return await self._run(self._writer, name, *args, **kwargs)
+    
+    async def add_record(self, name, type_, date, score, comment, image_path=None):
+        """
+        添加新的打卡记录，事务提交后返回 True
+        写线程忙碌期间到达的记录会排队，下一次合并为一个事务写入
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((name, type_, date, score, comment, image_path), future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_pending())
+        return await future
+    
+    async def _flush_pending(self):
+        # 让同一轮事件循环中的其他 add_record 也加入本批
+        await asyncio.sleep(0)
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                result = await self._run(self._writer, 'add_records', [record for record, _ in batch])
+            except Exception as e:
+                result = e
+            if result is not True and len(batch) > 1:
+                # 整批失败（事务已回滚）时逐条重新写入，只有出错的记录得到失败的结果
+                for record, future in batch:
+                    try:
+                        result = await self._run(self._writer, 'add_record', *record)
+                    except Exception as e:
+                        result = e
+                    _resolve(future, result)
+                continue
+            for _, future in batch:
+                _resolve(future, result)
+    
+    async def _wait_pending(self):
+        while self._flush_task is not None and not self._flush_task.done():
+            await asyncio.shield(self._flush_task)
+    
+    async def flush(self):
+        """等待已提交的写操作全部完成"""
+        await self._wait_pending()
+        return await self._run(self._writer, 'flush')
+    
+    async def iter_records(self, batch_size=500, keyword=None, restaurant_name=None, type_=None,
+                           start_date=None, end_date=None):
+        """
+        异步逐条遍历记录（按日期从新到旧），每次只从数据库读取一页
+        参数与 DakaDatabase.iter_records_page 的筛选条件相同
+        """
+        after = None
+        while True:
+            page = await self._run(self._readers, 'iter_records_page', batch_size, after, keyword,
+                                   restaurant_name, type_, start_date, end_date)
+            for record in page:
+                yield record
+            if len(page) < batch_size:
+                return
+            after = (page[-1][3], page[-1][0])
+    
+    async def close(self):
+        """写入剩余的记录，停止线程池并关闭所有连接"""
+        await self._wait_pending()
+        self._writer.shutdown()
+        self._readers.shutdown()
+        with self._connections_lock:
+            for db in self._connections:
+                db.close()
+            self._connections = []
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+def _write_method(name):
+    async def method(self, *args, **kwargs):
+        return await self._run_write(name, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = getattr(DakaDatabase, name).__doc__
+    return method
+
+def _read_method(name):
+    async def method(self, *args, **kwargs):
+        return await self._run(self._readers, name, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = getattr(DakaDatabase, name).__doc__
+    return method
+
+for _name in _WRITE_METHODS:
+    setattr(AsyncDakaDatabase, _name, _write_method(_name))
+for _name in _READ_METHODS:
+    setattr(AsyncDakaDatabase, _name, _read_method(_name))
+
+# 并发写入测试：python async_database.py [协程数]
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+    import time
+    
+    async def demo(db_path, count):
+        async with AsyncDakaDatabase(db_path) as db:
+            start = time.perf_counter()
+            results = await asyncio.gather(*(
+                db.add_record(f"餐厅{i % 100}", "火锅", f"2024-01-{i % 28 + 1:02d}", i % 11, f"并发{i}")
+                for i in range(count)
+            ))
+            elapsed = time.perf_counter() - start
+            print(f"{count} 个协程并发 add_record: {elapsed:.3f}s, 全部成功: {all(results)}")
+            
+            # 写入期间事件循环不被阻塞
+            ticks = 0
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.001)
+                    ticks += 1
+            task = asyncio.ensure_future(ticker())
+            records = await db.get_all_records()
+            summary = await db.get_restaurant_score_summary()
+            streamed = [record async for record in db.iter_records(batch_size=128)]
+            task.cancel()
+            print(f"读取 {len(records)} 条记录, {len(summary)} 家餐厅, 期间事件循环运行了 {ticks} 次")
+            print(f"异步遍历结果一致: {[r[0] for r in streamed] == [r[0] for r in await db.iter_records_page(count)]}")
+    
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(demo(os.path.join(tmp, "async.db"), count))
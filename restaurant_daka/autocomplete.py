@@ -0,0 +1,145 @@
+"""
+餐厅名称和类型的前缀自动补全
+PrefixIndex 是一棵前缀树，每个节点保存以该前缀开头、打卡次数最多的 TOP_K 个候选，
+输入每个字符时只需沿前缀走到对应节点并取出前 k 个，耗时为 O(前缀长度 + k)，与名称总数无关。
+索引从数据库建立一次，之后随添加/删除记录增量更新。
+"""
+import bisect
+
+# 每个节点保存的候选数（查询的 k 不能超过它）
+TOP_K = 10
+
+# 添加记录对话框中默认提供的餐厅类型
+DEFAULT_TYPES = ('火锅', '川菜', '粤菜', '湘菜', '鲁菜', '西餐', '日料', '韩餐', '快餐', '小吃', '其他')
+
+class _Node:
+    __slots__ = ('children', 'names', 'top')
+    
+    def __init__(self):
+        self.children = {}
+        self.names = set()  # 正好在该节点结束的名称
+        self.top = []       # [(-次数, 名称), ...]，按次数从多到少、名称排序
+
+class PrefixIndex:
+    """按前缀补全的候选索引，候选按次数从多到少排序（英文不区分大小写）"""
+    
+    def __init__(self, counts=(), keep=()):
+        """keep 中的名称次数减到 0 时仍然保留（例如默认的餐厅类型）"""
+        self._root = _Node()
+        self._counts = {}  # 名称 -> 次数
+        self._keep = frozenset(keep)
+        for name, count in counts:
+            self.add(name, count)
+    
+    def __len__(self):
+        return len(self._counts)
+    
+    def __contains__(self, name):
+        return name in self._counts
+    
+    def count(self, name):
+        return self._counts.get(name, 0)
+    
+    def _path(self, name):
+        """从根节点到名称末尾节点的路径（不存在的节点会被创建）"""
+        node = self._root
+        path = [node]
+        for char in name.casefold():
+            node = node.children.setdefault(char, _Node())
+            path.append(node)
+        return path
+    
+    def add(self, name, count=1):
+        """名称的次数增加 count（新名称时创建，count 可以为 0）"""
+        if count < 0:
+            self.remove(name, -count)
+            return
+        old = self._counts.get(name)
+        new = self._counts[name] = (old or 0) + count
+        entry = (-new, name)
+        path = self._path(name)
+        path[-1].names.add(name)
+        for node in path:
+            top = node.top
+            if old is not None:
+                i = bisect.bisect_left(top, (-old, name))
+                if i < len(top) and top[i][1] == name:
+                    del top[i]
+            if len(top) < TOP_K or entry < top[-1]:
+                bisect.insort(top, entry)
+                del top[TOP_K:]
+    
+    def remove(self, name, count=1):
+        """名称的次数减少 count（例如删除了记录），减到 0 时不再提供该名称（keep 中的名称除外）"""
+        old = self._counts.get(name)
+        if old is None:
+            return
+        path = self._path(name)
+        if old - count <= 0 and name not in self._keep:
+            del self._counts[name]
+            path[-1].names.discard(name)
+        else:
+            self._counts[name] = max(old - count, 0)
+        # 次数减少后，原来排在 TOP_K 之外的名称可能进入前列：
+        # 自底向上合并子节点的候选和在本节点结束的名称，重新得到路径上各节点的候选
+        for node in reversed(path):
+            entries = [entry for child in node.children.values() for entry in child.top]
+            entries.extend((-self._counts[other], other) for other in node.names)
+            node.top = sorted(entries)[:TOP_K]
+    
+    def complete(self, prefix, k=TOP_K):
+        """以 prefix 开头的前 k 个名称，按次数从多到少排序"""
+        node = self._root
+        for char in prefix.casefold():
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return [name for _, name in node.top[:k]]
+
+def restaurant_index(db):
+    """用数据库中各餐厅的打卡次数建立餐厅名称索引（已合并的别名没有记录，不会出现）"""
+    return PrefixIndex((name, count) for name, count, _ in db.get_restaurant_score_summary())
+
+def type_index(db):
+    """用数据库中各类型的打卡次数建立类型索引，默认类型即使没有记录也会提供"""
+    index = PrefixIndex(((name, count) for name, count, _ in db.get_type_summary()), keep=DEFAULT_TYPES)
+    for type_ in DEFAULT_TYPES:
+        index.add(type_, 0)
+    return index
+
+def _benchmark(count):
+    """生成 count 个随机名称，测量建立索引和逐字查询的耗时"""
+    import random
+    import time
+    
+    chars = "海底捞火锅小四川湘菜馆老北京烤鸭店麻辣香锅串串面馆饺子王家李记张氏重庆成都广州深圳上海杭州"
+    random.seed(1)
+    counts = {}
+    for _ in range(count):
+        name = ''.join(random.choice(chars) for _ in range(random.randint(2, 8)))
+        counts[name] = random.randint(1, 100)
+    
+    start = time.perf_counter()
+    index = PrefixIndex(counts.items())
+    build = time.perf_counter() - start
+    
+    queries = random.sample(sorted(counts), 200)
+    keystrokes = 0
+    start = time.perf_counter()
+    for query in queries:
+        for i in range(1, len(query) + 1):
+            index.complete(query[:i])
+            keystrokes += 1
+    per_key = (time.perf_counter() - start) / keystrokes
+    
+    # 与扫描全部名称的结果比较
+    prefix = queries[0][:2]
+    expected = sorted((name for name in counts if name.startswith(prefix)), key=lambda name: (-counts[name], name))
+    print(f"{len(counts)} 个不同的名称：建立索引 {build:.2f}s，每次按键查询 {per_key * 1e6:.1f}µs")
+    print(f"与全量扫描结果一致: {index.complete(prefix) == expected[:TOP_K]}")
+
+# 性能测试：python autocomplete.py [名称数]
+if __name__ == "__main__":
+    import sys
+    
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
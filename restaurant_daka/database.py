@@ -1,76 +1,1137 @@
+import hashlib
+import json
+import os
 import sqlite3
-from datetime import datetime
+import time
+import uuid
+from datetime import datetime, timedelta
+from replica import ReplicaWriter
+from write_queue import GroupCommitWriter
+
+# 时间段起始日期的 SQL 表达式（周以周一为起点）
+_BUCKET_EXPRESSIONS = {
+    'day': "day",
+    'week': "date(day, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m-01', day)",
+}
+
+# 表格列 -> ORDER BY 表达式（get_records_ordered 只允许这些列）
+_ORDER_BY_COLUMNS = {
+    'id': "id",
+    'name': "name",
+    'type': "type",
+    'date': "date",
+    'score': "score",
+    'comment': "IFNULL(comment, '')",
+    'has_image': "(IFNULL(image_path, '') != '')",
+}
+
+# 百分位统计允许的分组：(records 中的外键列, 维度表)
+_PERCENTILE_GROUP_COLUMNS = {'name': ('restaurant_id', 'restaurants'), 'type': ('type_id', 'types')}
+
+# 记录表结构：餐厅名称和类型保存在维度表中，records 只保存整数键
+# records_view 还原为 (id, name, type, date, score, comment, image_path)，供查询使用
+_RECORDS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS restaurants (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    
+    CREATE TABLE IF NOT EXISTS types (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    
+    CREATE TABLE IF NOT EXISTS records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        restaurant_id INTEGER NOT NULL REFERENCES restaurants (id),
+        type_id INTEGER NOT NULL REFERENCES types (id),
+        date DATE NOT NULL,
+        score REAL NOT NULL,
+        comment TEXT,
+        image_path TEXT,
+        uuid TEXT,
+        fingerprint TEXT
+    );
+    
+    -- 全局唯一的记录标识，用于在多个数据库之间同步
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_records_uuid ON records (uuid);
+    
+    -- 按日期从新到旧分页（键集分页：WHERE (date, id) < (上一页最后一行)）
+    CREATE INDEX IF NOT EXISTS idx_records_date_id ON records (date, id);
+    
+    -- 按评分排序（记录表格按评分列排序时使用）
+    CREATE INDEX IF NOT EXISTS idx_records_score ON records (score, id);
+    
+    -- 分区内按评分排序的索引，供窗口函数和分布统计使用
+    CREATE INDEX IF NOT EXISTS idx_records_restaurant_score ON records (restaurant_id, score);
+    CREATE INDEX IF NOT EXISTS idx_records_type_score ON records (type_id, score);
+    
+    -- 单个餐厅的记录按日期从新到旧分页（分组视图展开餐厅时使用）
+    CREATE INDEX IF NOT EXISTS idx_records_restaurant_date ON records (restaurant_id, date, id);
+    
+    -- 合并的餐厅别名：别名的记录已经改为规范餐厅，之后用别名添加的记录也归到规范餐厅
+    CREATE TABLE IF NOT EXISTS restaurant_aliases (
+        alias_id INTEGER PRIMARY KEY REFERENCES restaurants (id),
+        canonical_id INTEGER NOT NULL REFERENCES restaurants (id),
+        merged_at REAL NOT NULL
+    );
+    
+    -- 已删除记录的墓碑，同一批删除的记录共用一个批次号，撤销时整批恢复
+    CREATE TABLE IF NOT EXISTS deleted_records (
+        id INTEGER PRIMARY KEY,
+        restaurant_id INTEGER NOT NULL,
+        type_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        score REAL NOT NULL,
+        comment TEXT,
+        image_path TEXT,
+        batch_id INTEGER NOT NULL,
+        deleted_at REAL NOT NULL,
+        uuid TEXT,
+        fingerprint TEXT
+    );
+    
+    CREATE INDEX IF NOT EXISTS idx_deleted_records_batch ON deleted_records (batch_id);
+    
+    -- 按年份归档的记录文件（路径相对于主数据库所在目录），由 archive.py 维护
+    CREATE TABLE IF NOT EXISTS archives (
+        year INTEGER PRIMARY KEY,
+        path TEXT NOT NULL,
+        record_count INTEGER NOT NULL,
+        min_date DATE,
+        max_date DATE
+    );
+    
+    -- 已归档记录的内容指纹（由 archive.py 维护），与已归档记录内容相同的记录也不再添加
+    CREATE TABLE IF NOT EXISTS archived_fingerprints (
+        fingerprint TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        id INTEGER NOT NULL,
+        PRIMARY KEY (fingerprint, year)
+    ) WITHOUT ROWID;
+    
+    CREATE INDEX IF NOT EXISTS idx_archived_fingerprints_year ON archived_fingerprints (year);
+    
+    -- 同步状态：本库的节点 ID 和逻辑时钟（Lamport 时钟）
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value
+    );
+    
+    INSERT OR IGNORE INTO sync_state (key, value) VALUES ('node', lower(hex(randomblob(16)))), ('clock', 0);
+    
+    -- 变更日志：每条记录只保留最新的一次变更（按 uuid 替换），seq 递增，
+    -- 同步时只需导出上次同步之后 seq 更大的行
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        uuid TEXT NOT NULL UNIQUE,
+        op TEXT NOT NULL,
+        clock INTEGER NOT NULL,
+        node TEXT NOT NULL,
+        payload TEXT
+    );
+    
+    -- 已经导出给每个同步对象的最大 seq
+    CREATE TABLE IF NOT EXISTS sync_peers (
+        peer TEXT PRIMARY KEY,
+        sent_seq INTEGER NOT NULL DEFAULT 0
+    );
+    
+    -- 增量导出（"上次导出之后" 模式）每个导出目标已经导出到的 seq
+    CREATE TABLE IF NOT EXISTS export_marks (
+        name TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL DEFAULT 0,
+        exported_at REAL
+    );
+    
+    -- 数据版本号：records 每改动一行加一，供 HTTP 接口的 ETag 和统计结果缓存判断数据是否变化
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    );
+    
+    INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0);
+    
+    CREATE TRIGGER IF NOT EXISTS records_version_insert AFTER INSERT ON records
+    BEGIN
+        UPDATE data_version SET version = version + 1 WHERE id = 1;
+    END;
+    
+    CREATE TRIGGER IF NOT EXISTS records_version_delete AFTER DELETE ON records
+    BEGIN
+        UPDATE data_version SET version = version + 1 WHERE id = 1;
+    END;
+    
+    CREATE TRIGGER IF NOT EXISTS records_version_update AFTER UPDATE ON records
+    BEGIN
+        UPDATE data_version SET version = version + 1 WHERE id = 1;
+    END;
+    
+    CREATE VIEW IF NOT EXISTS records_view AS
+    SELECT records.id, restaurants.name AS name, types.name AS type,
+           records.date, records.score, records.comment, records.image_path
+    FROM records
+    JOIN restaurants ON restaurants.id = records.restaurant_id
+    JOIN types ON types.id = records.type_id;
+'''
+
+# 按名称插入记录：先确保维度表中存在对应的行，再通过子查询取得整数键（已合并的别名取规范餐厅的键）
+_INSERT_RESTAURANT_SQL = 'INSERT OR IGNORE INTO restaurants (name) VALUES (?)'
+_INSERT_TYPE_SQL = 'INSERT OR IGNORE INTO types (name) VALUES (?)'
+_RESTAURANT_ID_SQL = '''(
+    SELECT IFNULL((SELECT canonical_id FROM restaurant_aliases WHERE alias_id = r.id), r.id)
+    FROM restaurants r WHERE r.name = ?
+)'''
+# 内容指纹相同的记录已经存在（包括已归档的记录）时不插入（重复提交、重复导入）
+_INSERT_RECORD_SQL = f'''
+    INSERT INTO records (restaurant_id, type_id, date, score, comment, image_path, uuid, fingerprint)
+    SELECT {_RESTAURANT_ID_SQL}, (SELECT id FROM types WHERE name = ?), ?, ?, ?, ?, ?, ?
+    WHERE NOT EXISTS (SELECT 1 FROM archived_fingerprints WHERE fingerprint = ?8)
+    ON CONFLICT (fingerprint) DO NOTHING
+'''
+
+# 应用同步变更：按 uuid 插入或更新记录（指纹与本地添加时一样计算，对方的图片不在本地时按路径计算）
+_UPSERT_RECORD_SQL = f'''
+    INSERT INTO records (restaurant_id, type_id, date, score, comment, image_path, uuid, fingerprint)
+    VALUES ({_RESTAURANT_ID_SQL}, (SELECT id FROM types WHERE name = ?), ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (uuid) DO UPDATE
+    SET restaurant_id = excluded.restaurant_id, type_id = excluded.type_id, date = excluded.date,
+        score = excluded.score, comment = excluded.comment, image_path = excluded.image_path,
+        fingerprint = excluded.fingerprint
+'''
+
+# 其他记录（包括已归档的记录）已经有相同的内容
+_FINGERPRINT_TAKEN_SQL = '''
+    SELECT 1 FROM records WHERE fingerprint = ? AND uuid IS NOT ?
+    UNION ALL
+    SELECT 1 FROM archived_fingerprints WHERE fingerprint = ?
+'''
+
+# 归档文件中的记录保留归档时的餐厅 ID，之后被合并为别名的餐厅在读取时换成规范餐厅
+def _canonical_restaurant_id(column):
+    return f'IFNULL((SELECT canonical_id FROM restaurant_aliases WHERE alias_id = {column}), {column})'
+
+# 按日期范围查询时每次最多同时附加的归档文件数（SQLite 默认上限为 10）
+_MAX_ATTACHED_ARCHIVES = 8
+
+# 去重迁移每批处理的记录数
+_FINGERPRINT_BATCH_SIZE = 5000
+
+# 把满足条件的记录的当前状态写入变更日志，所有行使用同一个新的时钟值
+_LOG_CHANGES_SQL = '''
+    INSERT OR REPLACE INTO change_log (uuid, op, clock, node, payload)
+    SELECT records.uuid, :op,
+           (SELECT value FROM sync_state WHERE key = 'clock'),
+           (SELECT value FROM sync_state WHERE key = 'node'),
+           CASE WHEN :op = 'delete' THEN NULL ELSE json_object(
+               'name', restaurants.name, 'type', types.name, 'date', records.date, 'score', records.score,
+               'comment', records.comment, 'image_path', records.image_path
+           ) END
+    FROM records
+    JOIN restaurants ON restaurants.id = records.restaurant_id
+    JOIN types ON types.id = records.type_id
+    WHERE {condition}
+'''
+
+def _image_digest(image_path):
+    """图片内容的哈希（每次添加都会把图片复制为新文件名，所以不能只比较路径），文件不存在时使用路径本身"""
+    if not image_path:
+        return b''
+    if os.path.isfile(image_path):
+        digest = hashlib.blake2b(digest_size=16)
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.digest()
+    return image_path.encode('utf-8')
+
+def record_fingerprint(name, type_, date, score, comment, image_path):
+    """
+    记录内容的指纹：餐厅名称、类型、日期、评分、短评和图片内容相同的记录指纹相同
+    records.fingerprint 上有唯一索引，添加记录时指纹已经存在则不插入；
+    已合并的别名按规范餐厅的名称计算，用别名和规范名称添加的相同记录指纹相同
+    """
+    content = '\x00'.join((name, type_, date, repr(float(score)), comment or '', '')).encode('utf-8')
+    return hashlib.blake2b(content + _image_digest(image_path), digest_size=16).hexdigest()
+
+def _parse_date(value):
+    """把 YYYY-MM-DD 字符串转换为 date 对象"""
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+def _bucket_start(day, granularity):
+    """计算某一天所在时间段的起始日期"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+def _iter_buckets(start_date, end_date, granularity):
+    """依次生成日期范围内每个时间段的起始日期字符串"""
+    current = _bucket_start(_parse_date(start_date), granularity)
+    end = _parse_date(end_date)
+    while current <= end:
+        yield current.strftime("%Y-%m-%d")
+        if granularity == 'month':
+            current = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+        elif granularity == 'week':
+            current += timedelta(days=7)
+        else:
+            current += timedelta(days=1)
 
 class DakaDatabase:
-    def __init__(self, db_name='daka_records.db'):
-        self.conn = sqlite3.connect(db_name)
+    def __init__(self, db_name='daka_records.db', in_memory=False, check_same_thread=True, write_queue=False):
+        """
+        check_same_thread=False 时连接可以交给其他线程使用（例如连接池），但同一时间只能由一个线程使用
+        write_queue=True 时 add_record 返回 Future，记录由后台线程分组提交（见 write_queue.py）
+        """
+        if in_memory and write_queue:
+            raise ValueError("内存副本模式不能与写入队列同时使用")
+        self.db_name = db_name
+        self.conn = sqlite3.connect(db_name, check_same_thread=check_same_thread)
         self.cursor = self.conn.cursor()
+        self.replica = None
+        self._pending_writes = []
+        # 新建的数据库使用增量 VACUUM 模式，删除记录后可以由 maintenance 逐步释放空间
+        self.cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
         self._create_table()
+        self._create_rollup_table()
+        self._create_daily_stats_table()
+        # 每家餐厅、每种类型的打卡次数和总分（分组视图和报表使用）
+        self._create_group_stats_table('restaurant_stats', 'restaurant_id')
+        self._create_group_stats_table('type_stats', 'type_id')
+        self._migrate_fingerprints()
+        self._index_archived_fingerprints()
+        
+        # 内存副本模式：启动时把磁盘数据库复制到 :memory:，所有查询都在内存中完成；
+        # 写操作先写内存，提交后由后台线程按相同的语句顺序批量写回磁盘
+        if in_memory:
+            memory_conn = sqlite3.connect(':memory:', check_same_thread=check_same_thread)
+            self.conn.backup(memory_conn)
+            self.conn.close()
+            self.conn = memory_conn
+            self.cursor = self.conn.cursor()
+            self.replica = ReplicaWriter(db_name)
+        
+        # 写入队列模式：add_record 只入队，由独立连接的后台线程分组提交
+        self.write_queue = GroupCommitWriter(db_name) if write_queue else None
     
     def _create_table(self):
-        """创建打卡记录表"""
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                type TEXT NOT NULL,
-                date DATE NOT NULL,
-                score REAL NOT NULL,
-                comment TEXT,
-                image_path TEXT
+        """创建打卡记录表以及餐厅、类型维度表"""
+        self._migrate_to_dimension_tables()
+        self._add_missing_column('records', 'uuid', 'TEXT')
+        self._add_missing_column('deleted_records', 'uuid', 'TEXT')
+        self._add_missing_column('records', 'fingerprint', 'TEXT')
+        self._add_missing_column('deleted_records', 'fingerprint', 'TEXT')
+        self.cursor.executescript(_RECORDS_SCHEMA)
+        self._backfill_sync_ids()
+        self.conn.commit()
+    
+    def _add_missing_column(self, table, column, declaration):
+        """旧数据库中已有的表缺少某一列时补上"""
+        self.cursor.execute(f'PRAGMA table_info({table})')
+        columns = [row[1] for row in self.cursor.fetchall()]
+        if columns and column not in columns:
+            self.cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+    
+    def _backfill_sync_ids(self):
+        """为旧记录生成 uuid，并写入变更日志，使它们在第一次同步时被导出"""
+        self.cursor.execute('SELECT 1 FROM records WHERE uuid IS NULL LIMIT 1')
+        if self.cursor.fetchone() is None:
+            return
+        
+        self.cursor.execute('UPDATE records SET uuid = lower(hex(randomblob(16))) WHERE uuid IS NULL')
+        self.cursor.execute('UPDATE deleted_records SET uuid = lower(hex(randomblob(16))) WHERE uuid IS NULL')
+        self.cursor.execute("UPDATE sync_state SET value = value + 1 WHERE key = 'clock'")
+        self.cursor.execute(
+            _LOG_CHANGES_SQL.format(condition='records.uuid NOT IN (SELECT uuid FROM change_log)'),
+            {'op': 'upsert'}
+        )
+    
+    def _migrate_to_dimension_tables(self):
+        """
+        把旧版 records 表（每行保存完整的餐厅名称和类型字符串）迁移为
+        restaurants / types 维度表加整数外键的结构，记录 ID 保持不变
+        """
+        self.cursor.execute('PRAGMA table_info(records)')
+        columns = [row[1] for row in self.cursor.fetchall()]
+        if 'name' not in columns:
+            return
+        
+        try:
+            self.cursor.executescript(f'''
+                BEGIN;
+                
+                -- 旧的汇总触发器引用了名称列，迁移后重新创建
+                DROP TRIGGER IF EXISTS records_rollup_insert;
+                DROP TRIGGER IF EXISTS records_rollup_delete;
+                DROP TRIGGER IF EXISTS records_rollup_update;
+                DROP TRIGGER IF EXISTS records_daily_stats_insert;
+                DROP TRIGGER IF EXISTS records_daily_stats_delete;
+                DROP TRIGGER IF EXISTS records_daily_stats_update;
+                DROP TABLE IF EXISTS daily_rollups;
+                DROP INDEX IF EXISTS idx_records_name_score;
+                DROP INDEX IF EXISTS idx_records_type_score;
+                
+                ALTER TABLE records RENAME TO records_legacy;
+                
+                {_RECORDS_SCHEMA}
+                
+                INSERT OR IGNORE INTO restaurants (name) SELECT name FROM records_legacy ORDER BY id;
+                INSERT OR IGNORE INTO types (name) SELECT type FROM records_legacy ORDER BY id;
+                
+                INSERT INTO records (id, restaurant_id, type_id, date, score, comment, image_path)
+                SELECT l.id, r.id, t.id, l.date, l.score, l.comment, l.image_path
+                FROM records_legacy l
+                JOIN restaurants r ON r.name = l.name
+                JOIN types t ON t.name = l.type
+                ORDER BY l.id;
+                
+                -- 保留自增序列，已删除记录的 ID 不会被重新使用
+                UPDATE sqlite_sequence
+                SET seq = MAX(seq, IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'records_legacy'), 0))
+                WHERE name = 'records';
+                
+                DROP TABLE records_legacy;
+                
+                COMMIT;
+            ''')
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def _create_rollup_table(self):
+        """创建按天汇总的统计表，由触发器随 records 的增删改增量维护"""
+        self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_rollups'"
+        )
+        exists = self.cursor.fetchone() is not None
+        
+        self.cursor.executescript('''
+            CREATE TABLE IF NOT EXISTS daily_rollups (
+                day DATE NOT NULL,
+                restaurant_id INTEGER NOT NULL,
+                type_id INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                total_score REAL NOT NULL,
+                PRIMARY KEY (day, restaurant_id, type_id)
+            ) WITHOUT ROWID;
+            
+            CREATE INDEX IF NOT EXISTS idx_daily_rollups_restaurant ON daily_rollups (restaurant_id, day);
+            CREATE INDEX IF NOT EXISTS idx_daily_rollups_type ON daily_rollups (type_id, day);
+            
+            CREATE TRIGGER IF NOT EXISTS records_rollup_insert AFTER INSERT ON records
+            BEGIN
+                INSERT INTO daily_rollups (day, restaurant_id, type_id, count, total_score)
+                VALUES (NEW.date, NEW.restaurant_id, NEW.type_id, 1, NEW.score)
+                ON CONFLICT (day, restaurant_id, type_id) DO UPDATE
+                SET count = count + 1, total_score = total_score + excluded.total_score;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS records_rollup_delete AFTER DELETE ON records
+            BEGIN
+                UPDATE daily_rollups SET count = count - 1, total_score = total_score - OLD.score
+                WHERE day = OLD.date AND restaurant_id = OLD.restaurant_id AND type_id = OLD.type_id;
+                DELETE FROM daily_rollups
+                WHERE day = OLD.date AND restaurant_id = OLD.restaurant_id AND type_id = OLD.type_id AND count <= 0;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS records_rollup_update
+            AFTER UPDATE OF restaurant_id, type_id, date, score ON records
+            BEGIN
+                UPDATE daily_rollups SET count = count - 1, total_score = total_score - OLD.score
+                WHERE day = OLD.date AND restaurant_id = OLD.restaurant_id AND type_id = OLD.type_id;
+                DELETE FROM daily_rollups
+                WHERE day = OLD.date AND restaurant_id = OLD.restaurant_id AND type_id = OLD.type_id AND count <= 0;
+                INSERT INTO daily_rollups (day, restaurant_id, type_id, count, total_score)
+                VALUES (NEW.date, NEW.restaurant_id, NEW.type_id, 1, NEW.score)
+                ON CONFLICT (day, restaurant_id, type_id) DO UPDATE
+                SET count = count + 1, total_score = total_score + excluded.total_score;
+            END;
+        ''')
+        
+        # 旧数据库第一次升级时，根据已有记录回填汇总表
+        if not exists:
+            self.cursor.execute('''
+                INSERT INTO daily_rollups (day, restaurant_id, type_id, count, total_score)
+                SELECT date, restaurant_id, type_id, COUNT(*), SUM(score) FROM records
+                GROUP BY date, restaurant_id, type_id
+            ''')
+        self.conn.commit()
+    
+    def _create_daily_stats_table(self):
+        """创建每日打卡次数和总分的索引表，供日历热力图按年份一次读取"""
+        self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_stats'"
+        )
+        exists = self.cursor.fetchone() is not None
+        
+        self.cursor.executescript('''
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                day DATE PRIMARY KEY,
+                count INTEGER NOT NULL,
+                total_score REAL NOT NULL
+            ) WITHOUT ROWID;
+            
+            CREATE TRIGGER IF NOT EXISTS records_daily_stats_insert AFTER INSERT ON records
+            BEGIN
+                INSERT INTO daily_stats (day, count, total_score) VALUES (NEW.date, 1, NEW.score)
+                ON CONFLICT (day) DO UPDATE
+                SET count = count + 1, total_score = total_score + excluded.total_score;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS records_daily_stats_delete AFTER DELETE ON records
+            BEGIN
+                UPDATE daily_stats SET count = count - 1, total_score = total_score - OLD.score
+                WHERE day = OLD.date;
+                DELETE FROM daily_stats WHERE day = OLD.date AND count <= 0;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS records_daily_stats_update AFTER UPDATE OF date, score ON records
+            BEGIN
+                UPDATE daily_stats SET count = count - 1, total_score = total_score - OLD.score
+                WHERE day = OLD.date;
+                DELETE FROM daily_stats WHERE day = OLD.date AND count <= 0;
+                INSERT INTO daily_stats (day, count, total_score) VALUES (NEW.date, 1, NEW.score)
+                ON CONFLICT (day) DO UPDATE
+                SET count = count + 1, total_score = total_score + excluded.total_score;
+            END;
+        ''')
+        
+        # 旧数据库第一次升级时，根据已有记录回填
+        if not exists:
+            self.cursor.execute('''
+                INSERT INTO daily_stats (day, count, total_score)
+                SELECT date, COUNT(*), SUM(score) FROM records GROUP BY date
+            ''')
+        self.conn.commit()
+    
+    def _create_group_stats_table(self, table, key):
+        """
+        创建按 key 列（restaurant_id / type_id）汇总打卡次数和总分的表，由触发器随 records 的改动维护，
+        读取汇总结果的开销与历史记录的多少无关
+        """
+        self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        )
+        exists = self.cursor.fetchone() is not None
+        
+        self.cursor.executescript(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} INTEGER PRIMARY KEY,
+                count INTEGER NOT NULL,
+                total_score REAL NOT NULL
+            );
+            
+            CREATE TRIGGER IF NOT EXISTS records_{table}_insert AFTER INSERT ON records
+            BEGIN
+                INSERT INTO {table} ({key}, count, total_score) VALUES (NEW.{key}, 1, NEW.score)
+                ON CONFLICT ({key}) DO UPDATE
+                SET count = count + 1, total_score = total_score + excluded.total_score;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS records_{table}_delete AFTER DELETE ON records
+            BEGIN
+                UPDATE {table} SET count = count - 1, total_score = total_score - OLD.score
+                WHERE {key} = OLD.{key};
+                DELETE FROM {table} WHERE {key} = OLD.{key} AND count <= 0;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS records_{table}_update AFTER UPDATE OF {key}, score ON records
+            BEGIN
+                UPDATE {table} SET count = count - 1, total_score = total_score - OLD.score
+                WHERE {key} = OLD.{key};
+                DELETE FROM {table} WHERE {key} = OLD.{key} AND count <= 0;
+                INSERT INTO {table} ({key}, count, total_score) VALUES (NEW.{key}, 1, NEW.score)
+                ON CONFLICT ({key}) DO UPDATE
+                SET count = count + 1, total_score = total_score + excluded.total_score;
+            END;
+        ''')
+        
+        # 旧数据库第一次升级时，根据已有记录回填（与 daily_stats 相同，已归档的记录也计入）
+        if not exists:
+            self.cursor.execute(f'''
+                INSERT INTO {table} ({key}, count, total_score)
+                SELECT {key}, COUNT(*), SUM(score) FROM records GROUP BY {key}
+            ''')
+            self.conn.commit()
+            archived_key = _canonical_restaurant_id(key) if key == 'restaurant_id' else key
+            for _, path in self._get_archive_paths('0000-01-01', '9999-12-31'):
+                self.cursor.execute('ATTACH DATABASE ? AS archive_backfill', (path,))
+                try:
+                    self.cursor.execute(f'''
+                        INSERT INTO {table} ({key}, count, total_score)
+                        SELECT {archived_key}, COUNT(*), SUM(score) FROM archive_backfill.records WHERE true
+                        GROUP BY 1
+                        ON CONFLICT ({key}) DO UPDATE
+                        SET count = count + excluded.count, total_score = total_score + excluded.total_score
+                    ''')
+                    self.conn.commit()
+                finally:
+                    self.cursor.execute('DETACH DATABASE archive_backfill')
+        self.conn.commit()
+    
+    def _migrate_fingerprints(self):
+        """
+        为旧数据库的记录计算内容指纹并删除重复的记录（保留 ID 最小的一条），之后建立唯一索引
+        按 ID 分批处理，每批单独提交，中断后下次启动从没有指纹的记录继续；
+        删除的重复记录和手动删除一样移入墓碑表并写入变更日志
+        """
+        self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_records_fingerprint'"
+        )
+        if self.cursor.fetchone() is not None:
+            self._fill_missing_fingerprints()
+            return
+        
+        # 迁移期间用普通索引查找已有的指纹
+        self.cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_records_fingerprint_migration ON records (fingerprint)'
+        )
+        last_id = 0
+        while True:
+            self.cursor.execute('''
+                SELECT records.id, restaurants.name, types.name, records.date, records.score,
+                       records.comment, records.image_path
+                FROM records
+                JOIN restaurants ON restaurants.id = records.restaurant_id
+                JOIN types ON types.id = records.type_id
+                WHERE records.id > ? AND records.fingerprint IS NULL
+                ORDER BY records.id
+                LIMIT ?
+            ''', (last_id, _FINGERPRINT_BATCH_SIZE))
+            rows = self.cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            
+            fingerprints = {}
+            duplicates = []
+            for record_id, *content in rows:
+                fingerprint = record_fingerprint(*content)
+                if fingerprint in fingerprints:
+                    duplicates.append(record_id)
+                else:
+                    fingerprints[fingerprint] = record_id
+            self.cursor.execute(
+                'SELECT fingerprint FROM records WHERE fingerprint IN (SELECT value FROM json_each(?))',
+                (json.dumps(list(fingerprints)),)
             )
+            for (fingerprint,) in self.cursor.fetchall():
+                duplicates.append(fingerprints.pop(fingerprint))
+            
+            self.cursor.executemany(
+                'UPDATE records SET fingerprint = ? WHERE id = ?', list(fingerprints.items())
+            )
+            if duplicates:
+                if self.delete_records(duplicates) is None:
+                    raise RuntimeError("删除重复记录失败")
+                print(f"已删除 {len(duplicates)} 条重复的记录")
+            else:
+                self.conn.commit()
+        
+        self.cursor.executescript('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_records_fingerprint ON records (fingerprint);
+            DROP INDEX IF EXISTS idx_records_fingerprint_migration;
+        ''')
+    
+    def _fill_missing_fingerprints(self):
+        """
+        较早版本同步来的记录没有指纹，补上；与其他记录内容相同的仍然没有指纹
+        （合并餐厅时与规范餐厅已有记录重复的记录也是这样）
+        """
+        self.cursor.execute('''
+            SELECT records.id, IFNULL(canonical.name, restaurants.name), types.name, records.date, records.score,
+                   records.comment, records.image_path
+            FROM records
+            JOIN restaurants ON restaurants.id = records.restaurant_id
+            LEFT JOIN restaurant_aliases ON restaurant_aliases.alias_id = records.restaurant_id
+            LEFT JOIN restaurants AS canonical ON canonical.id = restaurant_aliases.canonical_id
+            JOIN types ON types.id = records.type_id
+            WHERE records.fingerprint IS NULL
         ''')
+        rows = self.cursor.fetchall()
+        if rows:
+            self.cursor.executemany('UPDATE OR IGNORE records SET fingerprint = ? WHERE id = ?',
+                                    [(record_fingerprint(*content), record_id) for record_id, *content in rows])
+            self.conn.commit()
+    
+    def _index_archived_fingerprints(self):
+        """为还没有指纹索引的归档文件（较早版本归档的）计算内容指纹，每个年份单独提交"""
+        self.cursor.execute('''
+            SELECT year, path FROM archives
+            WHERE record_count > 0 AND year NOT IN (SELECT year FROM archived_fingerprints)
+            ORDER BY year
+        ''')
+        db_dir = os.path.dirname(os.path.abspath(self.db_name))
+        for year, path in self.cursor.fetchall():
+            path = path if os.path.isabs(path) else os.path.join(db_dir, path)
+            if not os.path.isfile(path):
+                continue
+            self.cursor.executemany(
+                'INSERT OR IGNORE INTO archived_fingerprints (fingerprint, year, id) VALUES (?, ?, ?)',
+                [(record_fingerprint(*content), year, record_id)
+                 for record_id, *content in self._query_archives([(year, path)], 'true', ())]
+            )
+            self.conn.commit()
+    
+    def _write(self, sql, params=()):
+        """执行一条写语句；内存副本模式下同时记录下来，提交后写回磁盘"""
+        self.cursor.execute(sql, params)
+        if self.replica:
+            self._pending_writes.append((sql, [params]))
+    
+    def _write_many(self, sql, seq_of_params):
+        """批量执行一条写语句，参数顺序在内存和磁盘上保持一致"""
+        seq_of_params = list(seq_of_params)
+        self.cursor.executemany(sql, seq_of_params)
+        if self.replica:
+            self._pending_writes.append((sql, seq_of_params))
+    
+    def _commit(self):
+        """提交事务；内存副本模式下把本事务的写语句交给后台线程写回磁盘"""
         self.conn.commit()
+        if self._pending_writes:
+            self.replica.submit(self._pending_writes)
+            self._pending_writes = []
+    
+    def _rollback(self):
+        """回滚事务并丢弃尚未提交的写语句"""
+        self.conn.rollback()
+        self._pending_writes = []
+    
+    def flush(self):
+        """
+        等待已提交的写操作全部写入磁盘
+        内存副本模式下只有 flush 返回 True 之后的写操作才保证不会因进程崩溃而丢失
+        """
+        if self.write_queue:
+            return self.write_queue.flush()
+        if self.replica:
+            return self.replica.flush()
+        return True
     
     def add_record(self, name, type_, date, score, comment, image_path=None):
-        """添加新的打卡记录"""
+        """
+        添加新的打卡记录，内容完全相同的记录已经存在时不重复添加（同样返回 True）
+        写入队列模式下立即返回 Future，记录提交后结果为 True
+        """
+        if self.write_queue:
+            return self.write_queue.submit((name, type_, date, score, comment, image_path))
         try:
-            self.cursor.execute('''
-                INSERT INTO records (name, type, date, score, comment, image_path)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (name, type_, date, score, comment, image_path))
-            self.conn.commit()
+            self._insert_record(name, type_, date, score, comment, image_path)
+            self._commit()
             return True
         except Exception as e:
+            self._rollback()
             print(f"添加记录失败: {e}")
             return False
     
+    def add_records(self, records):
+        """
+        在同一个事务中批量添加记录，已经存在的记录（包括同一批中重复的记录）被跳过，
+        重复导入同一个文件时每条记录只需一次索引查找
+        records 为 [(名称, 类型, 日期, 评分, 短评, 图片路径), ...]
+        """
+        try:
+            aliases = self.get_restaurant_aliases()
+            records = [tuple(record) + (uuid.uuid4().hex,
+                                        record_fingerprint(aliases.get(record[0], record[0]), *record[1:]))
+                       for record in records]
+            self._write_many(_INSERT_RESTAURANT_SQL, {(record[0],) for record in records})
+            self._write_many(_INSERT_TYPE_SQL, {(record[1],) for record in records})
+            self._write_many(_INSERT_RECORD_SQL, records)
+            # 全部是已经存在的记录时没有需要写入变更日志的内容
+            if self.cursor.rowcount > 0:
+                self._log_changes('upsert', 'records.uuid IN (SELECT value FROM json_each(:uuids))',
+                                  {'uuids': json.dumps([record[-2] for record in records])})
+            self._commit()
+            return True
+        except Exception as e:
+            self._rollback()
+            print(f"批量添加记录失败: {e}")
+            return False
+    
+    def find_duplicate(self, name, type_, date, score, comment, image_path=None):
+        """
+        查找内容完全相同的记录（按内容指纹，别名与规范餐厅视为同一家，包括已归档的记录），
+        返回记录 ID，不存在时返回 None
+        """
+        fingerprint = record_fingerprint(self._canonical_name(name), type_, date, score, comment, image_path)
+        self.cursor.execute('''
+            SELECT id FROM records WHERE fingerprint = ?
+            UNION ALL
+            SELECT id FROM archived_fingerprints WHERE fingerprint = ?
+            LIMIT 1
+        ''', (fingerprint, fingerprint))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+    
+    def _canonical_name(self, name):
+        """已合并的别名换成规范餐厅的名称，其他名称不变（内容指纹按规范名称计算）"""
+        self.cursor.execute('''
+            SELECT canonical.name FROM restaurants AS alias
+            JOIN restaurant_aliases ON restaurant_aliases.alias_id = alias.id
+            JOIN restaurants AS canonical ON canonical.id = restaurant_aliases.canonical_id
+            WHERE alias.name = ?
+        ''', (name,))
+        row = self.cursor.fetchone()
+        return row[0] if row else name
+    
+    def _insert_record(self, name, type_, date, score, comment, image_path):
+        """插入一条记录（不提交），返回新记录的 ID，相同的记录已经存在时返回 None"""
+        fingerprint = record_fingerprint(self._canonical_name(name), type_, date, score, comment, image_path)
+        self._write(_INSERT_RESTAURANT_SQL, (name,))
+        self._write(_INSERT_TYPE_SQL, (type_,))
+        self._write(_INSERT_RECORD_SQL, (name, type_, date, score, comment, image_path, uuid.uuid4().hex,
+                                         fingerprint))
+        if self.cursor.rowcount == 0:
+            return None
+        record_id = self.cursor.lastrowid
+        self._log_changes('upsert', 'records.id = :id', {'id': record_id})
+        return record_id
+    
+    def _log_changes(self, op, condition, params):
+        """
+        推进逻辑时钟，并把满足 condition 的记录写入变更日志（不提交）
+        op 为 'upsert' 时保存记录当前的内容，为 'delete' 时需要在删除记录之前调用
+        """
+        self._write("UPDATE sync_state SET value = value + 1 WHERE key = 'clock'")
+        self._write(_LOG_CHANGES_SQL.format(condition=condition), dict(params, op=op))
+    
     def delete_record(self, identifier):
         """删除记录（通过ID或名称）"""
         try:
             # 尝试按ID删除
             if identifier.isdigit():
-                self.cursor.execute('DELETE FROM records WHERE id = ?', (identifier,))
+                self._log_changes('delete', 'records.id = :id', {'id': identifier})
+                self._write('DELETE FROM records WHERE id = ?', (identifier,))
             else:
                 # 按名称删除
-                self.cursor.execute('DELETE FROM records WHERE name = ?', (identifier,))
+                self._log_changes('delete', 'restaurants.name = :name', {'name': identifier})
+                self._write('''
+                    DELETE FROM records
+                    WHERE restaurant_id = (SELECT id FROM restaurants WHERE name = ?)
+                ''', (identifier,))
             
-            self.conn.commit()
-            return self.cursor.rowcount > 0
+            deleted = self.cursor.rowcount
+            self._commit()
+            return deleted > 0
         except Exception as e:
+            self._rollback()
             print(f"删除记录失败: {e}")
             return False
     
+    def delete_records(self, record_ids):
+        """
+        在同一个事务中删除多条记录
+        记录先移入 deleted_records 墓碑表，可以用 restore_deleted 撤销，之后由 purge_deleted 清除
+        返回本次删除的批次号，没有删除任何记录或失败时返回 None
+        """
+        try:
+            ids = json.dumps([int(record_id) for record_id in record_ids])
+            self.cursor.execute('SELECT IFNULL(MAX(batch_id), 0) + 1 FROM deleted_records')
+            batch_id = self.cursor.fetchone()[0]
+            
+            # 删除时间作为参数传入，内存副本模式下磁盘上写入相同的值
+            self._write('''
+                INSERT INTO deleted_records
+                    (id, restaurant_id, type_id, date, score, comment, image_path, uuid, fingerprint,
+                     batch_id, deleted_at)
+                SELECT id, restaurant_id, type_id, date, score, comment, image_path, uuid, fingerprint, ?, ?
+                FROM records WHERE id IN (SELECT value FROM json_each(?))
+            ''', (batch_id, time.time(), ids))
+            self._log_changes('delete', 'records.id IN (SELECT value FROM json_each(:ids))', {'ids': ids})
+            self._write('DELETE FROM records WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+            deleted = self.cursor.rowcount
+            self._commit()
+            return batch_id if deleted > 0 else None
+        except Exception as e:
+            self._rollback()
+            print(f"批量删除记录失败: {e}")
+            return None
+    
+    def restore_deleted(self, batch_id):
+        """
+        撤销一次批量删除，记录以原来的 ID 恢复，返回恢复的记录数
+        删除之后又添加了相同内容的记录时，该记录不再恢复
+        """
+        try:
+            self._write('''
+                INSERT INTO records (id, restaurant_id, type_id, date, score, comment, image_path, uuid, fingerprint)
+                SELECT id, restaurant_id, type_id, date, score, comment, image_path, uuid, fingerprint
+                FROM deleted_records WHERE batch_id = ?
+                ON CONFLICT (fingerprint) DO NOTHING
+            ''', (batch_id,))
+            restored = self.cursor.rowcount
+            self._log_changes('upsert', 'records.uuid IN (SELECT uuid FROM deleted_records WHERE batch_id = :batch)',
+                              {'batch': batch_id})
+            self._write('DELETE FROM deleted_records WHERE batch_id = ?', (batch_id,))
+            self._commit()
+            return restored
+        except Exception as e:
+            self._rollback()
+            print(f"恢复记录失败: {e}")
+            return 0
+    
+    def purge_deleted(self, older_than=0):
+        """
+        清除删除时间早于 older_than 秒之前的墓碑（之后不能再撤销）
+        返回需要删除的图片文件路径（仍被其他记录使用的图片不包含在内）
+        """
+        try:
+            cutoff = time.time() - older_than
+            self.cursor.execute('''
+                SELECT DISTINCT image_path FROM deleted_records
+                WHERE deleted_at <= ? AND image_path IS NOT NULL AND image_path != ''
+                  AND image_path NOT IN (SELECT image_path FROM records WHERE image_path IS NOT NULL)
+            ''', (cutoff,))
+            image_paths = [row[0] for row in self.cursor.fetchall()]
+            self._write('DELETE FROM deleted_records WHERE deleted_at <= ?', (cutoff,))
+            self._commit()
+            return image_paths
+        except Exception as e:
+            self._rollback()
+            print(f"清除已删除记录失败: {e}")
+            return []
+    
+    def merge_restaurants(self, alias_name, canonical_name):
+        """
+        把餐厅 alias_name 合并到 canonical_name：别名的记录（包括可撤销的已删除记录）改为规范餐厅，
+        之后用别名添加的记录也会归到规范餐厅，所有统计都按规范餐厅汇总
+        返回移动的记录数，失败时返回 None
+        """
+        try:
+            names = {name: restaurant_id for restaurant_id, name in self.get_restaurant_names().items()}
+            if alias_name not in names or canonical_name not in names:
+                raise ValueError(f"餐厅不存在: {alias_name if alias_name not in names else canonical_name}")
+            alias_id = names[alias_name]
+            # 规范名称本身是别名时合并到它的规范餐厅
+            self.cursor.execute('SELECT canonical_id FROM restaurant_aliases WHERE alias_id = ?', (names[canonical_name],))
+            row = self.cursor.fetchone()
+            canonical_id = row[0] if row else names[canonical_name]
+            if alias_id == canonical_id:
+                raise ValueError(f"{alias_name} 和 {canonical_name} 已经是同一家餐厅")
+            
+            self.cursor.execute('SELECT uuid FROM records WHERE restaurant_id = ?', (alias_id,))
+            uuids = json.dumps([row[0] for row in self.cursor.fetchall()])
+            # 移动的记录和墓碑按规范餐厅的名称重新计算内容指纹
+            canonical = self.get_restaurant_names()[canonical_id]
+            fingerprints = {}
+            for table in ('records', 'deleted_records'):
+                self.cursor.execute(f'''
+                    SELECT {table}.id, types.name, {table}.date, {table}.score, {table}.comment, {table}.image_path
+                    FROM {table} JOIN types ON types.id = {table}.type_id
+                    WHERE {table}.restaurant_id = ?
+                ''', (alias_id,))
+                fingerprints[table] = [
+                    (record_fingerprint(canonical, *content), record_id)
+                    for record_id, *content in self.cursor.fetchall()
+                ]
+            # 别名（以及以前合并到别名的餐厅）已归档的记录也按规范名称记录指纹（归档文件按年份命名）
+            archives = self._get_archive_paths('0000-01-01', '9999-12-31')
+            condition = 'a.restaurant_id IN (SELECT ? UNION SELECT alias_id FROM restaurant_aliases WHERE canonical_id = ?)'
+            archived = []
+            for start in range(0, len(archives), _MAX_ATTACHED_ARCHIVES):
+                archived += [
+                    (record_fingerprint(canonical, *content[1:]), int(content[2][:4]), record_id)
+                    for record_id, *content in self._query_archives(archives[start:start + _MAX_ATTACHED_ARCHIVES],
+                                                                    condition, (alias_id, alias_id))
+                ]
+            
+            self._write('''
+                INSERT OR REPLACE INTO restaurant_aliases (alias_id, canonical_id, merged_at) VALUES (?, ?, ?)
+            ''', (alias_id, canonical_id, time.time()))
+            # 以前合并到别名的餐厅也改为指向新的规范餐厅
+            self._write('UPDATE restaurant_aliases SET canonical_id = ? WHERE canonical_id = ?', (canonical_id, alias_id))
+            self._write('UPDATE records SET restaurant_id = ? WHERE restaurant_id = ?', (canonical_id, alias_id))
+            moved = self.cursor.rowcount
+            self._write('UPDATE deleted_records SET restaurant_id = ? WHERE restaurant_id = ?', (canonical_id, alias_id))
+            # 触发器只移动了近期记录的汇总，别名剩下的是已归档的部分（归档文件读取时按别名表换成规范餐厅）
+            self._write('''
+                INSERT INTO restaurant_stats (restaurant_id, count, total_score)
+                SELECT ?, count, total_score FROM restaurant_stats WHERE restaurant_id = ?
+                ON CONFLICT (restaurant_id) DO UPDATE
+                SET count = count + excluded.count, total_score = total_score + excluded.total_score
+            ''', (canonical_id, alias_id))
+            self._write('DELETE FROM restaurant_stats WHERE restaurant_id = ?', (alias_id,))
+            self._write('''
+                INSERT INTO daily_rollups (day, restaurant_id, type_id, count, total_score)
+                SELECT day, ?, type_id, count, total_score FROM daily_rollups WHERE restaurant_id = ?
+                ON CONFLICT (day, restaurant_id, type_id) DO UPDATE
+                SET count = count + excluded.count, total_score = total_score + excluded.total_score
+            ''', (canonical_id, alias_id))
+            self._write('DELETE FROM daily_rollups WHERE restaurant_id = ?', (alias_id,))
+            # 与规范餐厅已有记录内容相同的记录保留，但不再有指纹
+            self._write_many('UPDATE records SET fingerprint = NULL WHERE id = ?',
+                             [(record_id,) for _, record_id in fingerprints['records']])
+            self._write_many('UPDATE OR IGNORE records SET fingerprint = ? WHERE id = ?', fingerprints['records'])
+            self._write_many('UPDATE deleted_records SET fingerprint = ? WHERE id = ?', fingerprints['deleted_records'])
+            self._write_many(
+                'INSERT OR IGNORE INTO archived_fingerprints (fingerprint, year, id) VALUES (?, ?, ?)', archived
+            )
+            self._log_changes('upsert', 'records.uuid IN (SELECT value FROM json_each(:uuids))', {'uuids': uuids})
+            self._commit()
+            return moved
+        except Exception as e:
+            self._rollback()
+            print(f"合并餐厅失败: {e}")
+            return None
+    
+    def get_restaurant_aliases(self):
+        """获取已合并的别名 {别名: 规范名称}"""
+        self.cursor.execute('''
+            SELECT alias.name, canonical.name FROM restaurant_aliases
+            JOIN restaurants AS alias ON alias.id = restaurant_aliases.alias_id
+            JOIN restaurants AS canonical ON canonical.id = restaurant_aliases.canonical_id
+        ''')
+        return dict(self.cursor.fetchall())
+    
+    def get_node_id(self):
+        """获取本数据库的同步节点 ID"""
+        self.cursor.execute("SELECT value FROM sync_state WHERE key = 'node'")
+        return self.cursor.fetchone()[0]
+    
+    def get_changes_since(self, seq, exclude_node=None):
+        """
+        获取变更日志中 seq 之后的变更（每条记录只有最新的一次）
+        exclude_node 不为空时跳过该节点产生的变更（不把对方的变更再发回给对方）
+        返回 (当前最大 seq, [(uuid, 操作, 时钟, 节点, 内容), ...])，删除操作的内容为 None
+        """
+        self.cursor.execute('SELECT IFNULL(MAX(seq), 0) FROM change_log')
+        max_seq = self.cursor.fetchone()[0]
+        self.cursor.execute('''
+            SELECT uuid, op, clock, node, payload FROM change_log
+            WHERE seq > ? AND seq <= ? AND node IS NOT ?
+            ORDER BY seq
+        ''', (seq, max_seq, exclude_node))
+        changes = [(record_uuid, op, clock, node, json.loads(payload) if payload else None)
+                   for record_uuid, op, clock, node, payload in self.cursor.fetchall()]
+        return max_seq, changes
+    
+    def apply_changes(self, changes):
+        """
+        在同一个事务中应用其他数据库导出的变更
+        同一条记录以 (时钟, 节点) 较大的一方为准（后写者胜），已经应用过的变更会被跳过，可以重复应用；
+        内容与本地另一条记录（例如两边各自添加了同一次打卡）相同的插入或修改不应用，保留本地的记录，
+        但仍记入变更日志，不会再次应用
+        返回 (应用的条数, 跳过的条数)，失败时返回 None
+        """
+        applied = skipped = 0
+        max_clock = 0
+        try:
+            for record_uuid, op, clock, node, payload in changes:
+                max_clock = max(max_clock, clock)
+                self.cursor.execute('SELECT clock, node FROM change_log WHERE uuid = ?', (record_uuid,))
+                local = self.cursor.fetchone()
+                if local is not None and tuple(local) >= (clock, node):
+                    skipped += 1
+                    continue
+                
+                if op == 'delete':
+                    self._write('DELETE FROM records WHERE uuid = ?', (record_uuid,))
+                    applied += 1
+                else:
+                    fingerprint = record_fingerprint(
+                        self._canonical_name(payload['name']), payload['type'], payload['date'],
+                        payload['score'], payload['comment'], payload['image_path']
+                    )
+                    self.cursor.execute(_FINGERPRINT_TAKEN_SQL, (fingerprint, record_uuid, fingerprint))
+                    if self.cursor.fetchone() is not None:
+                        skipped += 1
+                    else:
+                        self._write(_INSERT_RESTAURANT_SQL, (payload['name'],))
+                        self._write(_INSERT_TYPE_SQL, (payload['type'],))
+                        self._write(_UPSERT_RECORD_SQL, (
+                            payload['name'], payload['type'], payload['date'], payload['score'],
+                            payload['comment'], payload['image_path'], record_uuid, fingerprint
+                        ))
+                        applied += 1
+                # 保留原来的时钟和节点，其他数据库据此判断先后
+                self._write('''
+                    INSERT OR REPLACE INTO change_log (uuid, op, clock, node, payload) VALUES (?, ?, ?, ?, ?)
+                ''', (record_uuid, op, clock, node, json.dumps(payload, ensure_ascii=False) if payload else None))
+            
+            # 本地之后的修改要排在已见过的所有变更之后
+            self._write("UPDATE sync_state SET value = MAX(value, ?) WHERE key = 'clock'", (max_clock,))
+            self._commit()
+            return applied, skipped
+        except Exception as e:
+            self._rollback()
+            print(f"应用同步变更失败: {e}")
+            return None
+    
+    def get_peer_mark(self, peer):
+        """获取已经导出给某个同步对象的最大 seq"""
+        self.cursor.execute('SELECT sent_seq FROM sync_peers WHERE peer = ?', (peer,))
+        row = self.cursor.fetchone()
+        return row[0] if row else 0
+    
+    def set_peer_mark(self, peer, seq):
+        """记录已经导出给某个同步对象的最大 seq"""
+        try:
+            self._write('''
+                INSERT INTO sync_peers (peer, sent_seq) VALUES (?, ?)
+                ON CONFLICT (peer) DO UPDATE SET sent_seq = excluded.sent_seq
+            ''', (peer, seq))
+            self._commit()
+            return True
+        except Exception as e:
+            self._rollback()
+            print(f"保存同步进度失败: {e}")
+            return False
+    
+    def get_change_seq(self):
+        """变更日志当前的最大 seq（增量导出和报表的高水位标记）"""
+        self.cursor.execute('SELECT IFNULL(MAX(seq), 0) FROM change_log')
+        return self.cursor.fetchone()[0]
+    
+    def get_export_mark(self, name):
+        """获取导出目标 name 上次导出到的 seq，从未导出过时返回 0"""
+        self.cursor.execute('SELECT seq FROM export_marks WHERE name = ?', (name,))
+        row = self.cursor.fetchone()
+        return row[0] if row else 0
+    
+    def get_export_marks(self):
+        """获取所有导出目标的进度 {名称: (seq, 导出时间戳)}"""
+        self.cursor.execute('SELECT name, seq, exported_at FROM export_marks')
+        return {name: (seq, exported_at) for name, seq, exported_at in self.cursor.fetchall()}
+    
+    def set_export_mark(self, name, seq, exported_at):
+        """记录导出目标 name 已经导出到的 seq"""
+        try:
+            self._write('''
+                INSERT INTO export_marks (name, seq, exported_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET seq = excluded.seq, exported_at = excluded.exported_at
+            ''', (name, seq, exported_at))
+            self._commit()
+            return True
+        except Exception as e:
+            self._rollback()
+            print(f"记录导出进度失败: {e}")
+            return False
+    
     def get_all_records(self):
         """获取所有记录"""
-        self.cursor.execute('SELECT * FROM records ORDER BY date DESC')
+        self.cursor.execute('SELECT * FROM records_view ORDER BY date DESC, id DESC')
         return self.cursor.fetchall()
     
     def search_by_name(self, keyword):
         """按名称关键词搜索"""
         self.cursor.execute('''
-            SELECT * FROM records 
+            SELECT * FROM records_view 
             WHERE name LIKE ? 
-            ORDER BY date DESC
+            ORDER BY date DESC, id DESC
         ''', (f'%{keyword}%',))
         return self.cursor.fetchall()
     
     def filter_by_type(self, type_):
         """按类型筛选"""
         self.cursor.execute('''
-            SELECT * FROM records 
+            SELECT * FROM records_view 
             WHERE type = ? 
-            ORDER BY date DESC
+            ORDER BY date DESC, id DESC
         ''', (type_,))
         return self.cursor.fetchall()
     
@@ -78,31 +1139,473 @@ class DakaDatabase:
         """按评分排序获取记录"""
         order = "DESC" if descending else "ASC"
         self.cursor.execute(f'''
-            SELECT * FROM records 
+            SELECT * FROM records_view 
             ORDER BY score {order}
         ''')
         return self.cursor.fetchall()
         
+    def get_records_ordered(self, sort_keys):
+        """
+        按多列排序获取全部记录，sort_keys 为 [(列, 是否降序), ...]
+        列名与记录表格相同（id / name / type / date / score / comment / has_image），相同时按 ID 排序
+        """
+        terms = []
+        for column, descending in sort_keys:
+            if column not in _ORDER_BY_COLUMNS:
+                raise ValueError(f"不支持的排序列: {column}")
+            terms.append(f"{_ORDER_BY_COLUMNS[column]} {'DESC' if descending else 'ASC'}")
+        terms.append('id')
+        self.cursor.execute(f'SELECT * FROM records_view ORDER BY {", ".join(terms)}')
+        return self.cursor.fetchall()
+    
     def get_records_by_date_range(self, start_date, end_date):
-        """按日期范围筛选记录"""
+        """按日期范围筛选记录（日期范围涉及已归档的年份时，自动附加对应的归档文件一起查询）"""
         self.cursor.execute('''
-            SELECT * FROM records 
-            WHERE date BETWEEN ? AND ? 
-            ORDER BY date DESC
+            SELECT * FROM records_view WHERE date BETWEEN ? AND ?
+            ORDER BY date DESC, id DESC
         ''', (start_date, end_date))
+        records = self.cursor.fetchall()
+        
+        archives = self._get_archive_paths(start_date, end_date)
+        if not archives:
+            return records
+        # SQLite 默认最多同时附加 10 个数据库，归档文件分组附加，查询完立即分离
+        for start in range(0, len(archives), _MAX_ATTACHED_ARCHIVES):
+            records += self._query_archives(archives[start:start + _MAX_ATTACHED_ARCHIVES],
+                                            'a.date BETWEEN ? AND ?', (start_date, end_date))
+        records.sort(key=lambda record: (record[3], record[0]), reverse=True)
+        return records
+    
+    def _get_archive_paths(self, start_date, end_date):
+        """与日期范围重叠的年度归档文件 [(年份, 路径), ...]"""
+        self.cursor.execute('''
+            SELECT year, path FROM archives
+            WHERE min_date <= ? AND max_date >= ?
+            ORDER BY year
+        ''', (end_date, start_date))
+        db_dir = os.path.dirname(os.path.abspath(self.db_name))
+        return [(year, path if os.path.isabs(path) else os.path.join(db_dir, path))
+                for year, path in self.cursor.fetchall()]
+    
+    def _query_archives(self, archives, condition, params, limit=None):
+        """
+        附加一组归档文件，查询满足 condition 的记录后分离（condition 中归档记录表的别名为 a）
+        limit 不为空时只返回按日期从新到旧的前 limit 条
+        """
+        attached = []
+        try:
+            selects = []
+            for year, path in archives:
+                schema = f"archive_{year}"
+                self.cursor.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+                attached.append(schema)
+                selects.append(f'''
+                    SELECT a.id, restaurants.name, types.name, a.date, a.score, a.comment, a.image_path
+                    FROM {schema}.records AS a
+                    JOIN restaurants ON restaurants.id = {_canonical_restaurant_id('a.restaurant_id')}
+                    JOIN types ON types.id = a.type_id
+                    WHERE {condition}
+                ''')
+            sql = ' UNION ALL '.join(selects)
+            params = list(params) * len(selects)
+            if limit is not None:
+                sql += ' ORDER BY 4 DESC, 1 DESC LIMIT ?'
+                params.append(limit)
+            self.cursor.execute(sql, params)
+            return self.cursor.fetchall()
+        finally:
+            for schema in attached:
+                self.cursor.execute(f'DETACH DATABASE {schema}')
+        
+    def get_records_by_restaurant(self, restaurant_name, limit=None, after=None):
+        """
+        获取特定餐厅的所有记录（包括已归档的记录，与汇总表中的打卡次数一致）
+        limit 不为空时只返回按日期从新到旧的一页，after 为上一页最后一条记录的 (日期, ID)
+        """
+        if limit is None:
+            self.cursor.execute('''
+                SELECT * FROM records_view 
+                WHERE name = ? 
+                ORDER BY date DESC, id DESC
+            ''', (restaurant_name,))
+            return self._add_archived_records(self.cursor.fetchall(), restaurant_name, limit, after)
+        
+        # 键集分页：沿 (restaurant_id, date, id) 索引读取，翻页的开销与页码无关
+        condition = 'AND (records.date, records.id) < (?, ?)' if after is not None else ''
+        self.cursor.execute(f'''
+            SELECT records.id, restaurants.name, types.name, records.date, records.score,
+                   records.comment, records.image_path
+            FROM records
+            JOIN restaurants ON restaurants.id = records.restaurant_id
+            JOIN types ON types.id = records.type_id
+            WHERE records.restaurant_id = (SELECT id FROM restaurants WHERE name = ?) {condition}
+            ORDER BY records.date DESC, records.id DESC
+            LIMIT ?
+        ''', (restaurant_name, *(after or ()), limit))
+        return self._add_archived_records(self.cursor.fetchall(), restaurant_name, limit, after)
+    
+    def _add_archived_records(self, records, restaurant_name, limit, after):
+        """
+        把餐厅在归档文件中的记录（包括归档之后才合并为别名的餐厅的记录）并入 records，
+        按日期从新到旧排序，limit 不为空时只保留前 limit 条
+        """
+        archives = self._get_archive_paths('0000-01-01', after[0] if after is not None else '9999-12-31')
+        if not archives:
+            return records
+        restaurant = '(SELECT id FROM restaurants WHERE name = ?)'
+        condition = (f'a.restaurant_id IN (SELECT {restaurant} '
+                     f'UNION SELECT alias_id FROM restaurant_aliases WHERE canonical_id = {restaurant})')
+        params = [restaurant_name, restaurant_name]
+        if after is not None:
+            condition += ' AND (a.date, a.id) < (?, ?)'
+            params += after
+        for start in range(0, len(archives), _MAX_ATTACHED_ARCHIVES):
+            records += self._query_archives(archives[start:start + _MAX_ATTACHED_ARCHIVES], condition, params, limit)
+        records.sort(key=lambda record: (record[3], record[0]), reverse=True)
+        return records if limit is None else records[:limit]
+    
+    def get_type_stats(self):
+        """
+        从汇总表读取每种类型的打卡次数和平均评分（不扫描记录表，包括已归档的记录）
+        返回 [(类型, 打卡次数, 平均评分), ...]，按打卡次数从多到少排序
+        """
+        self.cursor.execute('''
+            SELECT types.name, type_stats.count, type_stats.total_score / type_stats.count
+            FROM type_stats
+            JOIN types ON types.id = type_stats.type_id
+            ORDER BY type_stats.count DESC, types.name
+        ''')
         return self.cursor.fetchall()
+    
+    def get_restaurant_stats(self, type_=None):
+        """
+        从汇总表读取每家餐厅的打卡次数和平均评分（不扫描记录表，包括已归档的记录）
+        type_ 不为空时只统计该类型的打卡（按 daily_rollups 汇总）
+        返回 [(餐厅名称, 打卡次数, 平均评分), ...]，按打卡次数从多到少排序
+        """
+        if type_:
+            self.cursor.execute('''
+                SELECT restaurants.name, SUM(daily_rollups.count), SUM(daily_rollups.total_score) / SUM(daily_rollups.count)
+                FROM daily_rollups
+                JOIN restaurants ON restaurants.id = daily_rollups.restaurant_id
+                WHERE daily_rollups.type_id = (SELECT id FROM types WHERE name = ?)
+                GROUP BY daily_rollups.restaurant_id
+                ORDER BY 2 DESC, restaurants.name
+            ''', (type_,))
+            return self.cursor.fetchall()
+        self.cursor.execute('''
+            SELECT restaurants.name, restaurant_stats.count, restaurant_stats.total_score / restaurant_stats.count
+            FROM restaurant_stats
+            JOIN restaurants ON restaurants.id = restaurant_stats.restaurant_id
+            ORDER BY restaurant_stats.count DESC, restaurants.name
+        ''')
+        return self.cursor.fetchall()
+    
+    def get_data_version(self):
+        """获取数据版本号，records 有任何改动时都会变化"""
+        self.cursor.execute('SELECT version FROM data_version WHERE id = 1')
+        return self.cursor.fetchone()[0]
+    
+    def iter_records_page(self, limit, after=None, keyword=None, restaurant_name=None, type_=None,
+                          start_date=None, end_date=None):
+        """
+        按日期从新到旧分页读取记录（键集分页，翻页的开销与页码无关）
+        after 为上一页最后一条记录的 (日期, ID)，其余参数为筛选条件
+        返回游标，每行与 get_all_records 相同
+        """
+        conditions = []
+        params = []
+        if after is not None:
+            conditions.append('(date, id) < (?, ?)')
+            params += list(after)
+        if keyword:
+            conditions.append('name LIKE ?')
+            params.append(f'%{keyword}%')
+        if restaurant_name:
+            conditions.append('name = ?')
+            params.append(restaurant_name)
+        if type_:
+            conditions.append('type = ?')
+            params.append(type_)
+        if start_date:
+            conditions.append('date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('date <= ?')
+            params.append(end_date)
         
-    def get_records_by_restaurant(self, restaurant_name):
-        """获取特定餐厅的所有记录"""
+        sql = 'SELECT * FROM records_view'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY date DESC, id DESC LIMIT ?'
+        params.append(limit)
+        return self.conn.execute(sql, params)
+    
+    def get_restaurant_names(self):
+        """获取餐厅维度表 {餐厅ID: 名称}"""
+        self.cursor.execute('SELECT id, name FROM restaurants')
+        return dict(self.cursor.fetchall())
+    
+    def get_type_names(self):
+        """获取类型维度表 {类型ID: 名称}"""
+        self.cursor.execute('SELECT id, name FROM types')
+        return dict(self.cursor.fetchall())
+    
+    def iter_record_keys(self):
+        """
+        逐行遍历记录的整数键和数值列（按日期从新到旧，不加载短评和图片路径）
+        返回游标，每行为 (ID, 餐厅ID, 类型ID, 日期, 评分)
+        """
+        return self.conn.execute('''
+            SELECT id, restaurant_id, type_id, date, score FROM records
+            ORDER BY date DESC, id DESC
+        ''')
+    
+    def iter_records_export(self, start_date=None, end_date=None, type_=None, since_seq=None):
+        """
+        逐行遍历要导出的记录（按 ID 顺序，游标不把结果加载到内存）
+        since_seq 不为空时只包括变更日志中 seq 在它之后添加或修改过的记录
+        每行为 (ID, uuid, 餐厅名称, 类型, 日期, 评分, 短评, 图片路径)
+        """
+        conditions = []
+        params = []
+        if start_date:
+            conditions.append('records.date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('records.date <= ?')
+            params.append(end_date)
+        if type_:
+            conditions.append('types.name = ?')
+            params.append(type_)
+        if since_seq is not None:
+            conditions.append('records.uuid IN (SELECT uuid FROM change_log WHERE seq > ?)')
+            params.append(since_seq)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.conn.execute(f'''
+            SELECT records.id, records.uuid, restaurants.name, types.name, records.date, records.score,
+                   records.comment, records.image_path
+            FROM records
+            JOIN restaurants ON restaurants.id = records.restaurant_id
+            JOIN types ON types.id = records.type_id
+            {where}
+            ORDER BY records.id
+        ''', params)
+    
+    def iter_record_details(self):
+        """逐行遍历记录的短评和图片路径，每行为 (ID, 短评, 图片路径)"""
+        return self.conn.execute('SELECT id, comment, image_path FROM records')
+    
+    def get_restaurant_score_summary(self):
+        """
+        按餐厅统计打卡次数和平均评分（按整数键分组）
+        返回 [(餐厅名称, 打卡次数, 平均评分), ...]，按平均评分从高到低排序
+        """
         self.cursor.execute('''
-            SELECT * FROM records 
-            WHERE name = ? 
-            ORDER BY date DESC
-        ''', (restaurant_name,))
+            SELECT restaurants.name, summary.count, summary.average FROM (
+                SELECT restaurant_id, COUNT(*) AS count, AVG(score) AS average
+                FROM records GROUP BY restaurant_id
+            ) AS summary
+            JOIN restaurants ON restaurants.id = summary.restaurant_id
+            ORDER BY summary.average DESC
+        ''')
+        return self.cursor.fetchall()
+    
+    def get_type_summary(self):
+        """
+        按类型统计打卡次数和平均评分（按整数键分组）
+        返回 [(类型, 打卡次数, 平均评分), ...]，按打卡次数从多到少排序
+        """
+        self.cursor.execute('''
+            SELECT types.name, summary.count, summary.average FROM (
+                SELECT type_id, COUNT(*) AS count, AVG(score) AS average
+                FROM records GROUP BY type_id
+            ) AS summary
+            JOIN types ON types.id = summary.type_id
+            ORDER BY summary.count DESC
+        ''')
+        return self.cursor.fetchall()
+    
+    def get_score_histogram(self, bin_width=1.0, restaurant_name=None, type_=None):
+        """
+        获取评分分布直方图（评分范围 0-10，满分计入最后一个区间）
+        返回 [(区间下限, 区间上限, 记录数), ...]
+        """
+        bin_count = int(round(10 / bin_width))
+        
+        # 加上极小值，避免 0.3 / 0.1 这类浮点误差把边界值分到前一个区间
+        sql = f'SELECT MIN(CAST(score / ? + 1e-9 AS INTEGER), {bin_count - 1}) AS bin, COUNT(*) FROM records'
+        params = [bin_width]
+        conditions = []
+        if restaurant_name:
+            conditions.append('restaurant_id = (SELECT id FROM restaurants WHERE name = ?)')
+            params.append(restaurant_name)
+        if type_:
+            conditions.append('type_id = (SELECT id FROM types WHERE name = ?)')
+            params.append(type_)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' GROUP BY bin'
+        
+        self.cursor.execute(sql, params)
+        counts = dict(self.cursor.fetchall())
+        return [(i * bin_width, (i + 1) * bin_width, counts.get(i, 0)) for i in range(bin_count)]
+    
+    def get_score_percentiles(self, group_by='name'):
+        """
+        计算每个餐厅（group_by='name'）或类型（group_by='type'）的评分中位数和 P90
+        使用窗口函数在数据库中完成排序，P90 采用最近秩法
+        返回 [(名称, 记录数, 中位数, P90), ...]
+        """
+        column, dimension = _PERCENTILE_GROUP_COLUMNS[group_by]
+        self.cursor.execute(f'''
+            WITH ranked AS (
+                SELECT {column} AS grp, score,
+                       ROW_NUMBER() OVER (PARTITION BY {column} ORDER BY score) AS rn,
+                       COUNT(*) OVER (PARTITION BY {column}) AS cnt
+                FROM records
+            ),
+            summary AS (
+                SELECT grp, cnt,
+                       AVG(CASE WHEN rn IN ((cnt + 1) / 2, (cnt + 2) / 2) THEN score END) AS median,
+                       MAX(CASE WHEN rn = (cnt * 90 + 99) / 100 THEN score END) AS p90
+                FROM ranked
+                GROUP BY grp
+            )
+            SELECT {dimension}.name, cnt, median, p90
+            FROM summary JOIN {dimension} ON {dimension}.id = summary.grp
+            ORDER BY median DESC
+        ''')
         return self.cursor.fetchall()
     
+    def get_visit_percentiles(self, restaurant_name=None):
+        """
+        计算每次打卡在所属餐厅内的百分位排名（0 为最低，1 为最高）和四分位档次（1-4）
+        返回 [(ID, 餐厅名称, 日期, 评分, 百分位排名, 四分位档次), ...]
+        """
+        sql = '''
+            SELECT records.id, restaurants.name, records.date, records.score,
+                   PERCENT_RANK() OVER (PARTITION BY records.restaurant_id ORDER BY records.score) AS pct_rank,
+                   NTILE(4) OVER (PARTITION BY records.restaurant_id ORDER BY records.score) AS quartile
+            FROM records
+            JOIN restaurants ON restaurants.id = records.restaurant_id
+        '''
+        params = []
+        if restaurant_name:
+            sql += ' WHERE records.restaurant_id = (SELECT id FROM restaurants WHERE name = ?)'
+            params.append(restaurant_name)
+        sql += ' ORDER BY records.restaurant_id, records.score DESC'
+        
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+    
+    def get_date_bounds(self):
+        """获取最早和最晚的打卡日期，没有记录时返回 (None, None)"""
+        self.cursor.execute('SELECT MIN(day), MAX(day) FROM daily_rollups')
+        return self.cursor.fetchone()
+    
+    def get_daily_stats(self, start_date, end_date):
+        """
+        获取日期范围内每天的打卡统计
+        返回 {日期: (打卡次数, 平均评分)}，没有打卡的日期不包含在内
+        """
+        self.cursor.execute('''
+            SELECT day, count, total_score FROM daily_stats
+            WHERE day BETWEEN ? AND ?
+        ''', (start_date, end_date))
+        return {day: (count, total / count) for day, count, total in self.cursor.fetchall()}
+    
+    def get_checkin_series(self, start_date, end_date, granularity='day', restaurant_name=None, type_=None):
+        """
+        获取按天/周/月汇总的打卡时间序列，没有打卡的时间段补零
+        返回 [(时间段起始日期, 打卡次数, 平均评分), ...]
+        """
+        bucket = _BUCKET_EXPRESSIONS[granularity]
+        first_day = _bucket_start(_parse_date(start_date), granularity).strftime("%Y-%m-%d")
+        
+        sql = f'SELECT {bucket} AS bucket, SUM(count), SUM(total_score) FROM daily_rollups WHERE day BETWEEN ? AND ?'
+        params = [first_day, end_date]
+        if restaurant_name:
+            sql += ' AND restaurant_id = (SELECT id FROM restaurants WHERE name = ?)'
+            params.append(restaurant_name)
+        if type_:
+            sql += ' AND type_id = (SELECT id FROM types WHERE name = ?)'
+            params.append(type_)
+        sql += ' GROUP BY bucket'
+        
+        self.cursor.execute(sql, params)
+        totals = {bucket: (count, total) for bucket, count, total in self.cursor.fetchall()}
+        
+        series = []
+        for bucket in _iter_buckets(start_date, end_date, granularity):
+            count, total = totals.get(bucket, (0, 0.0))
+            series.append((bucket, count, total / count if count else 0.0))
+        return series
+    
+    def get_rolling_average_series(self, start_date, end_date, window=30, restaurant_name=None):
+        """
+        获取滚动平均评分序列（默认 30 天窗口）
+        返回 [(日期, 窗口内平均评分或 None, 窗口内打卡次数), ...]
+        """
+        first_day = (_parse_date(start_date) - timedelta(days=window - 1)).strftime("%Y-%m-%d")
+        
+        sql = 'SELECT day, SUM(count), SUM(total_score) FROM daily_rollups WHERE day BETWEEN ? AND ?'
+        params = [first_day, end_date]
+        if restaurant_name:
+            sql += ' AND restaurant_id = (SELECT id FROM restaurants WHERE name = ?)'
+            params.append(restaurant_name)
+        sql += ' GROUP BY day'
+        
+        self.cursor.execute(sql, params)
+        daily = {day: (count, total) for day, count, total in self.cursor.fetchall()}
+        
+        # 滑动窗口：加入当天，移出窗口外的一天
+        days = list(_iter_buckets(first_day, end_date, 'day'))
+        window_count = 0
+        window_total = 0.0
+        series = []
+        for i, day in enumerate(days):
+            count, total = daily.get(day, (0, 0.0))
+            window_count += count
+            window_total += total
+            if i >= window:
+                old_count, old_total = daily.get(days[i - window], (0, 0.0))
+                window_count -= old_count
+                window_total -= old_total
+            if i >= window - 1:
+                average = window_total / window_count if window_count else None
+                series.append((day, average, window_count))
+        return series
+    
+    def get_type_mix_series(self, start_date, end_date, granularity='month'):
+        """
+        获取每个时间段的类型分布，没有打卡的时间段为空字典
+        返回 [(时间段起始日期, {类型: 打卡次数}), ...]
+        """
+        bucket = _BUCKET_EXPRESSIONS[granularity]
+        first_day = _bucket_start(_parse_date(start_date), granularity).strftime("%Y-%m-%d")
+        
+        self.cursor.execute(f'''
+            SELECT bucket, types.name, count FROM (
+                SELECT {bucket} AS bucket, type_id, SUM(count) AS count FROM daily_rollups
+                WHERE day BETWEEN ? AND ?
+                GROUP BY bucket, type_id
+            ) JOIN types ON types.id = type_id
+        ''', (first_day, end_date))
+        
+        mix = {}
+        for bucket_start, type_, count in self.cursor.fetchall():
+            mix.setdefault(bucket_start, {})[type_] = count
+        
+        return [(bucket_start, mix.get(bucket_start, {}))
+                for bucket_start in _iter_buckets(start_date, end_date, granularity)]
+    
     def close(self):
-        """关闭数据库连接"""
+        """关闭数据库连接（内存副本模式下先把未写回的数据写入磁盘，写入队列模式下先写入队列中的记录）"""
+        if self.write_queue:
+            self.write_queue.close()
+        if self.replica:
+            self.replica.close()
         self.conn.close()
 
 # 测试代码
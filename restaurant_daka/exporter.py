@@ -0,0 +1,297 @@
+"""
+导出打卡记录
+所有格式都从 DakaDatabase.iter_records_export 的游标逐行读取，不把全部记录加载到内存：
+- CSV / JSON Lines（文件名以 .gz 结尾时用 gzip 压缩）
+- .npz 列式快照：每列先顺序写入临时文件，再写成 NumPy 可以直接加载的 .npy（不需要安装 NumPy）。
+  文本列保存为 UTF-8 字节 (<列>_data) 加偏移量 (<列>_offsets)，餐厅和类型保存为编码加名称表
+- .arrow Arrow IPC 文件（需要安装 pyarrow），按批写入并用 zstd 压缩（重复的名称由压缩处理，
+  IPC 文件格式不允许各批使用不同的字典）
+导出在一个读事务中完成，增量模式（--since-last 名称）记录本次导出到的变更日志 seq，
+下次只导出之后添加或修改过的记录。
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from array import array
+from datetime import date, datetime
+from database import DakaDatabase
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+COLUMNS = ('id', 'uuid', 'name', 'type', 'date', 'score', 'comment', 'image_path')
+
+# Arrow 每批的行数 / 列式临时文件每次写入的元素数
+BATCH_SIZE = 65536
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+def _parse_day(day, cache):
+    """解析记录日期（允许月、日不补零，如 2024-1-5），同一天只解析一次"""
+    parsed = cache.get(day)
+    if parsed is None:
+        parsed = cache[day] = datetime.strptime(day, "%Y-%m-%d").date()
+    return parsed
+
+def _open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', compresslevel=6, encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+def write_csv(rows, path):
+    """写入 CSV（第一行为列名），返回行数"""
+    count = 0
+    with _open_text(path) as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def write_jsonl(rows, path):
+    """写入 JSON Lines（每行一个对象），返回行数"""
+    count = 0
+    with _open_text(path) as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    return count
+
+class _Column:
+    """顺序写入临时文件的定长数值列"""
+    
+    def __init__(self, directory, name, typecode, descr):
+        self.name = name
+        self.descr = descr
+        self.count = 0
+        self._buffer = array(typecode)
+        self._file = open(os.path.join(directory, name), 'w+b')
+    
+    def append(self, value):
+        self._buffer.append(value)
+        if len(self._buffer) >= BATCH_SIZE:
+            self.flush()
+    
+    def write_bytes(self, data):
+        """直接追加字节（只用于 uint8 列）"""
+        self._file.write(data)
+        self.count += len(data)
+    
+    def flush(self):
+        self.count += len(self._buffer)
+        self._buffer.tofile(self._file)
+        del self._buffer[:]
+    
+    def write_npy(self, archive):
+        """把列写成 archive 中的 <列名>.npy"""
+        self.flush()
+        header = f"{{'descr': '{self.descr}', 'fortran_order': False, 'shape': ({self.count},), }}"
+        # .npy 1.0 格式：魔数 + 版本 + 头长度，头部以换行结尾并补齐到 64 字节的整数倍
+        padding = 63 - (10 + len(header)) % 64
+        header = (header + ' ' * padding + '\n').encode('latin1')
+        with archive.open(f"{self.name}.npy", 'w', force_zip64=True) as f:
+            f.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header)
+            self._file.seek(0)
+            shutil.copyfileobj(self._file, f)
+        self._file.close()
+
+class _TextColumn:
+    """变长文本列：UTF-8 字节列加 N+1 个偏移量"""
+    
+    def __init__(self, directory, name):
+        self.data = _Column(directory, f"{name}_data", 'B', '|u1')
+        self.offsets = _Column(directory, f"{name}_offsets", 'q', f'{_BYTE_ORDER}i8')
+        self.offsets.append(0)
+    
+    def append(self, text):
+        if text:
+            self.data.write_bytes(text.encode('utf-8'))
+        self.offsets.append(self.data.count)
+    
+    def write_npy(self, archive):
+        self.data.write_npy(archive)
+        self.offsets.write_npy(archive)
+
+def write_npz(rows, path):
+    """写入压缩的 .npz 列式快照，返回行数"""
+    with tempfile.TemporaryDirectory() as directory:
+        ids = _Column(directory, 'id', 'q', f'{_BYTE_ORDER}i8')
+        days = _Column(directory, 'date', 'q', f'{_BYTE_ORDER}M8[D]')
+        scores = _Column(directory, 'score', 'd', f'{_BYTE_ORDER}f8')
+        name_codes = _Column(directory, 'name_code', 'i', f'{_BYTE_ORDER}i4')
+        type_codes = _Column(directory, 'type_code', 'i', f'{_BYTE_ORDER}i4')
+        uuids = _TextColumn(directory, 'uuid')
+        comments = _TextColumn(directory, 'comment')
+        image_paths = _TextColumn(directory, 'image_path')
+        names = {}
+        types = {}
+        parsed_days = {}
+        count = 0
+        for record_id, record_uuid, name, type_, day, score, comment, image_path in rows:
+            ids.append(record_id)
+            days.append(_parse_day(day, parsed_days).toordinal() - _EPOCH_ORDINAL)
+            scores.append(score)
+            name_codes.append(names.setdefault(name, len(names)))
+            type_codes.append(types.setdefault(type_, len(types)))
+            uuids.append(record_uuid)
+            comments.append(comment)
+            image_paths.append(image_path)
+            count += 1
+        
+        name_table = _TextColumn(directory, 'names')
+        for name in names:
+            name_table.append(name)
+        type_table = _TextColumn(directory, 'types')
+        for type_ in types:
+            type_table.append(type_)
+        
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for column in (ids, days, scores, name_codes, type_codes, uuids, comments, image_paths,
+                           name_table, type_table):
+                column.write_npy(archive)
+    return count
+
+def write_arrow(rows, path):
+    """写入 zstd 压缩的 Arrow IPC 文件（需要 pyarrow），返回行数"""
+    if pa is None:
+        raise RuntimeError("导出 Arrow 格式需要安装 pyarrow")
+    schema = pa.schema([
+        ('id', pa.int64()), ('uuid', pa.string()), ('name', pa.string()), ('type', pa.string()),
+        ('date', pa.date32()), ('score', pa.float64()),
+        ('comment', pa.string()), ('image_path', pa.string()),
+    ])
+    parsed_days = {}
+    count = 0
+    options = pa.ipc.IpcWriteOptions(compression='zstd')
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+        while True:
+            batch = rows.fetchmany(BATCH_SIZE)
+            if not batch:
+                break
+            columns = list(zip(*batch))
+            columns[4] = [_parse_day(day, parsed_days) for day in columns[4]]
+            arrays = [pa.array(column, type=field.type) for column, field in zip(columns, schema)]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            count += len(batch)
+    return count
+
+# 文件扩展名 -> 写入函数
+WRITERS = {
+    '.csv': write_csv,
+    '.csv.gz': write_csv,
+    '.jsonl': write_jsonl,
+    '.jsonl.gz': write_jsonl,
+    '.npz': write_npz,
+    '.arrow': write_arrow,
+}
+
+def _writer_for(path):
+    """返回 (扩展名, 写入函数)，较长的扩展名（.csv.gz）优先匹配"""
+    for suffix in sorted(WRITERS, key=len, reverse=True):
+        if path.endswith(suffix):
+            return suffix, WRITERS[suffix]
+    raise ValueError(f"不支持的导出格式: {path}（支持 {', '.join(WRITERS)}）")
+
+def export_records(db, path, start_date=None, end_date=None, type_=None, since_last=None):
+    """
+    按筛选条件导出记录，格式由文件扩展名决定，返回导出的行数，失败时返回 None
+    since_last 为导出目标的名称：只导出该目标上次导出之后添加或修改过的记录，成功后记录新的进度
+    （删除的记录不会出现在增量导出中）
+    文件先写到临时文件，全部写完后才替换目标文件
+    """
+    try:
+        suffix, writer = _writer_for(path)
+    except ValueError as e:
+        print(f"导出失败: {e}")
+        return None
+    since_seq = db.get_export_mark(since_last) if since_last else None
+    # 临时文件保留扩展名（是否 gzip 压缩由扩展名决定）
+    partial = f"{path[:-len(suffix)]}.partial{suffix}"
+    # 在同一个读事务中读取高水位和记录，导出期间的新变更留给下一次增量导出
+    db.conn.execute('BEGIN')
+    try:
+        seq = db.get_change_seq()
+        count = writer(db.iter_records_export(start_date, end_date, type_, since_seq), partial)
+        os.replace(partial, path)
+    except Exception as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        print(f"导出失败: {e}")
+        return None
+    finally:
+        db.conn.rollback()
+    if since_last and not db.set_export_mark(since_last, seq, time.time()):
+        return None
+    return count
+
+def _benchmark(rows):
+    """生成 rows 条记录，测量各格式的导出吞吐量和文件大小"""
+    from parallel_statistics import _create_benchmark_database
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "export.db")
+        _create_benchmark_database(db_path, rows)
+        db = DakaDatabase(db_path)
+        formats = ['.csv', '.csv.gz', '.jsonl', '.jsonl.gz', '.npz'] + (['.arrow'] if pa is not None else [])
+        print(f"{rows} 条记录")
+        for suffix in formats:
+            path = os.path.join(tmp, f"records{suffix}")
+            start = time.perf_counter()
+            count = export_records(db, path)
+            elapsed = time.perf_counter() - start
+            print(f"{suffix:10s} {elapsed:6.2f}s  {count / elapsed:9.0f} 行/秒  {os.path.getsize(path) / 1024 / 1024:7.1f} MB")
+        if pa is None:
+            print("未安装 pyarrow，跳过 .arrow")
+        
+        export_records(db, os.path.join(tmp, "first.jsonl"), since_last="bench")
+        db.add_record("新餐厅", "火锅", "2024-06-01", 9, "增量导出", None)
+        start = time.perf_counter()
+        count = export_records(db, os.path.join(tmp, "delta.jsonl"), since_last="bench")
+        print(f"增量导出 {count} 行: {(time.perf_counter() - start) * 1000:.1f}ms")
+        db.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="导出打卡记录（格式由文件扩展名决定）")
+    parser.add_argument("--db", default="daka_records.db", help="数据库文件")
+    parser.add_argument("--start-date", help="开始日期 YYYY-MM-DD")
+    parser.add_argument("--end-date", help="结束日期 YYYY-MM-DD")
+    parser.add_argument("--type", dest="type_", help="只导出该类型")
+    parser.add_argument("--since-last", metavar="NAME", help="只导出该导出目标上次导出之后添加或修改的记录")
+    parser.add_argument("--bench", type=int, metavar="ROWS", help="用生成的数据测试导出吞吐量")
+    parser.add_argument("output", nargs="?", help=f"输出文件（{', '.join(WRITERS)}）")
+    args = parser.parse_args(argv)
+    
+    if args.bench:
+        _benchmark(args.bench)
+        return 0
+    if not args.output:
+        parser.error("需要输出文件")
+    
+    db = DakaDatabase(args.db)
+    try:
+        start = time.perf_counter()
+        count = export_records(db, args.output, args.start_date, args.end_date, args.type_, args.since_last)
+        if count is None:
+            return 1
+        elapsed = time.perf_counter() - start
+        print(f"已导出 {count} 条记录到 {args.output}（{elapsed:.2f}s，{count / max(elapsed, 1e-9):.0f} 条/秒）")
+    finally:
+        db.close()
+    return 0
+
+# 命令行：python exporter.py [--db 数据库文件] [--start-date] [--end-date] [--type] [--since-last 名称] 输出文件
+#         python exporter.py --bench 记录数
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,15 +1,36 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog
+from autocomplete import restaurant_index, type_index
 from database import DakaDatabase
-from statistics import calculate_average_score, find_most_common_type, get_top_restaurants, calculate_restaurant_average_scores
+from heatmap import CalendarHeatmap
+from image_cleanup import ImageCleanupQueue
+from maintenance import MaintenanceScheduler, TASK_NAMES, get_last_runs, is_incremental
+from name_index import NameIndex
+from record_store import RecordStore
+from similarity_index import SimilarityIndex
+from table_sort import ColumnSorter, update_sort_keys
+from statistics import (get_top_restaurants_by_type, calculate_restaurant_average_scores, calculate_growth_rates,
+                        calculate_type_mix_changes, get_score_distribution, get_percentile_summary, get_visit_percentile_rank)
 import datetime
 from PIL import Image, ImageTk
 import os
+import queue
 import shutil
 import sys
 
 class RestaurantDakaGUI:
-    def __init__(self, root):
+    # 高分餐厅排名的先验权重（相当于按平均分额外打卡的次数）
+    TOP_PRIOR_WEIGHT = 5
+    # 已删除记录保留多久后彻底清除（秒），清除前可以撤销
+    TOMBSTONE_RETENTION = 7 * 24 * 3600
+    # 统计窗口的大表格每批插入的行数
+    TABLE_CHUNK_SIZE = 500
+    # 分组视图中展开餐厅时每页读取的记录数
+    GROUP_PAGE_SIZE = 50
+    # 相似餐厅索引每次空闲时更新的餐厅数
+    SIMILARITY_BATCH_SIZE = 200
+    
+    def __init__(self, root, in_memory=False):
         self.root = root
         self.root.title("餐厅打卡系统")
         self.root.geometry("1200x700")  # 增加窗口大小以获得更好的布局
@@ -18,8 +39,41 @@ class RestaurantDakaGUI:
         # 设置颜色主题
         self.setup_styles()
         
-        # 初始化数据库
-        self.db = DakaDatabase()
+        # 初始化数据库（in_memory 为 True 时使用内存副本，适合存储较慢的设备）
+        self.db = DakaDatabase(in_memory=in_memory)
+        
+        # 内存中的紧凑记录存储，主表格和统计都从这里读取
+        self.store = RecordStore(self.db)
+        
+        # 删除记录的图片由后台队列清理；本次运行中删除的批次可以依次撤销
+        self.image_cleanup = ImageCleanupQueue()
+        self.deleted_batches = []
+        
+        # 记录表格当前显示的记录和排序列 [(列, 是否降序), ...]，各列的排序键缓存在 sorter 中
+        self.displayed_records = []
+        self.sorter = ColumnSorter(self.displayed_records)
+        self.sort_keys = []
+        
+        # 分组视图中已展开的餐厅 {餐厅名称: 已读取的最后一条记录的 (日期, ID)}
+        self.group_pages = {}
+        
+        # 统计结果缓存（数据版本变化时失效）和正在分批填充的表格 {表格: after 任务}
+        self.statistics_cache = {}
+        self.statistics_version = None
+        self.fill_jobs = {}
+        
+        # 餐厅名称的模糊匹配索引：添加记录时提示可能重复的已有餐厅
+        self.name_index = NameIndex.from_database(self.db)
+        self.name_aliases = self.db.get_restaurant_aliases()
+        
+        # 餐厅名称（按打卡次数排序）和类型的前缀补全索引，随添加和删除记录增量更新
+        self.name_completer = restaurant_index(self.db)
+        self.type_completer = type_index(self.db)
+        
+        # 按短评内容和评分推荐相似餐厅的索引，使用界面的数据库连接，
+        # 记录变化后在空闲时分批增量更新（第一次打开时在后台逐步建立）
+        self.similarity = SimilarityIndex.from_database(self.db)
+        self.similarity_job = None
         
         # 创建图片存储目录
         self.image_dir = "restaurant_images"
@@ -38,6 +92,17 @@ class RestaurantDakaGUI:
         # 加载数据
         self.load_records()
         
+        # 数据库维护：按计划在后台线程中备份、整理空间和更新统计信息，
+        # 后台线程只把进度放入队列，由主线程定时取出并更新界面
+        self.maintenance_events = queue.Queue()
+        self.maintenance_listeners = []
+        self.maintenance = MaintenanceScheduler(self.db.db_name, progress=self.report_maintenance_progress)
+        self.maintenance.start()
+        self.poll_maintenance_events()
+        
+        # 定期清除过期的已删除记录
+        self.purge_deleted_records()
+        
         # 绑定窗口关闭事件
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
     
@@ -145,10 +210,12 @@ class RestaurantDakaGUI:
         search_frame.pack(side=tk.LEFT, padx=10)
         
         self.search_var = tk.StringVar()
-        search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=20, 
-                                font=('Microsoft YaHei UI', 10))
+        search_entry = ttk.Combobox(search_frame, textvariable=self.search_var, width=20, 
+                                    font=('Microsoft YaHei UI', 10))
         search_entry.pack(side=tk.LEFT, padx=5)
         search_entry.bind("<Return>", self.search_records)
+        search_entry.bind("<<ComboboxSelected>>", self.search_records)
+        self.attach_completer(search_entry, self.search_var, lambda prefix: self.name_completer.complete(prefix))
         
         search_btn = ttk.Button(search_frame, text="🔍 搜索", command=self.search_records, width=8)
         search_btn.pack(side=tk.LEFT)
@@ -176,17 +243,16 @@ class RestaurantDakaGUI:
             table_container, 
             columns=columns, 
             show="headings",
-            selectmode="browse"
+            selectmode="extended"
         )
         
-        # 设置列标题
-        self.records_table.heading("id", text="ID", anchor=tk.W)
-        self.records_table.heading("name", text="餐厅名称", anchor=tk.W)
-        self.records_table.heading("type", text="类型", anchor=tk.W)
-        self.records_table.heading("date", text="日期", anchor=tk.W)
-        self.records_table.heading("score", text="评分", anchor=tk.W)
-        self.records_table.heading("comment", text="短评", anchor=tk.W)
-        self.records_table.heading("has_image", text="图片", anchor=tk.CENTER)
+        # 设置列标题（点击标题排序，Shift+点击添加次要排序列）
+        self.column_titles = {
+            "id": "ID", "name": "餐厅名称", "type": "类型", "date": "日期",
+            "score": "评分", "comment": "短评", "has_image": "图片"
+        }
+        for column, title in self.column_titles.items():
+            self.records_table.heading(column, text=title, anchor=tk.CENTER if column == "has_image" else tk.W)
         
         # 设置列宽度
         self.records_table.column("id", width=50, minwidth=50, anchor=tk.W)
@@ -196,6 +262,8 @@ class RestaurantDakaGUI:
         self.records_table.column("score", width=80, minwidth=80, anchor=tk.W)
         self.records_table.column("comment", width=300, minwidth=300, anchor=tk.W)
         self.records_table.column("has_image", width=60, minwidth=60, anchor=tk.CENTER)
+        # 树形列只在分组视图中显示，用于展开/折叠餐厅
+        self.records_table.column("#0", width=40, minwidth=40, stretch=False)
         
         # 添加垂直滚动条
         y_scrollbar = ttk.Scrollbar(table_container, orient=tk.VERTICAL, command=self.records_table.yview)
@@ -212,6 +280,8 @@ class RestaurantDakaGUI:
         
         # 绑定双击事件查看详情
         self.records_table.bind("<Double-1>", self.show_record_details)
+        self.records_table.bind("<Button-1>", self.on_heading_click)
+        self.records_table.bind("<<TreeviewOpen>>", self.on_group_open)
         
         # 表格下方的操作按钮
         btn_frame = ttk.Frame(parent)
@@ -221,9 +291,18 @@ class RestaurantDakaGUI:
         delete_btn = ttk.Button(btn_frame, text="🗑️ 删除记录", command=self.delete_record, width=12)
         delete_btn.pack(side=tk.LEFT, padx=5)
         
+        # 撤销删除按钮
+        self.undo_btn = ttk.Button(btn_frame, text="↩ 撤销删除", command=self.undo_delete, width=12, state=tk.DISABLED)
+        self.undo_btn.pack(side=tk.LEFT, padx=5)
+        
         # 刷新按钮
         refresh_btn = ttk.Button(btn_frame, text="🔄 刷新", command=self.load_records, width=10)
         refresh_btn.pack(side=tk.LEFT, padx=5)
+        
+        # 按餐厅分组显示
+        self.grouped_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(btn_frame, text="按餐厅分组", variable=self.grouped_var,
+                        command=self.toggle_grouped).pack(side=tk.LEFT, padx=5)
     
     def create_info_panel(self, parent):
         """创建右侧信息面板"""
@@ -290,10 +369,19 @@ class RestaurantDakaGUI:
                               style="Accent.TButton", width=15)
         stats_btn.pack(pady=10)
     
+        # 打卡日历按钮
+        calendar_btn = ttk.Button(parent, text="📅 打卡日历", command=self.show_calendar_heatmap, width=15)
+        calendar_btn.pack(pady=5)
+    
+        # 数据维护按钮
+        maintenance_btn = ttk.Button(parent, text="🛠 数据维护", command=self.show_maintenance, width=15)
+        maintenance_btn.pack(pady=5)
+    
     def create_bottom_controls(self, parent):
         """创建底部状态栏"""
         # 状态信息
-        status_label = ttk.Label(parent, text="就绪", font=('Microsoft YaHei UI', 9))
+        self.status_var = tk.StringVar(value="就绪")
+        status_label = ttk.Label(parent, textvariable=self.status_var, font=('Microsoft YaHei UI', 9))
         status_label.pack(side=tk.LEFT)
         
         # 版本信息
@@ -302,32 +390,173 @@ class RestaurantDakaGUI:
     
     def load_records(self):
         """加载所有记录到表格"""
+        # 从数据库重新加载记录存储
+        self.store.load()
+        if self.grouped_var.get():
+            self.display_grouped()
+        else:
+            self.display_records(self.store)
+        
+        # 更新统计信息
+        self.update_statistics()
+        self.schedule_similarity_update()
+    
+    def schedule_similarity_update(self):
+        """在空闲时分批更新相似餐厅索引"""
+        if self.similarity_job is None:
+            self.similarity_job = self.root.after_idle(self.update_similarity_index)
+    
+    def update_similarity_index(self):
+        """更新一批餐厅的相似度索引，还有未更新的餐厅时稍后继续，不阻塞界面"""
+        updated = self.similarity.update(limit=self.SIMILARITY_BATCH_SIZE)
+        if updated and self.similarity.pending():
+            self.similarity_job = self.root.after(1, self.update_similarity_index)
+        else:
+            self.similarity_job = None
+    
+    def display_records(self, records, sorted_=False):
+        """清空表格并显示给定的记录（按当前的排序列排序，sorted_ 为 True 表示记录已经排好序）"""
+        # 搜索、筛选等结果总是以平铺列表显示
+        self.grouped_var.set(False)
+        self.records_table.configure(show="headings")
+        
+        self.displayed_records = records
+        self.sorter = ColumnSorter(records)
+        if self.sort_keys and not sorted_:
+            order = self.sorter.order(self.sort_keys)
+        else:
+            order = range(len(records))
+        
         # 清空表格
         for item in self.records_table.get_children():
             self.records_table.delete(item)
         
-        # 从数据库获取记录
-        records = self.db.get_all_records()
-        
-        # 添加到表格
-        for record in records:
+        # 添加到表格（行的 iid 为记录 ID，排序时按 ID 移动行）
+        for index in order:
+            record = records[index]
             # 检查是否有图片
             has_image = "✓" if record[6] else ""
             values = list(record[:6]) + [has_image]
-            self.records_table.insert("", tk.END, values=values)
+            self.records_table.insert("", tk.END, iid=str(record[0]), values=values)
+    
+    def toggle_grouped(self):
+        """在平铺列表和按餐厅分组的视图之间切换"""
+        if self.grouped_var.get():
+            self.display_grouped()
+        else:
+            self.display_records(self.store)
+    
+    def display_grouped(self):
+        """
+        分组视图：每家餐厅一行，打卡次数和平均分来自汇总表，打开视图的开销与历史记录的多少无关；
+        餐厅的打卡记录在展开时才分页读取
+        """
+        self.records_table.configure(show="tree headings")
+        children = self.records_table.get_children()
+        if children:
+            self.records_table.delete(*children)
+        self.group_pages = {}
+        
+        for name, count, average in self.db.get_restaurant_stats():
+            group = self.records_table.insert("", tk.END, iid=f"group:{name}",
+                                              values=("", name, "", f"{count} 次", f"{average:.1f}", "", ""))
+            # 占位的子行使餐厅可以展开，展开后用作 "加载更多" 行
+            self.records_table.insert(group, tk.END, iid=f"more:{name}", values=("", "", "", "加载中...", "", "", ""))
+    
+    def refresh_group_rows(self):
+        """删除记录后更新分组视图中餐厅行的次数和平均分，已展开的餐厅保持展开"""
+        stats = {name: (count, average) for name, count, average in self.db.get_restaurant_stats()}
+        for group in self.records_table.get_children():
+            name = group[len("group:"):]
+            if name in stats:
+                count, average = stats[name]
+                self.records_table.item(group, values=("", name, "", f"{count} 次", f"{average:.1f}", "", ""))
+            else:
+                self.records_table.delete(group)
+                self.group_pages.pop(name, None)
+    
+    def on_group_open(self, event=None):
+        """第一次展开餐厅时读取第一页记录"""
+        item = self.records_table.focus()
+        if item.startswith("group:"):
+            name = item[len("group:"):]
+            if name not in self.group_pages:
+                self.load_group_page(name)
+    
+    def load_group_page(self, name):
+        """读取餐厅的下一页记录（键集分页），插入到 "加载更多" 行之前"""
+        group, more = f"group:{name}", f"more:{name}"
+        if not self.records_table.exists(more):
+            return
+        page = self.db.get_records_by_restaurant(name, limit=self.GROUP_PAGE_SIZE + 1,
+                                                 after=self.group_pages.get(name))
+        has_more = len(page) > self.GROUP_PAGE_SIZE
+        page = page[:self.GROUP_PAGE_SIZE]
         
-        # 更新统计信息
-        self.update_statistics()
+        position = self.records_table.index(more)
+        for offset, record in enumerate(page):
+            has_image = "✓" if record[6] else ""
+            self.records_table.insert(group, position + offset, iid=str(record[0]),
+                                      values=list(record[:6]) + [has_image])
+        self.group_pages[name] = (page[-1][3], page[-1][0]) if page else None
+        
+        if has_more:
+            self.records_table.item(more, values=("", "", "", "双击加载更多...", "", "", ""))
+        else:
+            self.records_table.delete(more)
+    
+    def on_heading_click(self, event):
+        """点击列标题排序，Shift+点击添加或切换次要排序列"""
+        if self.records_table.identify_region(event.x, event.y) != "heading":
+            return
+        # "#0" 是树形列（分组视图中显示餐厅），不对应记录的字段，不参与排序
+        column_id = self.records_table.identify_column(event.x)
+        if not column_id or column_id == "#0":
+            return
+        column = self.records_table["columns"][int(column_id[1:]) - 1]
+        self.sort_keys = update_sort_keys(self.sort_keys, column, add=bool(event.state & 0x0001))
+        self.apply_sort()
+    
+    def apply_sort(self):
+        """按 sort_keys 重新排列表格中已有的行，不查询数据库"""
+        self.update_sort_headings()
+        if not self.sort_keys:
+            return
+        
+        if self.grouped_var.get():
+            # 排序作用于平铺列表：回到全部记录的平铺视图
+            self.display_records(self.store)
+            return
+        
+        if self.sorter.needs_query(self.sort_keys):
+            # 记录很多且需要按短评等未加载的列排序时，使用数据库的 ORDER BY
+            self.display_records(self.db.get_records_ordered(self.sort_keys), sorted_=True)
+            return
+        
+        records = self.displayed_records
+        order = self.sorter.order(self.sort_keys)
+        # 一次设置全部子节点的顺序，等价于逐行 move，但只需要一次 Tk 调用
+        self.records_table.set_children("", *(str(records[index][0]) for index in order))
+    
+    def update_sort_headings(self):
+        """在列标题上显示排序方向，多列排序时显示序号"""
+        for column, title in self.column_titles.items():
+            self.records_table.heading(column, text=title)
+        for i, (column, descending) in enumerate(self.sort_keys):
+            arrow = "▼" if descending else "▲"
+            suffix = f"{arrow}{i + 1}" if len(self.sort_keys) > 1 else arrow
+            self.records_table.heading(column, text=f"{self.column_titles[column]} {suffix}")
     
     def update_statistics(self):
         """更新统计数据"""
-        records = self.db.get_all_records()
+        # 按整数编码在记录存储中分组统计
+        type_summary = self.store.get_type_summary()
         
-        if records:
+        if type_summary:
             # 更新最爱类型
-            fav_type = find_most_common_type(records)
-            self.fav_type_var.set(fav_type)
-            self.total_records_var.set(f"{len(records)}")
+            fav_type, fav_count, _ = type_summary[0]
+            self.fav_type_var.set(f"{fav_type} ({fav_count}次)")
+            self.total_records_var.set(f"{len(self.store)}")
             
             # 更新餐厅评分列表
             # 清空列表
@@ -335,10 +564,10 @@ class RestaurantDakaGUI:
                 self.restaurant_list.delete(item)
             
             # 获取每个餐厅的平均评分
-            restaurant_scores = calculate_restaurant_average_scores(records)
+            restaurant_scores = self.store.get_restaurant_score_summary()
             
             # 添加到列表
-            for name, score in restaurant_scores:
+            for name, _, score in restaurant_scores:
                 self.restaurant_list.insert("", tk.END, values=(name, f"{score:.1f}"))
         else:
             self.fav_type_var.set("无记录")
@@ -382,16 +611,28 @@ class RestaurantDakaGUI:
         # 餐厅名称
         ttk.Label(form_frame, text="餐厅名称:").grid(row=0, column=0, padx=5, pady=10, sticky=tk.W)
         name_var = tk.StringVar()
-        name_entry = ttk.Entry(form_frame, textvariable=name_var, width=30, font=('Microsoft YaHei UI', 10))
+        name_entry = ttk.Combobox(form_frame, textvariable=name_var, width=27, font=('Microsoft YaHei UI', 10))
         name_entry.grid(row=0, column=1, padx=5, pady=10, sticky=tk.EW)
         name_entry.focus()
+        self.attach_completer(name_entry, name_var, lambda prefix: self.name_completer.complete(prefix))
+        
+        # 输入名称时提示相似的已有餐厅，避免同一家餐厅以不同名称记录
+        similar_var = tk.StringVar()
+        ttk.Label(form_frame, textvariable=similar_var, foreground="#c0392b").grid(
+            row=0, column=2, padx=5, sticky=tk.W)
+        
+        def update_similar(*args):
+            name = name_var.get().strip()
+            matches = [] if not name or name in self.name_index else self.name_index.lookup(name, limit=3)
+            similar_var.set("可能重复: " + "、".join(match for match, _ in matches) if matches else "")
+        name_var.trace_add("write", update_similar)
         
         # 餐厅类型
         ttk.Label(form_frame, text="餐厅类型:").grid(row=1, column=0, padx=5, pady=10, sticky=tk.W)
         type_var = tk.StringVar()
         type_combo = ttk.Combobox(form_frame, textvariable=type_var, width=27, font=('Microsoft YaHei UI', 10))
-        type_combo['values'] = ('火锅', '川菜', '粤菜', '湘菜', '鲁菜', '西餐', '日料', '韩餐', '快餐', '小吃', '其他')
         type_combo.grid(row=1, column=1, padx=5, pady=10, sticky=tk.EW)
+        self.attach_completer(type_combo, type_var, lambda prefix: self.type_completer.complete(prefix))
         
         # 打卡日期
         ttk.Label(form_frame, text="打卡日期:").grid(row=2, column=0, padx=5, pady=10, sticky=tk.W)
@@ -489,6 +730,13 @@ class RestaurantDakaGUI:
                 messagebox.showerror("错误", "餐厅名称不能为空")
                 return
             
+            # 新名称与已有餐厅非常相似时询问是否使用已有名称
+            if name not in self.name_index and name not in self.name_aliases:
+                matches = self.name_index.lookup(name, limit=1, min_similarity=0.8)
+                if matches and messagebox.askyesno(
+                        "可能重复", f"已有相似的餐厅「{matches[0][0]}」，是否使用已有名称？", parent=dialog):
+                    name = matches[0][0]
+            
             if not type_:
                 messagebox.showerror("错误", "请选择餐厅类型")
                 return
@@ -500,6 +748,13 @@ class RestaurantDakaGUI:
                 messagebox.showerror("错误", "日期格式应为 YYYY-MM-DD")
                 return
             
+            # 重复提交（例如连续点击两次 "提交"）时不再复制图片，数据库也不会插入相同的记录
+            duplicate_id = self.db.find_duplicate(name, type_, date, score, comment, image_path)
+            if duplicate_id is not None:
+                dialog.destroy()
+                messagebox.showinfo("提示", f"相同的记录已经存在（ID: {duplicate_id}），不会重复添加")
+                return
+            
             # 处理图片
             saved_image_path = None
             if image_path:
@@ -518,6 +773,10 @@ class RestaurantDakaGUI:
             
             # 添加记录到数据库
             if self.db.add_record(name, type_, date, score, comment, saved_image_path):
+                if name not in self.name_aliases:
+                    self.name_index.add(name)
+                self.name_completer.add(self.name_aliases.get(name, name))
+                self.type_completer.add(type_)
                 self.load_records()
                 dialog.destroy()
                 messagebox.showinfo("成功", "记录添加成功！")
@@ -534,33 +793,80 @@ class RestaurantDakaGUI:
         ttk.Button(button_frame, text="提交", command=submit, style="Accent.TButton").pack(side=tk.RIGHT, padx=5)
     
     def delete_record(self):
-        """删除选中的记录"""
-        selected = self.records_table.selection()
+        """删除选中的记录（支持多选，在同一个事务中删除）"""
+        # 分组视图中的餐厅行和 "加载更多" 行不是记录
+        selected = [item for item in self.records_table.selection()
+                    if not item.startswith(("group:", "more:"))]
         if not selected:
             messagebox.showwarning("警告", "请先选择要删除的记录")
             return
         
-        record_id = self.records_table.item(selected[0], "values")[0]
-        record_name = self.records_table.item(selected[0], "values")[1]
+        record_ids = [self.records_table.item(item, "values")[0] for item in selected]
+        if len(selected) == 1:
+            record_name = self.records_table.item(selected[0], "values")[1]
+            message = f"确定要删除记录: {record_name} (ID: {record_ids[0]}) 吗?"
+        else:
+            message = f"确定要删除选中的 {len(selected)} 条记录吗?"
         
-        confirm = messagebox.askyesno("确认删除", f"确定要删除记录: {record_name} (ID: {record_id}) 吗?")
+        confirm = messagebox.askyesno("确认删除", message)
         if confirm:
-            # 获取完整记录以便删除图片
-            records = self.db.get_all_records()
-            for record in records:
-                if str(record[0]) == record_id and record[6]:  # 如果有图片
-                    try:
-                        if os.path.exists(record[6]):
-                            os.remove(record[6])
-                    except Exception as e:
-                        print(f"删除图片失败: {e}")
+            # 记录先移入墓碑表，图片在墓碑被清除时由后台队列删除
+            batch_id = self.db.delete_records(record_ids)
+            if batch_id is not None:
+                for item in selected:
+                    values = self.records_table.item(item, "values")
+                    self.name_completer.remove(values[1])
+                    self.type_completer.remove(values[2])
+                # 只从表格和记录存储中移除受影响的行，不重新加载全部记录
+                self.records_table.delete(*selected)
+                self.store.remove(record_ids)
+                if self.displayed_records is not self.store:
+                    removed = {str(record_id) for record_id in record_ids}
+                    self.displayed_records = [record for record in self.displayed_records
+                                              if str(record[0]) not in removed]
+                self.sorter = ColumnSorter(self.displayed_records)
+                if self.grouped_var.get():
+                    self.refresh_group_rows()
+                self.update_statistics()
             
-            if self.db.delete_record(record_id):
-                self.load_records()
-                messagebox.showinfo("成功", "记录删除成功！")
+                self.deleted_batches.append(batch_id)
+                self.undo_btn.config(state=tk.NORMAL)
+                self.status_var.set(f"已删除 {len(record_ids)} 条记录，可以撤销")
             else:
                 messagebox.showerror("错误", "删除记录失败")
     
+    def undo_delete(self):
+        """撤销最近一次删除"""
+        if not self.deleted_batches:
+            return
+        
+        batch_id = self.deleted_batches.pop()
+        restored = self.db.restore_deleted(batch_id)
+        if not self.deleted_batches:
+            self.undo_btn.config(state=tk.DISABLED)
+        
+        if restored:
+            # 恢复的记录可能有多家餐厅，直接从数据库重新统计补全索引的次数
+            self.name_completer = restaurant_index(self.db)
+            self.type_completer = type_index(self.db)
+            self.load_records()
+            self.status_var.set(f"已恢复 {restored} 条记录")
+        else:
+            messagebox.showerror("错误", "撤销删除失败，记录可能已被彻底清除")
+    
+    def attach_completer(self, combo, variable, complete):
+        """输入时用 complete(前缀) 返回的补全候选更新下拉框（按向下键展开）"""
+        def update_values(*args):
+            combo['values'] = complete(variable.get().strip())
+        variable.trace_add("write", update_values)
+        update_values()
+    
+    def purge_deleted_records(self):
+        """清除过期的已删除记录，并把它们的图片交给后台队列删除（每小时执行一次）"""
+        image_paths = self.db.purge_deleted(self.TOMBSTONE_RETENTION)
+        self.image_cleanup.enqueue(image_paths)
+        self.root.after(3600 * 1000, self.purge_deleted_records)
+    
     def search_records(self, event=None):
         """搜索记录"""
         keyword = self.search_var.get().strip()
@@ -568,19 +874,9 @@ class RestaurantDakaGUI:
             self.load_records()
             return
         
-        # 清空表格
-        for item in self.records_table.get_children():
-            self.records_table.delete(item)
-        
         # 从数据库搜索记录
         records = self.db.search_by_name(keyword)
-        
-        # 添加到表格
-        for record in records:
-            # 检查是否有图片
-            has_image = "✓" if record[6] else ""
-            values = list(record[:6]) + [has_image]
-            self.records_table.insert("", tk.END, values=values)
+        self.display_records(records)
         
         # 更新标题
         if records:
@@ -590,27 +886,16 @@ class RestaurantDakaGUI:
     
     def sort_records(self):
         """按评分排序记录"""
-        # 清空表格
-        for item in self.records_table.get_children():
-            self.records_table.delete(item)
-        
-        # 从数据库获取排序后的记录
-        records = self.db.get_records_sorted_by_score(descending=True)
-        
-        # 添加到表格
-        for record in records:
-            # 检查是否有图片
-            has_image = "✓" if record[6] else ""
-            values = list(record[:6]) + [has_image]
-            self.records_table.insert("", tk.END, values=values)
+        # 在已加载的记录上排序，不查询数据库
+        self.sort_keys = [("score", True)]
+        self.apply_sort()
         
         messagebox.showinfo("排序", "已按评分从高到低排序")
     
     def filter_records(self):
         """按类型筛选记录"""
         # 获取所有存在的类型
-        records = self.db.get_all_records()
-        types = sorted(set(record[2] for record in records))
+        types = self.store.get_types()
         
         if not types:
             messagebox.showinfo("提示", "没有记录可供筛选")
@@ -636,19 +921,9 @@ class RestaurantDakaGUI:
             if not type_:
                 return
             
-            # 清空表格
-            for item in self.records_table.get_children():
-                self.records_table.delete(item)
-            
             # 从数据库获取筛选后的记录
             records = self.db.filter_by_type(type_)
-            
-            # 添加到表格
-            for record in records:
-                # 检查是否有图片
-                has_image = "✓" if record[6] else ""
-                values = list(record[:6]) + [has_image]
-                self.records_table.insert("", tk.END, values=values)
+            self.display_records(records)
             
             dialog.destroy()
             messagebox.showinfo("筛选结果", f"找到 {len(records)} 条 {type_} 类型的记录")
@@ -660,8 +935,8 @@ class RestaurantDakaGUI:
         ttk.Button(button_frame, text="取消", command=dialog.destroy).pack(side=tk.LEFT, padx=10)
     
     def show_statistics(self):
-        """显示详细统计信息"""
-        records = self.db.get_all_records()
+        """显示详细统计信息（各选项卡在第一次选中时才创建，大表格分批填充）"""
+        records = self.store
         
         if not records:
             messagebox.showinfo("统计", "没有记录可供统计")
@@ -670,205 +945,560 @@ class RestaurantDakaGUI:
         # 创建统计窗口
         dialog = tk.Toplevel(self.root)
         dialog.title("详细统计")
-        dialog.geometry("600x500")
+        dialog.geometry("700x600")
+        
+        # 分批填充表格时的进度提示
+        progress_var = tk.StringVar()
+        ttk.Label(dialog, textvariable=progress_var, foreground="#666666").pack(side=tk.BOTTOM, anchor=tk.W, padx=12)
         
         # 创建选项卡控件
         notebook = ttk.Notebook(dialog)
         notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        # 总体统计选项卡
-        overall_tab = ttk.Frame(notebook)
-        notebook.add(overall_tab, text="总体统计")
-        
-        # 计算类型分布
-        type_count = {}
-        for record in records:
-            type_ = record[2]
-            type_count[type_] = type_count.get(type_, 0) + 1
-        
-        # 总体统计信息框架
-        stats_frame = ttk.LabelFrame(overall_tab, text="统计信息", padding="10")
-        stats_frame.pack(fill=tk.X, padx=10, pady=10)
-        
-        ttk.Label(stats_frame, text=f"总记录数: {len(records)}").pack(anchor=tk.W, pady=5)
-        ttk.Label(stats_frame, text=f"最常打卡的类型: {find_most_common_type(records)}").pack(anchor=tk.W, pady=5)
-        
-        # 餐厅评分框架
-        restaurant_frame = ttk.LabelFrame(overall_tab, text="餐厅评分", padding="10")
-        restaurant_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        
-        # 创建表格显示餐厅评分
-        columns = ("rank", "name", "score")
-        restaurant_table = ttk.Treeview(restaurant_frame, columns=columns, show="headings")
-        
-        restaurant_table.heading("rank", text="排名")
-        restaurant_table.heading("name", text="餐厅名称")
-        restaurant_table.heading("score", text="平均评分")
+        # 类型分布和餐厅评分在多个选项卡中使用，按数据版本缓存
+        type_summary = self.cached_statistics('type_summary', self.store.get_type_summary)
+        restaurant_scores = self.cached_statistics('restaurant_scores', self.store.get_restaurant_score_summary)
+        type_count = {type_: count for type_, count, _ in type_summary}
+        
+        def build_overall_tab(overall_tab):
+            # 总体统计信息框架
+            stats_frame = ttk.LabelFrame(overall_tab, text="统计信息", padding="10")
+            stats_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+            ttk.Label(stats_frame, text=f"总记录数: {len(records)}").pack(anchor=tk.W, pady=5)
+            ttk.Label(stats_frame, text=f"最常打卡的类型: {type_summary[0][0]} ({type_summary[0][1]}次)").pack(anchor=tk.W, pady=5)
+        
+            # 餐厅评分框架
+            restaurant_frame = ttk.LabelFrame(overall_tab, text="餐厅评分", padding="10")
+            restaurant_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+            # 创建表格显示餐厅评分
+            columns = ("rank", "name", "score")
+            restaurant_table = ttk.Treeview(restaurant_frame, columns=columns, show="headings")
+        
+            restaurant_table.heading("rank", text="排名")
+            restaurant_table.heading("name", text="餐厅名称")
+            restaurant_table.heading("score", text="平均评分")
+        
+            restaurant_table.column("rank", width=80, anchor=tk.CENTER)
+            restaurant_table.column("name", width=200)
+            restaurant_table.column("score", width=100, anchor=tk.CENTER)
+        
+            # 添加滚动条
+            scrollbar = ttk.Scrollbar(restaurant_frame, orient=tk.VERTICAL, command=restaurant_table.yview)
+            restaurant_table.configure(yscroll=scrollbar.set)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            restaurant_table.pack(fill=tk.BOTH, expand=True)
+        
+            # 添加数据到表格
+            self.fill_table(restaurant_table, [(i, name, f"{score:.1f}")
+                                               for i, (name, _, score) in enumerate(restaurant_scores, 1)],
+                            progress_var)
+        
+            # 类型分布框架
+            type_frame = ttk.LabelFrame(overall_tab, text="类型分布", padding="10")
+            type_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+            # 创建表格显示类型分布
+            columns = ("type", "count", "percentage", "avg_score")
+            type_table = ttk.Treeview(type_frame, columns=columns, show="headings")
+        
+            type_table.heading("type", text="类型")
+            type_table.heading("count", text="数量")
+            type_table.heading("percentage", text="占比")
+            type_table.heading("avg_score", text="平均评分")
+        
+            type_table.column("type", width=150)
+            type_table.column("count", width=80, anchor=tk.CENTER)
+            type_table.column("percentage", width=80, anchor=tk.CENTER)
+            type_table.column("avg_score", width=80, anchor=tk.CENTER)
+        
+            # 添加滚动条
+            scrollbar = ttk.Scrollbar(type_frame, orient=tk.VERTICAL, command=type_table.yview)
+            type_table.configure(yscroll=scrollbar.set)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            type_table.pack(fill=tk.BOTH, expand=True)
+        
+            # 添加数据到表格
+            for type_, count, type_avg in type_summary:
+                percentage = (count / len(records)) * 100
+                type_table.insert("", tk.END, values=(type_, count, f"{percentage:.1f}%", f"{type_avg:.1f}"))
+        
+        def build_top_tab(top_tab):
+            # 一次遍历计算总体及各类型的高分餐厅（贝叶斯加权，避免少量打卡的餐厅排名虚高）
+            top_by_type = self.cached_statistics(
+                'top_by_type',
+                lambda: get_top_restaurants_by_type(records, limit=10, prior_weight=self.TOP_PRIOR_WEIGHT))
+        
+            # 类型选择
+            top_filter_frame = ttk.Frame(top_tab)
+            top_filter_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+        
+            ttk.Label(top_filter_frame, text="餐厅类型:").pack(side=tk.LEFT, padx=5)
+            top_type_var = tk.StringVar(value="全部")
+            top_type_combo = ttk.Combobox(top_filter_frame, textvariable=top_type_var, width=15, state="readonly")
+            top_type_combo['values'] = ["全部"] + sorted(t for t in top_by_type if t is not None)
+            top_type_combo.pack(side=tk.LEFT, padx=5)
+        
+            # 创建表格显示高分餐厅
+            top_frame = ttk.LabelFrame(top_tab, text="评分最高的餐厅（按打卡次数加权）", padding="10")
+            top_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+            columns = ("rank", "name", "score", "count")
+            top_table = ttk.Treeview(top_frame, columns=columns, show="headings")
+        
+            top_table.heading("rank", text="排名")
+            top_table.heading("name", text="餐厅名称")
+            top_table.heading("score", text="加权评分")
+            top_table.heading("count", text="打卡次数")
+        
+            top_table.column("rank", width=80, anchor=tk.CENTER)
+            top_table.column("name", width=200)
+            top_table.column("score", width=100, anchor=tk.CENTER)
+            top_table.column("count", width=80, anchor=tk.CENTER)
+        
+            # 添加滚动条
+            scrollbar = ttk.Scrollbar(top_frame, orient=tk.VERTICAL, command=top_table.yview)
+            top_table.configure(yscroll=scrollbar.set)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            top_table.pack(fill=tk.BOTH, expand=True)
+        
+            def show_top_restaurants(event=None):
+                """显示所选类型分区的高分餐厅"""
+                for item in top_table.get_children():
+                    top_table.delete(item)
+            
+                selected_type = top_type_var.get()
+                partition = None if selected_type == "全部" else selected_type
+            
+                # 添加数据到表格
+                for i, (name, score, count) in enumerate(top_by_type.get(partition, []), 1):
+                    top_table.insert("", tk.END, values=(i, name, f"{score:.1f}", count))
         
-        restaurant_table.column("rank", width=80, anchor=tk.CENTER)
-        restaurant_table.column("name", width=200)
-        restaurant_table.column("score", width=100, anchor=tk.CENTER)
+            top_type_combo.bind("<<ComboboxSelected>>", show_top_restaurants)
+            show_top_restaurants()
+            
+        def build_custom_tab(custom_tab):
+            # 自定义统计框架
+            custom_frame = ttk.LabelFrame(custom_tab, text="按条件筛选", padding="10")
+            custom_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+            # 创建筛选选项
+            filter_frame = ttk.Frame(custom_frame)
+            filter_frame.pack(fill=tk.X, pady=10)
+        
+            # 餐厅类型筛选
+            ttk.Label(filter_frame, text="餐厅类型:").grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
+            type_var = tk.StringVar()
+            type_combo = ttk.Combobox(filter_frame, textvariable=type_var, width=15)
+            type_combo['values'] = ["全部"] + sorted(type_count.keys())
+            type_combo.current(0)
+            type_combo.grid(row=0, column=1, padx=5, pady=5, sticky=tk.W)
+        
+            # 结果显示区域 - 使用表格代替文本框
+            result_frame = ttk.LabelFrame(custom_frame, text="餐厅评分列表", padding="10")
+            result_frame.pack(fill=tk.BOTH, expand=True, pady=10)
+        
+            # 创建表格
+            columns = ("rank", "name", "type", "score")
+            result_table = ttk.Treeview(result_frame, columns=columns, show="headings")
+        
+            result_table.heading("rank", text="排名")
+            result_table.heading("name", text="餐厅名称")
+            result_table.heading("type", text="类型")
+            result_table.heading("score", text="平均评分")
+        
+            result_table.column("rank", width=60, anchor=tk.CENTER)
+            result_table.column("name", width=150)
+            result_table.column("type", width=100)
+            result_table.column("score", width=80, anchor=tk.CENTER)
+        
+            # 添加滚动条
+            scrollbar = ttk.Scrollbar(result_frame, orient=tk.VERTICAL, command=result_table.yview)
+            result_table.configure(yscroll=scrollbar.set)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            result_table.pack(fill=tk.BOTH, expand=True)
+        
+            def custom_rows(selected_type):
+                """筛选后的餐厅评分表格行；餐厅类型一次遍历得到，不再为每家餐厅扫描全部记录"""
+                if selected_type == "全部":
+                    scores = [(name, score) for name, _, score in restaurant_scores]
+                    restaurant_types = self.store.get_restaurant_types()
+                else:
+                    # 计算筛选后的餐厅评分
+                    scores = calculate_restaurant_average_scores([r for r in records if r[2] == selected_type])
+                    restaurant_types = self.store.get_restaurant_types(selected_type)
+                return [(i, name, restaurant_types.get(name, ""), f"{score:.1f}")
+                        for i, (name, score) in enumerate(scores, 1)]
+        
+            # 筛选函数
+            def filter_by_type():
+                selected_type = type_var.get()
+                rows = self.cached_statistics(('custom', selected_type), lambda: custom_rows(selected_type))
+                self.fill_table(result_table, rows, progress_var)
+            
+            # 筛选按钮
+            filter_btn = ttk.Button(filter_frame, text="应用筛选", command=filter_by_type)
+            filter_btn.grid(row=0, column=2, padx=10, pady=5)
+    
+            # 初始加载所有餐厅
+            filter_by_type()
+    
+        # 选项卡 -> 创建函数；只创建空白框架，第一次选中时才填充内容
+        builders = {}
+        for text, builder in (
+            ("总体统计", build_overall_tab),
+            ("高分餐厅", build_top_tab),
+            ("自定义统计", build_custom_tab),
+            ("趋势统计", lambda tab: self.create_trend_tab(tab, sorted(name for name, _, _ in restaurant_scores))),
+            ("评分分布", lambda tab: self.create_distribution_tab(tab, sorted(type_count.keys()), progress_var)),
+        ):
+            tab = ttk.Frame(notebook)
+            notebook.add(tab, text=text)
+            builders[str(tab)] = (tab, builder)
+        
+        def build_selected_tab(event=None):
+            entry = builders.pop(notebook.select(), None)
+            if entry is not None:
+                tab, builder = entry
+                builder(tab)
+        
+        notebook.bind("<<NotebookTabChanged>>", build_selected_tab)
+        build_selected_tab()
+    
+    def cached_statistics(self, key, compute):
+        """统计结果按数据版本缓存：数据没有变化时再次打开统计窗口直接使用上次的结果"""
+        version = self.db.get_data_version()
+        if version != self.statistics_version:
+            self.statistics_cache = {}
+            self.statistics_version = version
+        if key not in self.statistics_cache:
+            self.statistics_cache[key] = compute()
+        return self.statistics_cache[key]
+    
+    def fill_table(self, table, rows, progress_var=None):
+        """
+        分批把 rows 插入表格，每批之间通过 root.after 让出主循环，窗口在填充期间保持响应
+        对同一个表格再次调用时取消上一次未完成的填充
+        """
+        job = self.fill_jobs.pop(str(table), None)
+        if job is not None:
+            self.root.after_cancel(job)
+        children = table.get_children()
+        if children:
+            table.delete(*children)
+        
+        def insert_chunk(start):
+            self.fill_jobs.pop(str(table), None)
+            if not table.winfo_exists():
+                return
+            end = min(start + self.TABLE_CHUNK_SIZE, len(rows))
+            for values in rows[start:end]:
+                table.insert("", tk.END, values=values)
+            if end < len(rows):
+                if progress_var is not None:
+                    progress_var.set(f"正在加载 {end}/{len(rows)} 行...")
+                self.fill_jobs[str(table)] = self.root.after(1, insert_chunk, end)
+            elif progress_var is not None:
+                progress_var.set("")
+        
+        insert_chunk(0)
+    
+    def create_trend_tab(self, parent, restaurant_names):
+        """创建趋势统计选项卡，数据来自按天汇总表"""
+        # 每种粒度默认显示的时间段数量
+        granularities = {"按天": ("day", 30), "按周": ("week", 12), "按月": ("month", 12)}
         
-        # 添加滚动条
-        scrollbar = ttk.Scrollbar(restaurant_frame, orient=tk.VERTICAL, command=restaurant_table.yview)
-        restaurant_table.configure(yscroll=scrollbar.set)
+        # 控制区域
+        control_frame = ttk.Frame(parent)
+        control_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+        
+        ttk.Label(control_frame, text="粒度:").pack(side=tk.LEFT, padx=5)
+        granularity_var = tk.StringVar(value="按周")
+        granularity_combo = ttk.Combobox(control_frame, textvariable=granularity_var, width=6,
+                                         values=list(granularities), state="readonly")
+        granularity_combo.pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(control_frame, text="滚动平均餐厅:").pack(side=tk.LEFT, padx=5)
+        restaurant_var = tk.StringVar(value="全部")
+        restaurant_combo = ttk.Combobox(control_frame, textvariable=restaurant_var, width=15,
+                                        values=["全部"] + restaurant_names, state="readonly")
+        restaurant_combo.pack(side=tk.LEFT, padx=5)
+        
+        # 打卡次数柱状图
+        count_frame = ttk.LabelFrame(parent, text="打卡次数", padding="5")
+        count_frame.pack(fill=tk.X, padx=10, pady=5)
+        count_canvas = tk.Canvas(count_frame, height=120, background="white", highlightthickness=0)
+        count_canvas.pack(fill=tk.X, expand=True)
+        
+        # 30天滚动平均评分折线图
+        rolling_frame = ttk.LabelFrame(parent, text="30天滚动平均评分", padding="5")
+        rolling_frame.pack(fill=tk.X, padx=10, pady=5)
+        rolling_canvas = tk.Canvas(rolling_frame, height=100, background="white", highlightthickness=0)
+        rolling_canvas.pack(fill=tk.X, expand=True)
+        
+        # 明细表格
+        table_frame = ttk.Frame(parent)
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        
+        columns = ("period", "count", "growth", "avg_score", "top_type")
+        trend_table = ttk.Treeview(table_frame, columns=columns, show="headings", height=6)
+        
+        trend_table.heading("period", text="时间段")
+        trend_table.heading("count", text="打卡次数")
+        trend_table.heading("growth", text="环比")
+        trend_table.heading("avg_score", text="平均评分")
+        trend_table.heading("top_type", text="主要类型(占比/变化)")
+        
+        trend_table.column("period", width=100)
+        trend_table.column("count", width=70, anchor=tk.CENTER)
+        trend_table.column("growth", width=70, anchor=tk.CENTER)
+        trend_table.column("avg_score", width=70, anchor=tk.CENTER)
+        trend_table.column("top_type", width=200)
+        
+        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=trend_table.yview)
+        trend_table.configure(yscroll=scrollbar.set)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        restaurant_table.pack(fill=tk.BOTH, expand=True)
+        trend_table.pack(fill=tk.BOTH, expand=True)
         
-        # 获取每个餐厅的平均评分
-        restaurant_scores = calculate_restaurant_average_scores(records)
+        chart_data = {}
         
-        # 添加数据到表格
-        for i, (name, score) in enumerate(restaurant_scores, 1):
-            restaurant_table.insert("", tk.END, values=(i, name, f"{score:.1f}"))
+        def draw_charts(event=None):
+            """绘制柱状图和折线图"""
+            if chart_data:
+                self.draw_bar_chart(count_canvas, chart_data["labels"], chart_data["counts"])
+                self.draw_line_chart(rolling_canvas, chart_data["rolling"], max_value=10)
         
-        # 类型分布框架
-        type_frame = ttk.LabelFrame(overall_tab, text="类型分布", padding="10")
-        type_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        
-        # 创建表格显示类型分布
-        columns = ("type", "count", "percentage", "avg_score")
-        type_table = ttk.Treeview(type_frame, columns=columns, show="headings")
-        
-        type_table.heading("type", text="类型")
-        type_table.heading("count", text="数量")
-        type_table.heading("percentage", text="占比")
-        type_table.heading("avg_score", text="平均评分")
+        def refresh(event=None):
+            """根据所选粒度重新读取汇总数据"""
+            _, end_date = self.db.get_date_bounds()
+            if not end_date:
+                return
+            
+            granularity, periods = granularities[granularity_var.get()]
+            end = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
+            if granularity == "day":
+                start = end - datetime.timedelta(days=periods - 1)
+            elif granularity == "week":
+                start = end - datetime.timedelta(weeks=periods - 1)
+            else:
+                month_index = end.year * 12 + end.month - periods
+                start = datetime.date(month_index // 12, month_index % 12 + 1, 1)
+            start_date = start.strftime("%Y-%m-%d")
+            
+            selected_restaurant = restaurant_var.get()
+            restaurant_name = None if selected_restaurant == "全部" else selected_restaurant
+            
+            series = self.db.get_checkin_series(start_date, end_date, granularity)
+            growth_rates = calculate_growth_rates(series)
+            type_mix = calculate_type_mix_changes(self.db.get_type_mix_series(start_date, end_date, granularity))
+            rolling = self.db.get_rolling_average_series(start_date, end_date, window=30,
+                                                         restaurant_name=restaurant_name)
+            
+            chart_data["labels"] = [bucket[5:] for bucket, _, _ in series]
+            chart_data["counts"] = [count for _, count, _ in series]
+            chart_data["rolling"] = [average for _, average, _ in rolling]
+            draw_charts()
+            
+            for item in trend_table.get_children():
+                trend_table.delete(item)
+            
+            # 最新的时间段显示在最上面
+            for (bucket, count, avg), (_, growth), (_, mix) in reversed(list(zip(series, growth_rates, type_mix))):
+                growth_text = f"{growth:+.0f}%" if growth is not None else "-"
+                avg_text = f"{avg:.1f}" if count else "-"
+                if mix:
+                    type_, _, share, change = mix[0]
+                    top_type_text = f"{type_} ({share:.0f}%, {change:+.0f}pt)"
+                else:
+                    top_type_text = "-"
+                trend_table.insert("", tk.END, values=(bucket, count, growth_text, avg_text, top_type_text))
+        
+        granularity_combo.bind("<<ComboboxSelected>>", refresh)
+        restaurant_combo.bind("<<ComboboxSelected>>", refresh)
+        count_canvas.bind("<Configure>", draw_charts)
+        rolling_canvas.bind("<Configure>", draw_charts)
+        refresh()
+    
+    def create_distribution_tab(self, parent, types, progress_var=None):
+        """创建评分分布选项卡：直方图以及中位数/P90 表格"""
+        # 控制区域
+        control_frame = ttk.Frame(parent)
+        control_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+        
+        ttk.Label(control_frame, text="餐厅类型:").pack(side=tk.LEFT, padx=5)
+        type_var = tk.StringVar(value="全部")
+        type_combo = ttk.Combobox(control_frame, textvariable=type_var, width=12,
+                                  values=["全部"] + types, state="readonly")
+        type_combo.pack(side=tk.LEFT, padx=5)
+        
+        group_var = tk.StringVar(value="name")
+        ttk.Radiobutton(control_frame, text="按餐厅", variable=group_var, value="name").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(control_frame, text="按类型", variable=group_var, value="type").pack(side=tk.LEFT, padx=5)
+        
+        # 评分直方图
+        histogram_frame = ttk.LabelFrame(parent, text="评分直方图", padding="5")
+        histogram_frame.pack(fill=tk.X, padx=10, pady=5)
+        histogram_canvas = tk.Canvas(histogram_frame, height=140, background="white", highlightthickness=0)
+        histogram_canvas.pack(fill=tk.X, expand=True)
+        
+        # 中位数 / P90 表格
+        percentile_frame = ttk.LabelFrame(parent, text="评分中位数与 P90", padding="5")
+        percentile_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        
+        columns = ("name", "count", "median", "p90")
+        percentile_table = ttk.Treeview(percentile_frame, columns=columns, show="headings")
+        
+        percentile_table.heading("name", text="名称")
+        percentile_table.heading("count", text="打卡次数")
+        percentile_table.heading("median", text="中位数")
+        percentile_table.heading("p90", text="P90")
+        
+        percentile_table.column("name", width=200)
+        percentile_table.column("count", width=80, anchor=tk.CENTER)
+        percentile_table.column("median", width=80, anchor=tk.CENTER)
+        percentile_table.column("p90", width=80, anchor=tk.CENTER)
+        
+        scrollbar = ttk.Scrollbar(percentile_frame, orient=tk.VERTICAL, command=percentile_table.yview)
+        percentile_table.configure(yscroll=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        percentile_table.pack(fill=tk.BOTH, expand=True)
         
-        type_table.column("type", width=150)
-        type_table.column("count", width=80, anchor=tk.CENTER)
-        type_table.column("percentage", width=80, anchor=tk.CENTER)
-        type_table.column("avg_score", width=80, anchor=tk.CENTER)
+        distribution = []
         
-        # 添加滚动条
-        scrollbar = ttk.Scrollbar(type_frame, orient=tk.VERTICAL, command=type_table.yview)
-        type_table.configure(yscroll=scrollbar.set)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        type_table.pack(fill=tk.BOTH, expand=True)
+        def draw_histogram(event=None):
+            """绘制评分直方图"""
+            self.draw_bar_chart(histogram_canvas, [label for label, _, _, _ in distribution],
+                                [count for _, count, _, _ in distribution])
         
-        # 添加数据到表格
-        for type_, count in type_count.items():
-            percentage = (count / len(records)) * 100
-            type_avg = calculate_average_score(records, type_=type_)
-            type_table.insert("", tk.END, values=(type_, count, f"{percentage:.1f}%", f"{type_avg:.1f}"))
+        def refresh_histogram(event=None):
+            """按所选类型重新计算直方图"""
+            selected_type = type_var.get()
+            type_ = None if selected_type == "全部" else selected_type
+            distribution[:] = self.cached_statistics(('histogram', type_),
+                                                     lambda: get_score_distribution(self.db, type_=type_))
+            draw_histogram()
+        
+        def refresh_percentiles(*args):
+            """按所选分组重新计算中位数和 P90"""
+            group_by = group_var.get()
+            summary = self.cached_statistics(('percentiles', group_by),
+                                             lambda: get_percentile_summary(self.db, group_by=group_by))
+            self.fill_table(percentile_table, [(name, count, f"{median:.1f}", f"{p90:.1f}")
+                                               for name, count, median, p90 in summary], progress_var)
+        
+        type_combo.bind("<<ComboboxSelected>>", refresh_histogram)
+        histogram_canvas.bind("<Configure>", draw_histogram)
+        group_var.trace_add("write", refresh_percentiles)
+        refresh_histogram()
+        refresh_percentiles()
+    
+    def draw_bar_chart(self, canvas, labels, values, color="#4a6fa5"):
+        """在画布上绘制简单柱状图"""
+        canvas.delete("all")
+        width = max(canvas.winfo_width(), int(canvas["width"]))
+        height = max(canvas.winfo_height(), int(canvas["height"]))
+        if not values:
+            return
         
-        # 高分餐厅选项卡 - 这部分可以删除，因为我们已经有了餐厅评分列表
-        # 但为了保持一致性，我们保留它
-        top_tab = ttk.Frame(notebook)
-        notebook.add(top_tab, text="高分餐厅")
+        padding = 20
+        max_value = max(values) or 1
+        bar_width = (width - 2 * padding) / len(values)
+        label_step = max(1, len(values) // 8)  # 避免标签重叠
+        
+        for i, (label, value) in enumerate(zip(labels, values)):
+            x0 = padding + i * bar_width
+            bar_height = (height - 2 * padding) * value / max_value
+            canvas.create_rectangle(x0 + 1, height - padding - bar_height, x0 + bar_width - 1, height - padding,
+                                    fill=color, outline="")
+            if i % label_step == 0:
+                canvas.create_text(x0 + bar_width / 2, height - padding / 2, text=label, font=('Microsoft YaHei UI', 7))
+        
+        canvas.create_text(padding, padding / 2, text=f"最大 {max(values)}", anchor=tk.W,
+                           font=('Microsoft YaHei UI', 8))
+    
+    def draw_line_chart(self, canvas, values, max_value=None, color="#e67e22"):
+        """在画布上绘制折线图，None 表示该点没有数据"""
+        canvas.delete("all")
+        width = max(canvas.winfo_width(), int(canvas["width"]))
+        height = max(canvas.winfo_height(), int(canvas["height"]))
+        points = [(i, value) for i, value in enumerate(values) if value is not None]
+        if not points:
+            canvas.create_text(width / 2, height / 2, text="暂无数据", font=('Microsoft YaHei UI', 9))
+            return
         
-        # 获取评分最高的餐厅
-        top_restaurants = get_top_restaurants(records, limit=10)
+        padding = 15
+        max_value = max_value or max(value for _, value in points) or 1
+        x_step = (width - 2 * padding) / max(len(values) - 1, 1)
         
-        # 创建表格显示高分餐厅
-        top_frame = ttk.LabelFrame(top_tab, text="评分最高的餐厅", padding="10")
-        top_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        coords = []
+        for i, value in points:
+            coords.extend((padding + i * x_step, height - padding - (height - 2 * padding) * value / max_value))
         
-        columns = ("rank", "name", "score")
-        top_table = ttk.Treeview(top_frame, columns=columns, show="headings")
+        if len(coords) >= 4:
+            canvas.create_line(*coords, fill=color, width=2)
+        else:
+            canvas.create_oval(coords[0] - 2, coords[1] - 2, coords[0] + 2, coords[1] + 2, fill=color, outline="")
         
-        top_table.heading("rank", text="排名")
-        top_table.heading("name", text="餐厅名称")
-        top_table.heading("score", text="平均评分")
+        canvas.create_text(padding, padding / 2, text=f"最新 {points[-1][1]:.1f}", anchor=tk.W,
+                           font=('Microsoft YaHei UI', 8))
+    
+    def show_calendar_heatmap(self):
+        """显示打卡日历热力图"""
+        first_date, last_date = self.db.get_date_bounds()
+        if not first_date:
+            messagebox.showinfo("打卡日历", "没有记录可供显示")
+            return
         
-        top_table.column("rank", width=80, anchor=tk.CENTER)
-        top_table.column("name", width=200)
-        top_table.column("score", width=100, anchor=tk.CENTER)
+        dialog = tk.Toplevel(self.root)
+        dialog.title("打卡日历")
+        dialog.resizable(False, False)
         
-        # 添加滚动条
-        scrollbar = ttk.Scrollbar(top_frame, orient=tk.VERTICAL, command=top_table.yview)
-        top_table.configure(yscroll=scrollbar.set)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        top_table.pack(fill=tk.BOTH, expand=True)
+        # 控制区域
+        control_frame = ttk.Frame(dialog, padding="10")
+        control_frame.pack(fill=tk.X)
         
-        # 添加数据到表格
-        for i, (name, score) in enumerate(top_restaurants, 1):
-            top_table.insert("", tk.END, values=(i, name, f"{score:.1f}"))
-            
-        # 自定义统计选项卡
-        custom_tab = ttk.Frame(notebook)
-        notebook.add(custom_tab, text="自定义统计")
+        years = [str(year) for year in range(int(last_date[:4]), int(first_date[:4]) - 1, -1)]
+        ttk.Label(control_frame, text="年份:").pack(side=tk.LEFT, padx=5)
+        year_var = tk.StringVar(value=years[0])
+        year_combo = ttk.Combobox(control_frame, textvariable=year_var, values=years, width=6, state="readonly")
+        year_combo.pack(side=tk.LEFT, padx=5)
         
-        # 自定义统计框架
-        custom_frame = ttk.LabelFrame(custom_tab, text="按条件筛选", padding="10")
-        custom_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        metric_var = tk.StringVar(value="count")
+        ttk.Radiobutton(control_frame, text="打卡次数", variable=metric_var, value="count").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(control_frame, text="平均评分", variable=metric_var, value="score").pack(side=tk.LEFT, padx=5)
         
-        # 创建筛选选项
-        filter_frame = ttk.Frame(custom_frame)
-        filter_frame.pack(fill=tk.X, pady=10)
+        info_var = tk.StringVar(value="点击某一天查看当天的打卡记录")
         
-        # 餐厅类型筛选
-        ttk.Label(filter_frame, text="餐厅类型:").grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
-        type_var = tk.StringVar()
-        type_combo = ttk.Combobox(filter_frame, textvariable=type_var, width=15)
-        type_combo['values'] = ["全部"] + sorted(type_count.keys())
-        type_combo.current(0)
-        type_combo.grid(row=0, column=1, padx=5, pady=5, sticky=tk.W)
+        def show_day_info(day, stats):
+            """鼠标悬停时显示当天统计"""
+            if not day:
+                return
+            if stats:
+                info_var.set(f"{day}: {stats[0]} 次打卡，平均评分 {stats[1]:.1f}")
+            else:
+                info_var.set(f"{day}: 没有打卡")
         
-        # 结果显示区域 - 使用表格代替文本框
-        result_frame = ttk.LabelFrame(custom_frame, text="餐厅评分列表", padding="10")
-        result_frame.pack(fill=tk.BOTH, expand=True, pady=10)
+        def open_day(day):
+            """在主表格中显示当天的记录"""
+            records = self.db.get_records_by_date_range(day, day)
+            self.display_records(records)
+            info_var.set(f"{day}: 已在主窗口显示 {len(records)} 条记录")
         
-        # 创建表格
-        columns = ("rank", "name", "type", "score")
-        result_table = ttk.Treeview(result_frame, columns=columns, show="headings")
+        heatmap = CalendarHeatmap(dialog, on_day_click=open_day, on_day_hover=show_day_info)
+        heatmap.pack(padx=10, pady=5)
         
-        result_table.heading("rank", text="排名")
-        result_table.heading("name", text="餐厅名称")
-        result_table.heading("type", text="类型")
-        result_table.heading("score", text="平均评分")
+        ttk.Label(dialog, textvariable=info_var).pack(anchor=tk.W, padx=10, pady=(0, 10))
         
-        result_table.column("rank", width=60, anchor=tk.CENTER)
-        result_table.column("name", width=150)
-        result_table.column("type", width=100)
-        result_table.column("score", width=80, anchor=tk.CENTER)
+        def render(*args):
+            """按所选年份和指标重新绘制"""
+            year = int(year_var.get())
+            daily_stats = self.db.get_daily_stats(f"{year}-01-01", f"{year}-12-31")
+            heatmap.draw_year(year, daily_stats, metric_var.get())
         
-        # 添加滚动条
-        scrollbar = ttk.Scrollbar(result_frame, orient=tk.VERTICAL, command=result_table.yview)
-        result_table.configure(yscroll=scrollbar.set)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        result_table.pack(fill=tk.BOTH, expand=True)
-        
-        # 初始加载所有餐厅
-        for i, (name, score) in enumerate(restaurant_scores, 1):
-            # 查找餐厅类型
-            restaurant_type = ""
-            for record in records:
-                if record[1] == name:
-                    restaurant_type = record[2]
-                    break
-            result_table.insert("", tk.END, values=(i, name, restaurant_type, f"{score:.1f}"))
-        
-        # 筛选函数
-        def filter_by_type():
-            # 清空表格
-            for item in result_table.get_children():
-                result_table.delete(item)
-            
-            selected_type = type_var.get()
-            
-            # 筛选记录
-            filtered_records = records
-            if selected_type != "全部":
-                filtered_records = [r for r in filtered_records if r[2] == selected_type]
-            
-            # 计算筛选后的餐厅评分
-            if filtered_records:
-                restaurant_scores = calculate_restaurant_average_scores(filtered_records)
-                
-                # 添加到表格
-                for i, (name, score) in enumerate(restaurant_scores, 1):
-                    # 查找餐厅类型
-                    restaurant_type = ""
-                    for record in filtered_records:
-                        if record[1] == name:
-                            restaurant_type = record[2]
-                            break
-                    result_table.insert("", tk.END, values=(i, name, restaurant_type, f"{score:.1f}"))
-            
-        # 筛选按钮
-        filter_btn = ttk.Button(filter_frame, text="应用筛选", command=filter_by_type)
-        filter_btn.grid(row=0, column=2, padx=10, pady=5)
+        year_combo.bind("<<ComboboxSelected>>", render)
+        metric_var.trace_add("write", render)
+        render()
     
     def show_record_details(self, event):
         """显示选中记录的详细信息"""
@@ -876,16 +1506,18 @@ class RestaurantDakaGUI:
         if not selected:
             return
         
+        # 分组视图中的餐厅行和 "加载更多" 行
+        if selected[0].startswith("more:"):
+            self.load_group_page(selected[0][len("more:"):])
+            return
+        if selected[0].startswith("group:"):
+            return
+        
         # 获取选中记录的ID
         record_id = self.records_table.item(selected[0], "values")[0]
         
-        # 从数据库获取完整记录（包括图片路径）
-        records = self.db.get_all_records()
-        record = None
-        for r in records:
-            if str(r[0]) == record_id:
-                record = r
-                break
+        # 从记录存储获取完整记录（包括图片路径）
+        record = self.store.get(record_id)
         
         if not record:
             return
@@ -915,6 +1547,10 @@ class RestaurantDakaGUI:
         detail_frame = ttk.Frame(scrollable_frame, padding="20")
         detail_frame.pack(fill=tk.BOTH, expand=True)
         
+        # 本次评分在该餐厅所有打卡中的百分位
+        percentile = get_visit_percentile_rank(self.db, record[0], record[1])
+        percentile_text = f"{percentile[0]:.0f}% (第 {percentile[1]} 四分位)" if percentile else "-"
+        
         # 显示详细信息
         details = [
             ("ID", record[0]),
@@ -922,6 +1558,7 @@ class RestaurantDakaGUI:
             ("类型", record[2]),
             ("日期", record[3]),
             ("评分", record[4]),
+            ("店内百分位", percentile_text),
             ("短评", record[5])
         ]
         
@@ -957,8 +1594,128 @@ class RestaurantDakaGUI:
             except Exception as e:
                 ttk.Label(detail_frame, text=f"无法加载图片: {e}").grid(row=len(details), column=1, sticky=tk.W, pady=5)
     
+        # 短评内容和评分相近的餐厅（索引还在建立时结果可能不完整）
+        similar = self.similarity.similar(record[1], k=5)
+        similar_frame = ttk.LabelFrame(detail_frame, text="相似餐厅", padding="10")
+        similar_frame.grid(row=len(details) + 1, column=0, columnspan=2, sticky=tk.EW, pady=10)
+        if similar:
+            for i, (name, similarity, average, count) in enumerate(similar):
+                ttk.Label(similar_frame, text=name).grid(row=i, column=0, sticky=tk.W, padx=5)
+                ttk.Label(similar_frame, text=f"平均 {average:.1f} 分 / {count} 次").grid(row=i, column=1, sticky=tk.W, padx=10)
+                ttk.Label(similar_frame, text=f"相似度 {similarity:.0%}").grid(row=i, column=2, sticky=tk.W, padx=10)
+        else:
+            ttk.Label(similar_frame, text="暂无短评相近的餐厅").grid(row=0, column=0, sticky=tk.W)
+    
+    def report_maintenance_progress(self, task, done, total):
+        """维护任务的进度回调（在后台线程中调用）"""
+        self.maintenance_events.put((task, done, total))
+    
+    def poll_maintenance_events(self):
+        """在主线程中处理维护任务的进度，显示在状态栏和维护窗口中"""
+        try:
+            while True:
+                task, done, total = self.maintenance_events.get_nowait()
+                if done is None:
+                    # 任务结束，total 为任务结果
+                    self.status_var.set(f"{TASK_NAMES[task]}{'完成' if total else '失败'}")
+                else:
+                    percentage = done / total * 100 if total else 100.0
+                    self.status_var.set(f"{TASK_NAMES[task]}: {percentage:.0f}%")
+                for listener in list(self.maintenance_listeners):
+                    listener(task, done, total)
+        except queue.Empty:
+            pass
+        self.root.after(200, self.poll_maintenance_events)
+    
+    def show_maintenance(self):
+        """显示数据维护窗口"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("数据维护")
+        dialog.geometry("420x260")
+        dialog.transient(self.root)
+        
+        info_frame = ttk.LabelFrame(dialog, text="上次执行时间", padding="10")
+        info_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        last_run_vars = {}
+        for row, (task, name) in enumerate(TASK_NAMES.items()):
+            ttk.Label(info_frame, text=f"{name}:").grid(row=row, column=0, sticky=tk.W, pady=2)
+            last_run_vars[task] = tk.StringVar()
+            ttk.Label(info_frame, textvariable=last_run_vars[task]).grid(row=row, column=1, sticky=tk.W, padx=10, pady=2)
+        
+        def refresh_last_runs():
+            last_runs = get_last_runs(self.db.db_name)
+            for task, var in last_run_vars.items():
+                if task in last_runs:
+                    var.set(datetime.datetime.fromtimestamp(last_runs[task]).strftime("%Y-%m-%d %H:%M:%S"))
+                else:
+                    var.set("从未执行")
+        
+        refresh_last_runs()
+        
+        # 进度条
+        progress_var = tk.DoubleVar(value=0)
+        ttk.Progressbar(dialog, variable=progress_var, maximum=100).pack(fill=tk.X, padx=10, pady=5)
+        progress_text = tk.StringVar(value="")
+        ttk.Label(dialog, textvariable=progress_text).pack(anchor=tk.W, padx=10)
+        
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(pady=10)
+        buttons = []
+        
+        def on_progress(task, done, total):
+            """在主线程中更新进度条"""
+            if done is None:
+                progress_text.set(f"{TASK_NAMES[task]}{'完成' if total else '失败'}")
+                if total:
+                    progress_var.set(100)
+                for button in buttons:
+                    button.config(state=tk.NORMAL)
+                refresh_last_runs()
+            else:
+                progress_var.set(done / total * 100 if total else 100)
+                progress_text.set(f"{TASK_NAMES[task]}: {done}/{total} 页")
+        
+        def run(task):
+            """在后台线程中执行维护任务，界面保持响应"""
+            action = task
+            if task == 'vacuum' and not is_incremental(self.db.db_name):
+                # 旧数据库第一次整理需要完整的 VACUUM，期间无法保存记录，由用户确认后执行
+                if not messagebox.askyesno("整理空间", "数据库需要先执行一次完整整理才能切换为增量整理模式，"
+                                           "期间无法添加或修改记录，可能需要几分钟。是否现在执行？", parent=dialog):
+                    return
+                action = 'convert'
+            # 内存副本模式下先把未写回的数据写入磁盘
+            self.db.flush()
+            for button in buttons:
+                button.config(state=tk.DISABLED)
+            progress_var.set(0)
+            progress_text.set(f"正在{TASK_NAMES[task]}...")
+            self.maintenance.run_in_background(
+                action, self.report_maintenance_progress,
+                on_done=lambda result: self.maintenance_events.put((task, None, bool(result)))
+            )
+        
+        for task in TASK_NAMES:
+            button = ttk.Button(button_frame, text=TASK_NAMES[task], command=lambda t=task: run(t), width=12)
+            button.pack(side=tk.LEFT, padx=5)
+            buttons.append(button)
+        
+        self.maintenance_listeners.append(on_progress)
+        
+        def close():
+            self.maintenance_listeners.remove(on_progress)
+            dialog.destroy()
+        
+        dialog.protocol("WM_DELETE_WINDOW", close)
+    
     def on_closing(self):
         """关闭窗口时的处理"""
+        self.maintenance.stop()
+        self.image_cleanup.close()
+        if self.similarity_job is not None:
+            self.root.after_cancel(self.similarity_job)
+        self.similarity.close()
         self.db.close()
         self.root.destroy()
 
@@ -0,0 +1,105 @@
+import datetime
+import tkinter as tk
+
+# 颜色等级：无记录 -> 最多
+HEATMAP_COLORS = ("#ebedf0", "#9be9a8", "#40c463", "#30a14e", "#216e39")
+
+class CalendarHeatmap(tk.Canvas):
+    """GitHub 风格的打卡日历热力图，每列为一周，每行为星期一到星期日"""
+    
+    def __init__(self, parent, cell_size=13, cell_gap=2, on_day_click=None, on_day_hover=None, **kwargs):
+        self.cell_size = cell_size
+        self.step = cell_size + cell_gap
+        self.left = 30  # 星期标签的宽度
+        self.top = 20   # 月份标签的高度
+        self.on_day_click = on_day_click
+        self.on_day_hover = on_day_hover
+        
+        self.year = None
+        self.first_day = None
+        self.daily_stats = {}
+        
+        width = self.left + 54 * self.step + 10
+        height = self.top + 7 * self.step + 10
+        kwargs.setdefault("background", "white")
+        kwargs.setdefault("highlightthickness", 0)
+        super().__init__(parent, width=width, height=height, **kwargs)
+        
+        self.bind("<Button-1>", self._on_click)
+        self.bind("<Motion>", self._on_motion)
+    
+    def _color_for(self, stats, metric, max_count):
+        """根据统计值选择颜色等级"""
+        if not stats:
+            return HEATMAP_COLORS[0]
+        count, avg_score = stats
+        if metric == "score":
+            ratio = avg_score / 10
+        else:
+            ratio = count / max_count
+        level = min(len(HEATMAP_COLORS) - 1, max(1, int(ratio * (len(HEATMAP_COLORS) - 1) + 0.999)))
+        return HEATMAP_COLORS[level]
+    
+    def draw_year(self, year, daily_stats, metric="count"):
+        """
+        绘制一整年的热力图
+        daily_stats 为 {日期: (打卡次数, 平均评分)}，metric 可选 "count" 或 "score"
+        所有图形拼接为一条 Tcl 脚本一次性提交，避免逐个创建带来的开销
+        """
+        self.delete("all")
+        self.year = year
+        self.daily_stats = daily_stats
+        
+        jan_first = datetime.date(year, 1, 1)
+        self.first_day = jan_first - datetime.timedelta(days=jan_first.weekday())
+        max_count = max((count for count, _ in daily_stats.values()), default=1)
+        
+        path = str(self)
+        commands = []
+        day = jan_first
+        while day.year == year:
+            col, row = divmod((day - self.first_day).days, 7)
+            x0 = self.left + col * self.step
+            y0 = self.top + row * self.step
+            color = self._color_for(daily_stats.get(day.strftime("%Y-%m-%d")), metric, max_count)
+            commands.append(f"{path} create rectangle {x0} {y0} {x0 + self.cell_size} {y0 + self.cell_size} "
+                            f"-fill {color} -outline {{}} -tags cell")
+            
+            # 每月第一天所在的列显示月份
+            if day.day == 1:
+                commands.append(f"{path} create text {x0} {self.top - 10} -text {{{day.month}月}} "
+                                f"-anchor w -font {{{{Microsoft YaHei UI}} 8}}")
+            day += datetime.timedelta(days=1)
+        
+        for row, label in ((0, "一"), (2, "三"), (4, "五"), (6, "日")):
+            y = self.top + row * self.step + self.cell_size / 2
+            commands.append(f"{path} create text {self.left - 6} {y} -text {{{label}}} "
+                            f"-anchor e -font {{{{Microsoft YaHei UI}} 8}}")
+        
+        self.tk.eval("\n".join(commands))
+    
+    def day_at(self, x, y):
+        """返回画布坐标处的日期字符串，不在某一天的格子上时返回 None"""
+        if self.first_day is None or x < self.left or y < self.top:
+            return None
+        col, x_offset = divmod(int(x) - self.left, self.step)
+        row, y_offset = divmod(int(y) - self.top, self.step)
+        if row > 6 or x_offset >= self.cell_size or y_offset >= self.cell_size:
+            return None
+        
+        day = self.first_day + datetime.timedelta(days=col * 7 + row)
+        if day.year != self.year:
+            return None
+        return day.strftime("%Y-%m-%d")
+    
+    def _on_click(self, event):
+        """点击某一天时回调"""
+        day = self.day_at(event.x, event.y)
+        if day and self.on_day_click:
+            self.on_day_click(day)
+    
+    def _on_motion(self, event):
+        """鼠标移动时回调当前所指日期及其统计"""
+        if self.on_day_hover:
+            day = self.day_at(event.x, event.y)
+            self.on_day_hover(day, self.daily_stats.get(day) if day else None)
@@ -0,0 +1,45 @@
+"""
+图片文件的后台清理队列
+删除图片文件可能很慢（例如存储在 SD 卡上），放到后台线程中进行，界面不需要等待。
+"""
+import os
+import queue
+import threading
+
+class ImageCleanupQueue:
+    """按提交顺序在后台线程中删除图片文件"""
+    
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="ImageCleanup", daemon=True)
+        self._thread.start()
+    
+    def enqueue(self, image_paths):
+        """提交需要删除的图片文件"""
+        for path in image_paths:
+            if path:
+                self._queue.put(path)
+    
+    def join(self):
+        """等待已提交的图片全部处理完"""
+        self._queue.join()
+    
+    def close(self):
+        """处理完剩余的图片后停止后台线程"""
+        self._queue.put(None)
+        self._thread.join()
+    
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                if path is None:
+                    return
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"删除图片失败: {e}")
+            finally:
+                self._queue.task_done()
@@ -1,8 +1,14 @@
 from gui_interface import RestaurantDakaGUI
+import argparse
 import tkinter as tk
 from tkinter import ttk
 
 def main():
+    parser = argparse.ArgumentParser(description="餐厅打卡系统")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="把数据库复制到内存中运行，写操作在后台批量写回磁盘")
+    args = parser.parse_args()
+    
     root = tk.Tk()
     # 设置应用主题
     style = ttk.Style()
@@ -11,7 +17,7 @@ def main():
         style.theme_use('clam')  # 可选值: 'clam', 'alt', 'default', 'classic'
     except:
         pass
-    app = RestaurantDakaGUI(root)
+    app = RestaurantDakaGUI(root, in_memory=args.in_memory)
     root.mainloop()
 
 if __name__ == "__main__":
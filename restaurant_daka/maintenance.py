@@ -0,0 +1,317 @@
+"""
+数据库维护
+在线备份（Connection.backup 每步复制一批页面，步与步之间短暂释放锁）、备份文件轮换、
+增量 VACUUM 和 ANALYZE。每个任务都使用独立的连接，可以放在后台线程中执行，
+进度通过 progress(任务, 已完成, 总数) 回调报告。
+MaintenanceScheduler 按计划自动执行这些任务，上次执行时间保存在 maintenance_runs 表中；
+计划第一次启动时所有任务从此刻开始计时，不会在刚打开程序时就执行。
+旧数据库切换为增量整理模式需要一次完整的 VACUUM（期间其他连接无法写入），
+只能手动执行（convert 任务），计划不会执行，切换之前也不会按计划整理空间。
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_BACKUP_DIR = "backups"
+
+# 每个任务的默认执行间隔（秒）
+DEFAULT_INTERVALS = {
+    'backup': 24 * 3600,
+    'vacuum': 7 * 24 * 3600,
+    'analyze': 7 * 24 * 3600,
+}
+
+# 分步备份被其他连接的写入打断（从头开始）超过这个次数后，改为一步复制完（只在复制期间阻塞写入）
+MAX_BACKUP_RESTARTS = 3
+
+TASK_NAMES = {'backup': "备份", 'vacuum': "整理空间", 'analyze': "更新统计信息"}
+
+# maintenance_runs 中记录计划第一次启动时间的行
+_FIRST_START = 'first_start'
+
+def _record_run(db_name, task, replace=True):
+    """记录任务的执行时间（replace=False 时已有记录则不修改）"""
+    conn = sqlite3.connect(db_name)
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance_runs (
+                task TEXT PRIMARY KEY,
+                last_run REAL NOT NULL
+            )
+        ''')
+        conflict = 'REPLACE' if replace else 'IGNORE'
+        conn.execute(f'INSERT OR {conflict} INTO maintenance_runs (task, last_run) VALUES (?, ?)', (task, time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_last_runs(db_name):
+    """获取每个任务上次执行的时间戳 {任务: 时间戳}"""
+    conn = sqlite3.connect(db_name)
+    try:
+        return dict(conn.execute('SELECT task, last_run FROM maintenance_runs'))
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+
+def rotate_backups(backup_dir, stem, keep):
+    """只保留最新的 keep 个备份文件，返回被删除的文件"""
+    backups = sorted(glob.glob(os.path.join(backup_dir, f"{stem}-*.db")))
+    removed = backups[:-keep] if keep > 0 else backups
+    for path in removed:
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"删除旧备份失败: {e}")
+    return removed
+
+class _BackupRestarted(Exception):
+    """分步备份反复被其他连接的写入打断"""
+
+def backup_database(db_name, backup_dir=DEFAULT_BACKUP_DIR, keep=7, pages=1024, sleep=0.005, progress=None):
+    """
+    在线备份数据库并轮换备份文件
+    每步复制 pages 个页面，步与步之间等待 sleep 秒，其他连接可以在这期间继续读写；
+    其他连接写入后备份会从头开始，所以每步复制较多页面、尽快完成（4 KB 页面时每步约 4 MB）；
+    写入频繁、反复从头开始时改为一步复制完
+    成功返回备份文件路径，失败返回 None
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_name))[0]
+    backup_path = os.path.join(backup_dir, f"{stem}-{datetime.now():%Y%m%d-%H%M%S}.db")
+    temp_path = backup_path + ".tmp"
+    
+    last_remaining = None
+    restarts = 0
+    
+    def report(status, remaining, total):
+        nonlocal last_remaining, restarts
+        # 剩余页数没有减少说明备份从头开始了
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > MAX_BACKUP_RESTARTS:
+                raise _BackupRestarted()
+        last_remaining = remaining
+        if progress:
+            progress('backup', total - remaining, total)
+    
+    source = sqlite3.connect(db_name)
+    target = sqlite3.connect(temp_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=report, sleep=sleep)
+        except _BackupRestarted:
+            source.backup(target)
+            if progress:
+                progress('backup', 1, 1)
+        target.close()
+        # 备份完整写好后再改名，轮换时不会留下半个备份文件
+        os.replace(temp_path, backup_path)
+        rotate_backups(backup_dir, stem, keep)
+        _record_run(db_name, 'backup')
+        return backup_path
+    except Exception as e:
+        target.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        print(f"备份数据库失败: {e}")
+        return None
+    finally:
+        source.close()
+
+def is_incremental(db_name):
+    """数据库是否已经是增量整理（auto_vacuum = INCREMENTAL）模式"""
+    conn = sqlite3.connect(db_name)
+    try:
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    finally:
+        conn.close()
+
+def convert_to_incremental(db_name, progress=None):
+    """
+    把旧数据库切换为增量整理模式：执行一次完整的 VACUUM，
+    期间数据库被独占，其他连接无法写入，只应手动执行
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        conn.close()
+        _record_run(db_name, 'vacuum')
+        if progress:
+            progress('vacuum', 1, 1)
+        return True
+    except Exception as e:
+        conn.close()
+        print(f"切换增量整理模式失败: {e}")
+        return False
+
+def incremental_vacuum(db_name, pages=64, progress=None):
+    """
+    释放删除记录后留下的空闲页面，每步只释放 pages 个页面
+    旧数据库需要先用 convert_to_incremental 切换为增量模式，否则不整理并返回 False
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            raise RuntimeError("数据库还不是增量整理模式，需要先执行一次 convert（完整 VACUUM）")
+        
+        total = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        remaining = total
+        while remaining > 0:
+            # execute 只会执行一步（释放一个页面），executescript 会把语句执行完
+            conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+            remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if progress:
+                progress('vacuum', total - remaining, total)
+        if progress and total == 0:
+            progress('vacuum', 0, 0)
+        conn.close()
+        _record_run(db_name, 'vacuum')
+        return True
+    except Exception as e:
+        conn.close()
+        print(f"整理数据库空间失败: {e}")
+        return False
+
+def analyze_database(db_name, progress=None):
+    """更新查询优化器使用的统计信息"""
+    conn = sqlite3.connect(db_name)
+    try:
+        conn.execute('ANALYZE')
+        conn.commit()
+        conn.close()
+        _record_run(db_name, 'analyze')
+        if progress:
+            progress('analyze', 1, 1)
+        return True
+    except Exception as e:
+        conn.close()
+        print(f"更新统计信息失败: {e}")
+        return False
+
+class MaintenanceScheduler:
+    """在后台线程中按计划执行维护任务，同一时间只执行一个任务"""
+    
+    def __init__(self, db_name, backup_dir=DEFAULT_BACKUP_DIR, keep=7, intervals=None,
+                 check_interval=600, progress=None):
+        self.db_name = db_name
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self.check_interval = check_interval
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def run_task(self, task, progress=None):
+        """立即执行一个任务（阻塞），返回任务的结果"""
+        progress = progress or self.progress
+        with self._lock:
+            if task == 'backup':
+                return backup_database(self.db_name, self.backup_dir, self.keep, progress=progress)
+            if task == 'vacuum':
+                return incremental_vacuum(self.db_name, progress=progress)
+            if task == 'convert':
+                return convert_to_incremental(self.db_name, progress=progress)
+            if task == 'analyze':
+                return analyze_database(self.db_name, progress=progress)
+            raise ValueError(f"未知的维护任务: {task}")
+    
+    def run_in_background(self, task, progress=None, on_done=None):
+        """在新线程中执行一个任务，完成后调用 on_done(结果)"""
+        def worker():
+            result = self.run_task(task, progress)
+            if on_done:
+                on_done(result)
+        thread = threading.Thread(target=worker, name=f"maintenance-{task}", daemon=True)
+        thread.start()
+        return thread
+    
+    def due_tasks(self):
+        """
+        获取已经到期的任务：从未执行过的任务从计划第一次启动时开始计时，
+        数据库还不是增量整理模式时不整理空间（切换需要手动执行）
+        """
+        last_runs = get_last_runs(self.db_name)
+        first_start = last_runs.get(_FIRST_START, 0)
+        now = time.time()
+        incremental = is_incremental(self.db_name)
+        return [task for task, interval in self.intervals.items()
+                if now - last_runs.get(task, first_start) >= interval and (task != 'vacuum' or incremental)]
+    
+    def run_due_tasks(self):
+        """执行所有到期的任务"""
+        for task in self.due_tasks():
+            if self._stop.is_set():
+                break
+            self.run_task(task)
+    
+    def start(self):
+        """启动计划线程"""
+        if self._thread is None:
+            _record_run(self.db_name, _FIRST_START, replace=False)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="maintenance-scheduler", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        """停止计划线程（正在执行的任务会先完成）"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_due_tasks()
+            self._stop.wait(self.check_interval)
+
+def _print_progress(task, done, total):
+    """在命令行中显示进度条"""
+    ratio = done / total if total else 1.0
+    bar = "#" * int(ratio * 30)
+    print(f"\r{TASK_NAMES[task]}: [{bar:<30}] {ratio * 100:5.1f}% ({done}/{total})", end="", flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="餐厅打卡数据库维护")
+    parser.add_argument("tasks", nargs="*", metavar="task",
+                        help="要执行的任务：backup / vacuum / analyze / all / due（只执行到期的任务）/ "
+                             "convert（旧数据库切换为增量整理模式，完整 VACUUM），默认 all")
+    parser.add_argument("--db", default="daka_records.db", help="数据库文件")
+    parser.add_argument("--backup-dir", default=DEFAULT_BACKUP_DIR, help="备份目录")
+    parser.add_argument("--keep", type=int, default=7, help="保留的备份数量")
+    args = parser.parse_args(argv)
+    for task in args.tasks:
+        if task not in ("backup", "vacuum", "analyze", "all", "due", "convert"):
+            parser.error(f"未知的维护任务: {task}")
+    
+    scheduler = MaintenanceScheduler(args.db, args.backup_dir, args.keep, progress=_print_progress)
+    tasks = []
+    for task in args.tasks or ["all"]:
+        if task == "all":
+            tasks += ["backup", "vacuum", "analyze"]
+        elif task == "due":
+            tasks += scheduler.due_tasks()
+        else:
+            tasks.append(task)
+    
+    ok = True
+    for task in dict.fromkeys(tasks):
+        start = time.perf_counter()
+        result = scheduler.run_task(task)
+        print(f"  {'完成' if result else '失败'} ({time.perf_counter() - start:.2f}s)"
+              + (f" -> {result}" if isinstance(result, str) else ""))
+        ok = ok and bool(result)
+    return 0 if ok else 1
+
+# 命令行：python maintenance.py [backup|vacuum|analyze|all|due|convert ...] [--db 数据库文件]
+if __name__ == "__main__":
+    raise SystemExit(main())
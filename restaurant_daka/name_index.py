@@ -0,0 +1,191 @@
+"""
+餐厅名称的模糊匹配索引
+餐厅名称是自由输入的，"海底捞" 和 "海底捞火锅" 会成为两家餐厅，统计结果被拆开。
+NameIndex 以名称的字符二元组（bigram）建立倒排索引，输入名称时快速找出相似的已有名称；
+确认是同一家餐厅后，用 DakaDatabase.merge_restaurants 把别名合并到规范名称。
+"""
+import argparse
+import re
+
+# 只用于生成候选的倒排表长度上限：很常见的二元组（例如 "火锅"）出现在大量名称中，
+# 已经有更少见的二元组提供候选时跳过它们，结果仍按完整的二元组集合计算相似度
+MAX_CANDIDATE_POSTING = 2000
+
+# 比较时忽略括号中的分店信息、空白和标点
+_BRANCH_PATTERN = re.compile(r'[（(【\[].*?[）)】\]]')
+_IGNORED_PATTERN = re.compile(r'[\s·・,，.。、\-_/]+')
+
+def normalize_name(name):
+    """比较用的名称：去掉分店信息、空白和标点，英文转为小写"""
+    stripped = _IGNORED_PATTERN.sub('', _BRANCH_PATTERN.sub('', name)).casefold()
+    return stripped or name.casefold()
+
+def name_grams(name):
+    """名称的字符二元组集合（单个字符的名称使用它本身）"""
+    text = normalize_name(name)
+    if len(text) < 2:
+        return frozenset((text,))
+    return frozenset(text[i:i + 2] for i in range(len(text) - 1))
+
+class NameIndex:
+    """餐厅名称的二元组倒排索引，支持增量添加和删除"""
+    
+    def __init__(self, names=()):
+        self._ids = {}        # 名称 -> 内部编号
+        self._names = []      # 内部编号 -> 名称（删除后为 None）
+        self._grams = []      # 内部编号 -> 二元组集合
+        self._postings = {}   # 二元组 -> 包含它的内部编号集合
+        for name in names:
+            self.add(name)
+    
+    @classmethod
+    def from_database(cls, db):
+        """用数据库中的餐厅名称建立索引（已合并的别名不包含在内）"""
+        aliases = db.get_restaurant_aliases()
+        return cls(name for name in db.get_restaurant_names().values() if name not in aliases)
+    
+    def __len__(self):
+        return len(self._ids)
+    
+    def __contains__(self, name):
+        return name in self._ids
+    
+    def add(self, name):
+        """添加一个名称（已存在时忽略）"""
+        if name in self._ids:
+            return
+        name_id = len(self._names)
+        grams = name_grams(name)
+        self._ids[name] = name_id
+        self._names.append(name)
+        self._grams.append(grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(name_id)
+    
+    def remove(self, name):
+        """删除一个名称（例如合并为别名后）"""
+        name_id = self._ids.pop(name, None)
+        if name_id is None:
+            return
+        for gram in self._grams[name_id]:
+            posting = self._postings[gram]
+            posting.discard(name_id)
+            if not posting:
+                del self._postings[gram]
+        self._names[name_id] = None
+    
+    def lookup(self, query, limit=5, min_similarity=0.5):
+        """
+        查找与 query 相似的名称（不包括 query 本身）
+        相似度为二元组集合的 Dice 系数：2 * 共同二元组数 / (两者二元组数之和)
+        返回 [(名称, 相似度), ...]，按相似度从高到低排序
+        """
+        query_grams = name_grams(query)
+        postings = sorted((self._postings[gram] for gram in query_grams if gram in self._postings), key=len)
+        
+        candidates = set()
+        for posting in postings:
+            if len(posting) > MAX_CANDIDATE_POSTING and candidates:
+                break
+            candidates.update(posting)
+        
+        results = []
+        query_size = len(query_grams)
+        exclude = self._ids.get(query)
+        for name_id in candidates:
+            if name_id == exclude:
+                continue
+            grams = self._grams[name_id]
+            # 共同二元组数不会超过两者中较小的集合，先用上界过滤
+            if 2 * min(query_size, len(grams)) / (query_size + len(grams)) < min_similarity:
+                continue
+            similarity = 2 * len(query_grams & grams) / (query_size + len(grams))
+            if similarity >= min_similarity:
+                results.append((self._names[name_id], similarity))
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:limit]
+    
+    def find_duplicates(self, min_similarity=0.6):
+        """找出所有相似的名称对 [(名称A, 名称B, 相似度), ...]，每对只出现一次"""
+        pairs = []
+        for name in list(self._ids):
+            for other, similarity in self.lookup(name, limit=20, min_similarity=min_similarity):
+                if name < other:
+                    pairs.append((name, other, similarity))
+        pairs.sort(key=lambda item: -item[2])
+        return pairs
+
+def _benchmark(count):
+    """生成 count 个随机名称，测量建立索引和查询的耗时"""
+    import random
+    import time
+    
+    chars = "海底捞火锅小四川湘菜馆老北京烤鸭店麻辣香锅串串面馆饺子王家李记张氏重庆成都广州深圳上海杭州"
+    suffixes = ["", "火锅", "餐厅", "(总店)", "（分店）", "小馆"]
+    random.seed(1)
+    names = {''.join(random.choice(chars) for _ in range(random.randint(2, 6))) + random.choice(suffixes)
+             for _ in range(count)}
+    
+    start = time.perf_counter()
+    index = NameIndex(names)
+    build = time.perf_counter() - start
+    
+    queries = random.sample(sorted(names), 200)
+    start = time.perf_counter()
+    for query in queries:
+        index.lookup(query[:-1] or query)
+    lookup = (time.perf_counter() - start) / len(queries)
+    print(f"{len(names)} 个不同的名称：建立索引 {build:.2f}s，平均每次查询 {lookup * 1000:.2f}ms")
+
+def main(argv=None):
+    from database import DakaDatabase
+    
+    parser = argparse.ArgumentParser(description="查找和合并重复的餐厅名称")
+    parser.add_argument("--db", default="daka_records.db", help="数据库文件")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    duplicates_parser = subparsers.add_parser("duplicates", help="列出可能重复的餐厅名称")
+    duplicates_parser.add_argument("--threshold", type=float, default=0.6, help="相似度阈值 (0-1)")
+    
+    lookup_parser = subparsers.add_parser("lookup", help="查找与给定名称相似的餐厅")
+    lookup_parser.add_argument("name")
+    
+    merge_parser = subparsers.add_parser("merge", help="把别名合并到规范名称（别名的记录改为规范名称）")
+    merge_parser.add_argument("alias")
+    merge_parser.add_argument("canonical")
+    
+    subparsers.add_parser("aliases", help="列出已合并的别名")
+    
+    bench_parser = subparsers.add_parser("bench", help="用随机名称测试索引性能")
+    bench_parser.add_argument("--count", type=int, default=100000, help="名称数量")
+    args = parser.parse_args(argv)
+    
+    if args.command == "bench":
+        _benchmark(args.count)
+        return 0
+    
+    db = DakaDatabase(args.db)
+    try:
+        if args.command == "merge":
+            moved = db.merge_restaurants(args.alias, args.canonical)
+            if moved is None:
+                return 1
+            print(f"已把 {args.alias} 合并到 {args.canonical}，{moved} 条记录")
+        elif args.command == "aliases":
+            for alias, canonical in sorted(db.get_restaurant_aliases().items()):
+                print(f"{alias} -> {canonical}")
+        else:
+            index = NameIndex.from_database(db)
+            if args.command == "lookup":
+                for name, similarity in index.lookup(args.name, limit=10):
+                    print(f"{similarity:.2f}  {name}")
+            else:
+                for name, other, similarity in index.find_duplicates(args.threshold):
+                    print(f"{similarity:.2f}  {name}  <->  {other}")
+    finally:
+        db.close()
+    return 0
+
+# 命令行：python name_index.py [--db 数据库文件] duplicates | lookup 名称 | merge 别名 规范名称 | aliases | bench
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,236 @@
+"""
+多进程统计
+按 rowid 范围拆分 records 表，每个工作进程使用独立的只读 SQLite 连接
+按餐厅 / 类型的整数键计算可合并的部分聚合（次数 / 总分 / 平方和），
+最后在主进程中合并并把整数键换回名称。
+结果与 statistics.py 中对应的串行函数一致。
+"""
+import math
+import os
+import sqlite3
+import time
+from multiprocessing import Pool
+from pathlib import Path
+from statistics import add_exact
+
+def _open_readonly(db_path):
+    """以只读模式打开数据库"""
+    uri = Path(os.path.abspath(db_path)).as_uri() + "?mode=ro"
+    return sqlite3.connect(uri, uri=True)
+
+def _accumulate(groups, key, score, order_key):
+    """把一条记录累加到分组 [次数, 总分的精确和, 平方和, 首次出现位置] 中"""
+    data = groups.get(key)
+    if data is None:
+        groups[key] = [1, [score], score * score, order_key]
+    else:
+        data[0] += 1
+        add_exact(data[1], score)
+        data[2] += score * score
+        if order_key > data[3]:
+            data[3] = order_key
+
+def compute_partial(task):
+    """
+    工作进程：计算一个 rowid 范围内的部分聚合
+    task 为 (数据库路径, 起始rowid, 结束rowid, 开始日期, 结束日期)
+    """
+    db_path, low, high, start_date, end_date = task
+    
+    sql = 'SELECT rowid, restaurant_id, type_id, date, score FROM records WHERE rowid BETWEEN ? AND ?'
+    params = [low, high]
+    if start_date and end_date:
+        sql += ' AND date BETWEEN ? AND ?'
+        params += [start_date, end_date]
+    
+    restaurants = {}
+    types = {}
+    total = [0, [], 0.0]
+    
+    conn = _open_readonly(db_path)
+    try:
+        for rowid, restaurant_id, type_id, date, score in conn.execute(sql, params):
+            # 串行函数按 ORDER BY date DESC, id DESC 的顺序遍历，
+            # 记录每个分组在该顺序下首次出现的位置（最大的 (日期, rowid)），合并后用于打破平分
+            order_key = (date, rowid)
+            _accumulate(restaurants, restaurant_id, score, order_key)
+            _accumulate(types, type_id, score, order_key)
+            total[0] += 1
+            add_exact(total[1], score)
+            total[2] += score * score
+    finally:
+        conn.close()
+    
+    return {"restaurants": restaurants, "types": types, "total": total}
+
+def merge_partials(partials):
+    """合并多个部分聚合，合并后的总分为精确求和的结果"""
+    merged = {"restaurants": {}, "types": {}, "total": [0, [], 0.0]}
+    
+    for partial in partials:
+        for group in ("restaurants", "types"):
+            target = merged[group]
+            for key, data in partial[group].items():
+                existing = target.get(key)
+                if existing is None:
+                    target[key] = [data[0], list(data[1]), data[2], data[3]]
+                else:
+                    existing[0] += data[0]
+                    for term in data[1]:
+                        add_exact(existing[1], term)
+                    existing[2] += data[2]
+                    if data[3] > existing[3]:
+                        existing[3] = data[3]
+        
+        merged["total"][0] += partial["total"][0]
+        for term in partial["total"][1]:
+            add_exact(merged["total"][1], term)
+        merged["total"][2] += partial["total"][2]
+    
+    for group in ("restaurants", "types"):
+        for data in merged[group].values():
+            data[1] = math.fsum(data[1])
+    merged["total"][1] = math.fsum(merged["total"][1])
+    
+    return merged
+
+def _load_names(db_path, table):
+    """读取维度表中整数键到名称的映射"""
+    conn = _open_readonly(db_path)
+    try:
+        return dict(conn.execute(f'SELECT id, name FROM {table}'))
+    finally:
+        conn.close()
+
+def _first_seen_order(groups):
+    """按串行遍历时的首次出现顺序排列分组"""
+    return sorted(groups.items(), key=lambda item: item[1][3], reverse=True)
+
+class ParallelStatisticsExecutor:
+    """并行统计执行器"""
+    
+    def __init__(self, db_path='daka_records.db', processes=None, chunks_per_process=4):
+        self.db_path = db_path
+        self.processes = processes or os.cpu_count() or 1
+        self.chunks_per_process = chunks_per_process
+    
+    def _split_ranges(self):
+        """按 rowid 范围切分任务"""
+        conn = _open_readonly(self.db_path)
+        try:
+            low, high = conn.execute('SELECT MIN(rowid), MAX(rowid) FROM records').fetchone()
+        finally:
+            conn.close()
+        
+        if low is None:
+            return []
+        
+        chunk_count = self.processes * self.chunks_per_process
+        step = max(1, math.ceil((high - low + 1) / chunk_count))
+        return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+    
+    def aggregate(self, start_date=None, end_date=None):
+        """计算并合并所有范围的部分聚合"""
+        tasks = [(self.db_path, low, high, start_date, end_date) for low, high in self._split_ranges()]
+        
+        if self.processes == 1 or len(tasks) <= 1:
+            partials = [compute_partial(task) for task in tasks]
+        else:
+            with Pool(self.processes) as pool:
+                partials = pool.map(compute_partial, tasks)
+        
+        merged = merge_partials(partials)
+        
+        # 工作进程只按整数键分组，合并后再换回名称
+        for group, table in (("restaurants", "restaurants"), ("types", "types")):
+            names = _load_names(self.db_path, table)
+            merged[group] = {names[key]: data for key, data in merged[group].items()}
+        
+        return merged
+    
+    def calculate_average_score(self, start_date=None, end_date=None):
+        """计算总体平均评分，对应 statistics.calculate_average_score"""
+        count, total, _ = self.aggregate(start_date, end_date)["total"]
+        return total / count if count else 0.0
+    
+    def calculate_restaurant_average_scores(self):
+        """计算每个餐厅的平均评分，对应 statistics.calculate_restaurant_average_scores"""
+        restaurants = self.aggregate()["restaurants"]
+        averages = [(name, data[1] / data[0]) for name, data in _first_seen_order(restaurants)]
+        averages.sort(key=lambda x: x[1], reverse=True)
+        return averages
+    
+    def find_most_common_type(self, start_date=None, end_date=None):
+        """找出最常打卡的类型，对应 statistics.find_most_common_type"""
+        types = self.aggregate(start_date, end_date)["types"]
+        if not types:
+            return "无记录"
+        
+        type_, data = max(_first_seen_order(types), key=lambda item: item[1][0])
+        return f"{type_} ({data[0]}次)"
+    
+    def calculate_restaurant_score_stats(self):
+        """
+        计算每个餐厅的打卡次数、平均分和标准差
+        返回 [(餐厅名称, 次数, 平均分, 标准差), ...]，按平均分从高到低排序
+        """
+        restaurants = self.aggregate()["restaurants"]
+        stats = []
+        for name, (count, total, total_sq, _) in _first_seen_order(restaurants):
+            avg = total / count
+            variance = max(total_sq / count - avg * avg, 0.0)
+            stats.append((name, count, avg, math.sqrt(variance)))
+        stats.sort(key=lambda x: x[2], reverse=True)
+        return stats
+
+def _create_benchmark_database(db_path, rows):
+    """生成用于性能测试的数据库"""
+    import random
+    from database import DakaDatabase
+    
+    db = DakaDatabase(db_path)
+    names = [f"餐厅{i}" for i in range(2000)]
+    types = ['火锅', '川菜', '粤菜', '湘菜', '鲁菜', '西餐', '日料', '韩餐', '快餐', '小吃', '其他']
+    batch = []
+    for _ in range(rows):
+        batch.append((random.choice(names), random.choice(types),
+                      f"20{random.randint(18, 24)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+                      round(random.uniform(0, 10), 1), "", None))
+        if len(batch) == 50000:
+            db.add_records(batch)
+            batch = []
+    if batch:
+        db.add_records(batch)
+    db.close()
+
+# 性能测试：python parallel_statistics.py [记录数]
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    from database import DakaDatabase
+    from statistics import calculate_restaurant_average_scores, find_most_common_type
+    
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "benchmark.db")
+        print(f"生成 {rows} 条测试记录...")
+        _create_benchmark_database(db_path, rows)
+        
+        start = time.perf_counter()
+        db = DakaDatabase(db_path)
+        records = db.get_all_records()
+        serial_scores = calculate_restaurant_average_scores(records)
+        serial_type = find_most_common_type(records)
+        db.close()
+        serial_time = time.perf_counter() - start
+        print(f"串行: {serial_time:.2f}s")
+        
+        for processes in range(1, (os.cpu_count() or 1) + 1):
+            executor = ParallelStatisticsExecutor(db_path, processes=processes)
+            start = time.perf_counter()
+            parallel_scores = executor.calculate_restaurant_average_scores()
+            parallel_type = executor.find_most_common_type()
+            elapsed = time.perf_counter() - start
+            
+            same = serial_type == parallel_type and serial_scores == parallel_scores
+            print(f"{processes} 进程: {elapsed:.2f}s  加速比 {serial_time / elapsed:.2f}x  结果一致: {same}")
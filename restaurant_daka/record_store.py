@@ -0,0 +1,271 @@
+"""
+紧凑的内存记录存储
+餐厅名称和类型只保存维度表中的整数编码，ID / 评分 / 日期序数保存在 array 中，
+短评和图片路径在第一次被访问时才从数据库一次性加载。
+记录通过 RecordView 访问，可以像 (id, 名称, 类型, 日期, 评分, 短评, 图片路径) 元组一样使用。
+"""
+import math
+from array import array
+from datetime import date, datetime
+from statistics import add_exact
+
+class RecordView:
+    """单条记录的轻量视图，不复制任何数据"""
+    __slots__ = ('store', 'index')
+    
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+    
+    def __len__(self):
+        return 7
+    
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return tuple(self.store.field(self.index, i) for i in range(*key.indices(7)))
+        if key < 0:
+            key += 7
+        return self.store.field(self.index, key)
+    
+    def __iter__(self):
+        return (self.store.field(self.index, i) for i in range(7))
+    
+    def __repr__(self):
+        return f"RecordView{tuple(self)!r}"
+    
+    @property
+    def id(self):
+        return self.store.ids[self.index]
+    
+    @property
+    def name(self):
+        return self.store.field(self.index, 1)
+    
+    @property
+    def type(self):
+        return self.store.field(self.index, 2)
+    
+    @property
+    def date(self):
+        return self.store.field(self.index, 3)
+    
+    @property
+    def score(self):
+        return self.store.scores[self.index]
+    
+    @property
+    def comment(self):
+        return self.store.field(self.index, 5)
+    
+    @property
+    def image_path(self):
+        return self.store.field(self.index, 6)
+
+class RecordStore:
+    """按列保存全部打卡记录，顺序与 get_all_records 相同（按日期从新到旧）"""
+    
+    def __init__(self, db):
+        self.db = db
+        self.clear()
+    
+    def clear(self):
+        """清空存储"""
+        self.restaurant_names = {}  # 餐厅ID -> 名称
+        self.type_names = {}        # 类型ID -> 名称
+        self.ids = array('q')
+        self.name_codes = array('l')
+        self.type_codes = array('l')
+        self.scores = array('d')
+        self.days = array('l')      # date.toordinal() 的结果
+        self._day_strings = {}      # 日期序数 -> 'YYYY-MM-DD'，同一天只保存一个字符串
+        self._raw_days = {}         # 记录ID -> 旧数据中未补零的日期字符串（如 2024-1-5）
+        self._positions = None      # 记录ID -> 下标，按需建立
+        self._comments = None       # 短评和图片路径，按需加载
+        self._image_paths = None
+    
+    def load(self):
+        """从数据库重新加载全部记录"""
+        self.clear()
+        self.restaurant_names = self.db.get_restaurant_names()
+        self.type_names = self.db.get_type_names()
+        
+        day_ordinals = {}
+        for record_id, restaurant_id, type_id, day, score in self.db.iter_record_keys():
+            ordinal = day_ordinals.get(day)
+            if ordinal is None:
+                # 按添加记录时的格式解析，旧数据中可能有未补零的日期
+                ordinal = day_ordinals[day] = datetime.strptime(day, "%Y-%m-%d").toordinal()
+                self._day_strings.setdefault(ordinal, date.fromordinal(ordinal).isoformat())
+            if day != self._day_strings[ordinal]:
+                self._raw_days[record_id] = day
+            self.ids.append(record_id)
+            self.name_codes.append(restaurant_id)
+            self.type_codes.append(type_id)
+            self.scores.append(score)
+            self.days.append(ordinal)
+        return len(self.ids)
+    
+    def _load_details(self):
+        """一次性加载所有记录的短评和图片路径"""
+        comments = [None] * len(self.ids)
+        image_paths = [None] * len(self.ids)
+        positions = self._get_positions()
+        for record_id, comment, image_path in self.db.iter_record_details():
+            index = positions.get(record_id)
+            if index is not None:
+                comments[index] = comment
+                image_paths[index] = image_path
+        self._comments = comments
+        self._image_paths = image_paths
+    
+    def details_loaded(self):
+        """短评和图片路径是否已经加载"""
+        return self._comments is not None
+    
+    def _get_positions(self):
+        """记录ID到下标的映射"""
+        if self._positions is None:
+            self._positions = {record_id: index for index, record_id in enumerate(self.ids)}
+        return self._positions
+    
+    def field(self, index, column):
+        """按 get_all_records 元组的列下标读取一个字段"""
+        if column == 0:
+            return self.ids[index]
+        if column == 1:
+            return self.restaurant_names[self.name_codes[index]]
+        if column == 2:
+            return self.type_names[self.type_codes[index]]
+        if column == 3:
+            if self._raw_days:
+                day = self._raw_days.get(self.ids[index])
+                if day is not None:
+                    return day
+            return self._day_strings[self.days[index]]
+        if column == 4:
+            return self.scores[index]
+        if column == 5 or column == 6:
+            if self._comments is None:
+                self._load_details()
+            return self._comments[index] if column == 5 else self._image_paths[index]
+        raise IndexError(column)
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.ids)
+        if not 0 <= index < len(self.ids):
+            raise IndexError(index)
+        return RecordView(self, index)
+    
+    def __iter__(self):
+        return (RecordView(self, index) for index in range(len(self.ids)))
+    
+    def get(self, record_id):
+        """按记录ID获取记录视图，不存在时返回 None"""
+        index = self._get_positions().get(int(record_id))
+        return None if index is None else RecordView(self, index)
+    
+    def remove(self, record_ids):
+        """从存储中移除记录（不重新读取数据库），返回移除的条数"""
+        positions = self._get_positions()
+        removed = {positions[int(record_id)] for record_id in record_ids if int(record_id) in positions}
+        if not removed:
+            return 0
+        
+        keep = [index for index in range(len(self.ids)) if index not in removed]
+        for name in ('ids', 'name_codes', 'type_codes', 'scores', 'days'):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, (column[index] for index in keep)))
+        if self._comments is not None:
+            self._comments = [self._comments[index] for index in keep]
+            self._image_paths = [self._image_paths[index] for index in keep]
+        self._positions = None
+        return len(removed)
+    
+    def get_types(self):
+        """获取有记录的类型名称"""
+        return sorted({self.type_names[code] for code in set(self.type_codes)})
+    
+    def get_restaurant_types(self, type_=None):
+        """
+        一次遍历得到每家餐厅的类型 {餐厅名称: 类型}（取该餐厅最新一条记录的类型）
+        type_ 不为空时只包括有该类型记录的餐厅
+        """
+        first = {}
+        for name_code, type_code in zip(self.name_codes, self.type_codes):
+            if type_ is None or self.type_names[type_code] == type_:
+                first.setdefault(name_code, type_code)
+        return {self.restaurant_names[name_code]: self.type_names[type_code] for name_code, type_code in first.items()}
+    
+    def _summarize(self, codes, names):
+        """按编码分组，返回 [(名称, 次数, 平均分), ...]（精确求和）"""
+        groups = {}
+        for code, score in zip(codes, self.scores):
+            data = groups.get(code)
+            if data is None:
+                groups[code] = [1, [score]]
+            else:
+                data[0] += 1
+                add_exact(data[1], score)
+        return [(names[code], count, math.fsum(total) / count) for code, (count, total) in groups.items()]
+    
+    def get_restaurant_score_summary(self):
+        """
+        按餐厅统计打卡次数和平均评分，与 DakaDatabase.get_restaurant_score_summary 相同
+        返回 [(餐厅名称, 打卡次数, 平均评分), ...]，按平均评分从高到低排序
+        """
+        summary = self._summarize(self.name_codes, self.restaurant_names)
+        summary.sort(key=lambda x: x[2], reverse=True)
+        return summary
+    
+    def get_type_summary(self):
+        """
+        按类型统计打卡次数和平均评分，与 DakaDatabase.get_type_summary 相同
+        返回 [(类型, 打卡次数, 平均评分), ...]，按打卡次数从多到少排序
+        """
+        summary = self._summarize(self.type_codes, self.type_names)
+        summary.sort(key=lambda x: x[1], reverse=True)
+        return summary
+
+# 内存对比：python record_store.py [记录数]
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+    import tracemalloc
+    from database import DakaDatabase
+    from parallel_statistics import _create_benchmark_database
+    
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "memory.db")
+        print(f"生成 {rows} 条测试记录...")
+        _create_benchmark_database(db_path, rows)
+        db = DakaDatabase(db_path)
+        
+        tracemalloc.start()
+        records = db.get_all_records()
+        tuple_bytes = tracemalloc.get_traced_memory()[0]
+        del records
+        tracemalloc.stop()
+        
+        tracemalloc.start()
+        store = RecordStore(db)
+        store.load()
+        store_bytes = tracemalloc.get_traced_memory()[0]
+        store.field(0, 5)
+        detail_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        
+        scale = 1000000 / rows
+        print(f"元组列表: {tuple_bytes * scale / 2 ** 20:.1f} MB/百万行")
+        print(f"RecordStore: {store_bytes * scale / 2 ** 20:.1f} MB/百万行 "
+              f"(加载短评后 {detail_bytes * scale / 2 ** 20:.1f} MB/百万行)")
+        print(f"节省: {(tuple_bytes - store_bytes) * scale / 2 ** 20:.1f} MB/百万行")
+        
+        same = [tuple(view) for view in store] == db.get_all_records()
+        print(f"与 get_all_records 结果一致: {same}")
+        db.close()
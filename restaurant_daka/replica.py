@@ -0,0 +1,206 @@
+"""
+内存副本的磁盘写回
+DakaDatabase(in_memory=True) 在内存数据库上执行写操作并提交后，把该事务的写语句交给
+ReplicaWriter，由后台线程按提交顺序批量重放到磁盘数据库。
+语句按相同顺序执行，自增 ID 和触发器维护的汇总表在内存和磁盘上保持一致。
+磁盘数据库暂时被锁住或 I/O 出错时稍后重试（间隔逐渐加长）；其他错误（例如约束冲突）重试也不会成功，
+写回线程停止，出错的事务保存在 failed_transaction 中，之后的提交抛出异常。
+"""
+import queue
+import sqlite3
+import threading
+import time
+
+# 暂时性错误的重试间隔（秒）：从 RETRY_DELAY 开始每次加倍，最长 MAX_RETRY_DELAY
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+
+# 重试可能成功的错误：数据库被其他连接锁住、I/O 错误
+_TRANSIENT_ERRORS = (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED, sqlite3.SQLITE_IOERR)
+
+def _is_transient(error):
+    """写回错误是否是暂时性的"""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in _TRANSIENT_ERRORS
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+def _replay(conn, transactions):
+    """在一个磁盘事务中重放这些事务，失败时回滚并抛出异常"""
+    try:
+        for statements in transactions:
+            for sql, seq_of_params in statements:
+                conn.executemany(sql, seq_of_params)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+class ReplicaWriter:
+    """后台批量写回线程"""
+    
+    def __init__(self, db_name, batch_interval=0.2):
+        self.db_name = db_name
+        self.batch_interval = batch_interval
+        self.error = None
+        self.failed_transaction = None  # 因非暂时性错误无法写回的事务（写回线程随之停止）
+        self.unwritten = []             # 写回停止之后没有写入磁盘的事务
+        self._queue = queue.Queue()
+        self._failed = []  # 暂时性错误导致写回失败、等待重试的事务
+        self._retry_delay = RETRY_DELAY
+        self._thread = threading.Thread(target=self._run, name="ReplicaWriter", daemon=True)
+        self._thread.start()
+    
+    def submit(self, statements):
+        """
+        提交一个已在内存中提交的事务，statements 为 [(sql, [参数, ...]), ...]
+        写回已经因非暂时性错误停止时抛出 RuntimeError
+        """
+        if self.failed_transaction is not None:
+            raise RuntimeError(f"写回磁盘数据库已停止: {self.error}")
+        self._queue.put(statements)
+    
+    def flush(self, timeout=None):
+        """等待此前提交的事务全部写入磁盘，成功返回 True"""
+        done = threading.Event()
+        self._queue.put(done)
+        if not done.wait(timeout):
+            return False
+        return self.error is None
+    
+    def close(self):
+        """写回剩余的事务并停止后台线程"""
+        result = self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        return result
+    
+    def _next_batch(self):
+        """
+        取出一批队列项：收到第一个事务后再等待 batch_interval，期间提交的事务合并为一次磁盘提交
+        有等待重试的事务时最多等待一个重试间隔
+        """
+        try:
+            batch = [self._queue.get(timeout=self._retry_delay if self._failed else None)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_interval
+        # 遇到 flush 或停止请求时立即写回
+        while isinstance(batch[-1], list):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        """后台线程：磁盘连接只在该线程中使用"""
+        conn = sqlite3.connect(self.db_name)
+        try:
+            running = True
+            while running:
+                batch = self._next_batch()
+                transactions = self._failed + [item for item in batch if isinstance(item, list)]
+                if self.failed_transaction is not None:
+                    self.unwritten.extend(transactions)
+                elif transactions:
+                    self._write_back(conn, transactions)
+                
+                for item in batch:
+                    if isinstance(item, threading.Event):
+                        item.set()
+                    elif item is None:
+                        running = False
+        finally:
+            conn.close()
+    
+    def _write_back(self, conn, transactions):
+        """把一批事务写回磁盘：暂时性错误留待重试，其他错误找出出错的事务并停止写回"""
+        try:
+            _replay(conn, transactions)
+        except Exception as e:
+            self.error = e
+            if _is_transient(e):
+                self._failed = transactions
+                print(f"写回磁盘数据库失败，{self._retry_delay:.1f} 秒后重试: {e}")
+                self._retry_delay = min(self._retry_delay * 2, MAX_RETRY_DELAY)
+                return
+            self._failed = []
+            # 逐个事务重新写回：出错之前的事务照常写入，出错的事务保留下来以便检查
+            for i, statements in enumerate(transactions):
+                try:
+                    _replay(conn, [statements])
+                except Exception as e:
+                    self.error = e
+                    self.failed_transaction = statements
+                    self.unwritten = transactions[i + 1:]
+                    print(f"写回磁盘数据库失败，已停止写回: {e}")
+                    return
+            # 单独写回时都成功了（原来的错误是暂时性的）
+            self.error = None
+            return
+        self._failed = []
+        self.error = None
+        self._retry_delay = RETRY_DELAY
+
+def _crash_child(db_path):
+    """崩溃测试的子进程：不断写入，每次 flush 成功后输出已确认的序号"""
+    from database import DakaDatabase
+    
+    db = DakaDatabase(db_path, in_memory=True)
+    i = 0
+    while True:
+        db.add_record(f"餐厅{i % 50}", "火锅", f"2024-01-{i % 28 + 1:02d}", i % 11, f"写入{i}")
+        if i % 10 == 9 and db.flush():
+            print(f"ACK {i}", flush=True)
+        i += 1
+
+# 崩溃测试：python replica.py [轮数]
+# 子进程在内存副本模式下持续写入，随机时刻被强制结束，
+# 检查磁盘数据库中包含所有已确认（flush 返回后）的写入，并且汇总表与记录一致
+if __name__ == "__main__":
+    import os
+    import random
+    import subprocess
+    import sys
+    import tempfile
+    
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        _crash_child(sys.argv[2])
+    
+    from database import DakaDatabase
+    
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    all_ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for round_ in range(1, rounds + 1):
+            db_path = os.path.join(tmp, f"crash{round_}.db")
+            DakaDatabase(db_path).close()
+            
+            child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", db_path],
+                                     stdout=subprocess.PIPE, text=True)
+            time.sleep(random.uniform(0.5, 2.0))
+            child.kill()
+            output, _ = child.communicate()
+            
+            acknowledged = [int(line.split()[1]) for line in output.splitlines() if line.startswith("ACK")]
+            last_ack = max(acknowledged, default=-1)
+            
+            db = DakaDatabase(db_path)
+            records = db.get_all_records()
+            comments = {record[5] for record in records}
+            lost = [i for i in range(last_ack + 1) if f"写入{i}" not in comments]
+            record_count = len(records)
+            daily_count = sum(count for count, _ in db.get_daily_stats("0000-01-01", "9999-12-31").values())
+            consistent = record_count == daily_count
+            db.close()
+            
+            ok = not lost and consistent
+            all_ok = all_ok and ok
+            print(f"第 {round_} 轮: 已确认 {last_ack + 1} 条, 磁盘上 {record_count} 条, "
+                  f"丢失 {len(lost)} 条, 汇总表一致: {consistent}")
+    
+    print("通过" if all_ok else "失败")
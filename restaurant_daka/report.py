@@ -0,0 +1,271 @@
+"""
+定期报表
+每份报表包括总体概况、类型分布、高分餐厅和上次报表之后的新打卡，输出为 HTML 和 CSV。
+概况、类型分布和餐厅排名直接读取由触发器维护的汇总表（type_stats / restaurant_stats），
+新打卡只读取变更日志中上次报表高水位之后的记录（记录在 export_marks 表中，名称为 report:<报表名>），
+生成一份报表的耗时与历史记录的多少无关。
+ReportScheduler 在后台线程中按计划生成报表。
+"""
+import argparse
+import csv
+import heapq
+import html
+import os
+import threading
+import time
+from datetime import datetime
+from database import DakaDatabase
+from statistics import get_top_restaurants_from_summary
+
+DEFAULT_OUTPUT_DIR = "reports"
+
+# 默认每周生成一次
+DEFAULT_INTERVAL = 7 * 24 * 3600
+
+# 高分餐厅排名的先验权重（与统计界面相同）
+PRIOR_WEIGHT = 5
+
+# HTML 中最多列出的新打卡条数（日期最新的，CSV 中包括全部）
+HTML_VISIT_LIMIT = 200
+
+NEW_VISIT_COLUMNS = ('id', 'uuid', 'name', 'type', 'date', 'score', 'comment', 'image_path')
+
+def _mark_name(name):
+    return f"report:{name}"
+
+def _write_csv(path, header, rows):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M') if timestamp else "—"
+
+def _html_table(header, rows):
+    lines = ["<table>", "<tr>" + "".join(f"<th>{html.escape(str(cell))}</th>" for cell in header) + "</tr>"]
+    for row in rows:
+        lines.append("<tr>" + "".join(f"<td>{html.escape(str(cell))}</td>" for cell in row) + "</tr>")
+    lines.append("</table>")
+    return "\n".join(lines)
+
+def _write_html(path, title, summary, types, top, visits, visit_count):
+    sections = [
+        "<h2>概况</h2>", _html_table(("项目", "数值"), summary),
+        "<h2>类型分布</h2>", _html_table(("类型", "打卡次数", "占比", "平均评分"), types),
+        "<h2>高分餐厅</h2>", _html_table(("排名", "餐厅", "排名评分", "打卡次数"), top),
+        f"<h2>新打卡（{visit_count} 条）</h2>",
+    ]
+    if visit_count:
+        sections.append(_html_table(("日期", "餐厅", "类型", "评分", "短评"), visits))
+        if visit_count > len(visits):
+            sections.append(f"<p>只列出最新的 {len(visits)} 条，全部新打卡见 new_visits.csv</p>")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; margin-bottom: 1em; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: left; }}
+th {{ background: #f0f0f0; }}
+</style>
+</head>
+<body>
+<h1>{html.escape(title)}</h1>
+{chr(10).join(sections)}
+</body>
+</html>
+""")
+
+def generate_report(db, output_dir=DEFAULT_OUTPUT_DIR, name='weekly', top=10):
+    """
+    生成一份报表，返回报表目录，失败时返回 None
+    目录 <output_dir>/<name>-YYYYmmdd-HHMMSS 中包括 report.html、summary.csv、types.csv、
+    top_restaurants.csv 和 new_visits.csv
+    新打卡为该报表上次生成之后添加或修改过的记录；第一次生成时只记录高水位，不列出新打卡
+    """
+    # 按是否记录过高水位判断第一次生成（在空数据库上生成过的报表高水位为 0）
+    marks = db.get_export_marks()
+    first = _mark_name(name) not in marks
+    mark, last_time = marks.get(_mark_name(name), (0, None))
+    now = time.time()
+    directory = os.path.join(output_dir, f"{name}-{datetime.fromtimestamp(now).strftime('%Y%m%d-%H%M%S')}")
+    # 汇总表、高水位和新打卡在同一个读事务中读取，生成期间的新变更留给下一份报表
+    db.conn.execute('BEGIN')
+    try:
+        os.makedirs(directory, exist_ok=True)
+        seq = db.get_change_seq()
+        type_stats = db.get_type_stats()
+        restaurant_stats = db.get_restaurant_stats()
+        
+        total_count = sum(count for _, count, _ in type_stats)
+        total_score = sum(count * average for _, count, average in type_stats)
+        types = [(type_, count, f"{count / total_count * 100:.1f}%", f"{average:.2f}")
+                 for type_, count, average in type_stats]
+        ranked = get_top_restaurants_from_summary(restaurant_stats, top, prior_weight=PRIOR_WEIGHT)
+        top_rows = [(rank, restaurant, f"{score:.2f}", count)
+                    for rank, (restaurant, score, count) in enumerate(ranked, 1)]
+        
+        # 新打卡逐行写入 CSV，HTML 只保留日期最新的 HTML_VISIT_LIMIT 条（按 (日期, ID) 的最小堆）
+        newest = []
+        visit_count = 0
+        visit_score = 0.0
+        with open(os.path.join(directory, "new_visits.csv"), 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(NEW_VISIT_COLUMNS)
+            if not first:
+                for row in db.iter_records_export(since_seq=mark):
+                    writer.writerow(row)
+                    visit_count += 1
+                    visit_score += row[5]
+                    item = (row[4], row[0], row[2], row[3], row[5], row[6] or "")
+                    if len(newest) < HTML_VISIT_LIMIT:
+                        heapq.heappush(newest, item)
+                    elif item > newest[0]:
+                        heapq.heapreplace(newest, item)
+        visits = [(day, restaurant, type_, score, comment)
+                  for day, _, restaurant, type_, score, comment in sorted(newest, reverse=True)]
+        
+        summary = [
+            ("生成时间", _format_time(now)),
+            ("上次报表", "（第一次生成）" if first else _format_time(last_time)),
+            ("打卡总数", total_count),
+            ("餐厅数", len(restaurant_stats)),
+            ("类型数", len(type_stats)),
+            ("总体平均评分", f"{total_score / total_count:.2f}" if total_count else "—"),
+            ("新打卡", visit_count),
+            ("新打卡平均评分", f"{visit_score / visit_count:.2f}" if visit_count else "—"),
+        ]
+        _write_csv(os.path.join(directory, "summary.csv"), ("项目", "数值"), summary)
+        _write_csv(os.path.join(directory, "types.csv"), ("类型", "打卡次数", "占比", "平均评分"), types)
+        _write_csv(os.path.join(directory, "top_restaurants.csv"), ("排名", "餐厅", "排名评分", "打卡次数"), top_rows)
+        _write_html(os.path.join(directory, "report.html"), f"餐厅打卡报表 {_format_time(now)}",
+                    summary, types, top_rows, visits, visit_count)
+    except Exception as e:
+        print(f"生成报表失败: {e}")
+        return None
+    finally:
+        db.conn.rollback()
+    if not db.set_export_mark(_mark_name(name), seq, now):
+        return None
+    return directory
+
+class ReportScheduler:
+    """在后台线程中按计划生成报表，使用独立的数据库连接"""
+    
+    def __init__(self, db_name, output_dir=DEFAULT_OUTPUT_DIR, name='weekly', interval=DEFAULT_INTERVAL,
+                 check_interval=600, top=10, on_report=None):
+        self.db_name = db_name
+        self.output_dir = output_dir
+        self.name = name
+        self.interval = interval
+        self.check_interval = check_interval
+        self.top = top
+        self.on_report = on_report
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def is_due(self, db):
+        """距离上次生成是否已经超过间隔（从未生成过时也算到期）"""
+        last_time = db.get_export_marks().get(_mark_name(self.name), (0, 0))[1]
+        return time.time() - last_time >= self.interval
+    
+    def run_if_due(self):
+        """到期时生成报表，返回报表目录（未到期或失败时返回 None）"""
+        db = DakaDatabase(self.db_name)
+        try:
+            if not self.is_due(db):
+                return None
+            directory = generate_report(db, self.output_dir, self.name, self.top)
+        finally:
+            db.close()
+        if directory and self.on_report:
+            self.on_report(directory)
+        return directory
+    
+    def start(self):
+        """启动计划线程"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="report-scheduler", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        """停止计划线程（正在生成的报表会先完成）"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_if_due()
+            self._stop.wait(self.check_interval)
+
+def _benchmark(sizes, new_visits=100):
+    """在不同历史规模下各生成两份报表（第二份包括 new_visits 条新打卡），比较耗时"""
+    import tempfile
+    from parallel_statistics import _create_benchmark_database
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            db_path = os.path.join(tmp, f"report{rows}.db")
+            _create_benchmark_database(db_path, rows)
+            db = DakaDatabase(db_path)
+            generate_report(db, tmp, name="bench")
+            db.add_records([(f"新餐厅{i % 20}", "火锅", "2024-06-01", i % 11, f"新打卡{i}", None)
+                            for i in range(new_visits)])
+            start = time.perf_counter()
+            directory = generate_report(db, tmp, name="bench")
+            elapsed = time.perf_counter() - start
+            with open(os.path.join(directory, "new_visits.csv"), encoding='utf-8-sig') as f:
+                listed = sum(1 for _ in f) - 1
+            print(f"{rows:>9} 条历史记录: 生成报表 {elapsed * 1000:7.1f}ms（新打卡 {listed} 条）")
+            db.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成餐厅打卡报表")
+    parser.add_argument("command", nargs="?", default="generate", choices=("generate", "due", "schedule", "bench"),
+                        help="generate 立即生成 / due 到期时才生成 / schedule 持续按计划生成 / bench 性能测试")
+    parser.add_argument("--db", default="daka_records.db", help="数据库文件")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_DIR, help="报表目录")
+    parser.add_argument("--name", default="weekly", help="报表名称（每个名称单独记录上次生成的位置）")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL / 86400, help="生成间隔（天）")
+    parser.add_argument("--top", type=int, default=10, help="高分餐厅的数量")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="bench 使用的历史记录数，逗号分隔")
+    args = parser.parse_args(argv)
+    
+    if args.command == "bench":
+        _benchmark([int(size) for size in args.sizes.split(",")])
+        return 0
+    
+    scheduler = ReportScheduler(args.db, args.output, args.name, args.interval * 86400, top=args.top,
+                                on_report=lambda directory: print(f"已生成报表: {directory}"))
+    if args.command == "schedule":
+        scheduler.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            scheduler.stop()
+        return 0
+    if args.command == "due":
+        scheduler.run_if_due()
+        return 0
+    
+    db = DakaDatabase(args.db)
+    try:
+        directory = generate_report(db, args.output, args.name, args.top)
+    finally:
+        db.close()
+    if directory is None:
+        return 1
+    print(f"已生成报表: {directory}")
+    return 0
+
+# 命令行：python report.py [generate|due|schedule|bench] [--db 数据库文件] [--output 报表目录] [--name 报表名称]
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,382 @@
+"""
+"相似餐厅" 推荐
+每家餐厅的全部短评拼接为一篇文档，按字符二元组（适合中文，不需要分词）计算 TF-IDF 向量，
+用余弦相似度找出短评内容相近的餐厅，再结合平均评分的接近程度排序。
+向量以倒排表的形式保存在数据库的 similarity_terms 表中，
+查询时只读取查询餐厅的主要词项的倒排表，不需要与每家餐厅逐一比较。
+records 上的触发器（与 data_version 一样）把记录有变化的餐厅写入 similarity_dirty 表，
+无论记录是从界面、sync、归档还是合并餐厅修改的；增量更新只重新计算这些餐厅，
+可以分批进行（图形界面在空闲时每次更新一批，不阻塞启动）。
+"""
+import argparse
+import json
+import math
+import re
+import sqlite3
+
+# 相似度中短评内容所占的权重，其余为平均评分的接近程度
+TEXT_WEIGHT = 0.8
+
+# 查询时只使用权重最高的若干词项；出现在过多餐厅中的词项区分度低，它们的倒排表不读取
+QUERY_TERMS = 40
+MAX_POSTING = 5000
+
+# 餐厅数量变化超过该比例后，用新的 IDF 重新计算所有文档的向量长度
+NORM_REFRESH_RATIO = 0.1
+
+_IGNORED_PATTERN = re.compile(r'[\s\W_]+')
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS similarity_terms (
+        restaurant_id INTEGER NOT NULL,
+        term TEXT NOT NULL,
+        weight REAL NOT NULL,  -- 1 + ln(词频)
+        PRIMARY KEY (restaurant_id, term)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_similarity_terms_term ON similarity_terms (term, restaurant_id, weight);
+    
+    CREATE TABLE IF NOT EXISTS similarity_df (
+        term TEXT PRIMARY KEY,
+        df INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    
+    CREATE TABLE IF NOT EXISTS similarity_docs (
+        restaurant_id INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL,
+        average REAL NOT NULL,
+        norm REAL NOT NULL
+    );
+    
+    CREATE TABLE IF NOT EXISTS similarity_state (
+        key TEXT PRIMARY KEY,
+        value REAL NOT NULL
+    );
+    
+    -- 记录有变化、需要重新计算的餐厅
+    CREATE TABLE IF NOT EXISTS similarity_dirty (
+        restaurant_id INTEGER PRIMARY KEY
+    );
+    CREATE TRIGGER IF NOT EXISTS records_similarity_insert AFTER INSERT ON records
+    BEGIN
+        INSERT OR IGNORE INTO similarity_dirty (restaurant_id) VALUES (NEW.restaurant_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS records_similarity_delete AFTER DELETE ON records
+    BEGIN
+        INSERT OR IGNORE INTO similarity_dirty (restaurant_id) VALUES (OLD.restaurant_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS records_similarity_update AFTER UPDATE OF restaurant_id, score, comment ON records
+    BEGIN
+        INSERT OR IGNORE INTO similarity_dirty (restaurant_id) VALUES (OLD.restaurant_id), (NEW.restaurant_id);
+    END;
+'''
+
+def comment_terms(text):
+    """短评的字符二元组词频 {词项: 次数}（标点和空白处断开，英文转为小写）"""
+    counts = {}
+    for part in _IGNORED_PATTERN.split(text.casefold()):
+        if len(part) == 1:
+            counts[part] = counts.get(part, 0) + 1
+        for i in range(len(part) - 1):
+            gram = part[i:i + 2]
+            counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+class SimilarityIndex:
+    """
+    用法：
+        index = SimilarityIndex('daka_records.db')
+        index.update()                      # 增量更新（第一次调用时建立完整索引）
+        index.similar('海底捞', k=5)        # [(餐厅名称, 相似度, 平均评分, 打卡次数), ...]
+        index.close()
+    
+    conn 为已打开的连接时直接使用它（不会关闭），见 from_database
+    """
+    
+    def __init__(self, db_name='daka_records.db', conn=None):
+        self.db_name = db_name
+        self._owns_conn = conn is None
+        self.conn = sqlite3.connect(db_name, timeout=30) if conn is None else conn
+        self.conn.executescript(_SCHEMA)
+        self.conn.commit()
+    
+    @classmethod
+    def from_database(cls, db):
+        """
+        使用 DakaDatabase 当前的连接，索引读到的记录与界面显示的一致
+        内存副本模式下索引保存在内存中；磁盘数据库上同样建立触发器，写回的改动会标记到磁盘上的索引
+        """
+        if db.replica:
+            cls(db.db_name).close()
+        return cls(db.db_name, conn=db.conn)
+    
+    def close(self):
+        if self._owns_conn:
+            self.conn.close()
+    
+    def _state(self, key, default=0):
+        row = self.conn.execute('SELECT value FROM similarity_state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+    
+    def _set_state(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO similarity_state (key, value) VALUES (?, ?)', (key, value))
+    
+    def _idf(self, df, docs):
+        return math.log((1 + docs) / (1 + df)) + 1
+    
+    def _reset(self):
+        """丢弃已有索引，把所有餐厅标记为需要重新计算"""
+        self.conn.execute('DELETE FROM similarity_terms')
+        self.conn.execute('DELETE FROM similarity_df')
+        self.conn.execute('DELETE FROM similarity_docs')
+        self.conn.execute('DELETE FROM similarity_dirty')
+        self.conn.execute('INSERT INTO similarity_dirty (restaurant_id) SELECT DISTINCT restaurant_id FROM records')
+        self.conn.execute("DELETE FROM similarity_state WHERE key = 'seq'")
+        self._set_state('norm_docs', 0)
+        self._set_state('built', 1)
+    
+    def pending(self):
+        """还需要重新计算的餐厅数"""
+        if not self._state('built'):
+            return self.conn.execute('SELECT COUNT(DISTINCT restaurant_id) FROM records').fetchone()[0]
+        return self.conn.execute('SELECT COUNT(*) FROM similarity_dirty').fetchone()[0]
+    
+    def update(self, limit=None):
+        """
+        重新计算有记录添加、删除或修改的餐厅（第一次调用时为全部餐厅），
+        limit 不为 None 时最多计算这么多家，其余留给下一次调用（见 pending）
+        返回重新计算的餐厅数，失败时返回 None
+        """
+        try:
+            if not self._state('built'):
+                self._reset()
+            restaurant_ids = [row[0] for row in self.conn.execute(
+                'SELECT restaurant_id FROM similarity_dirty ORDER BY restaurant_id LIMIT ?',
+                (-1 if limit is None else limit,))]
+            if not restaurant_ids:
+                self.conn.commit()
+                return 0
+            self._reindex(restaurant_ids)
+            self.conn.execute('DELETE FROM similarity_dirty WHERE restaurant_id IN (SELECT value FROM json_each(?))',
+                              (json.dumps(restaurant_ids),))
+            
+            docs = self.conn.execute('SELECT COUNT(*) FROM similarity_docs').fetchone()[0]
+            norm_docs = self._state('norm_docs')
+            remaining = self.conn.execute('SELECT EXISTS (SELECT 1 FROM similarity_dirty)').fetchone()[0]
+            if not remaining and abs(docs - norm_docs) > NORM_REFRESH_RATIO * norm_docs:
+                # IDF 随餐厅数量缓慢变化，全部更新完且变化较大时才重新计算全部向量长度
+                self._refresh_norms(None, docs)
+                self._set_state('norm_docs', docs)
+            else:
+                self._refresh_norms(restaurant_ids, norm_docs or docs)
+            self.conn.commit()
+            return len(restaurant_ids)
+        except Exception as e:
+            self.conn.rollback()
+            print(f"更新相似餐厅索引失败: {e}")
+            return None
+    
+    def rebuild(self):
+        """丢弃已有索引，为所有餐厅重新建立，返回餐厅数，失败时返回 None"""
+        try:
+            self._reset()
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"建立相似餐厅索引失败: {e}")
+            return None
+        return self.update()
+    
+    def _reindex(self, restaurant_ids):
+        """在当前事务中重新计算这些餐厅的词项和文档频率（向量长度由调用者计算）"""
+        conn = self.conn
+        for restaurant_id in restaurant_ids:
+            old_terms = [row[0] for row in conn.execute(
+                'SELECT term FROM similarity_terms WHERE restaurant_id = ?', (restaurant_id,))]
+            conn.executemany('UPDATE similarity_df SET df = df - 1 WHERE term = ?', ((term,) for term in old_terms))
+            conn.execute('DELETE FROM similarity_terms WHERE restaurant_id = ?', (restaurant_id,))
+            conn.execute('DELETE FROM similarity_docs WHERE restaurant_id = ?', (restaurant_id,))
+            
+            count, average = conn.execute(
+                'SELECT COUNT(*), AVG(score) FROM records WHERE restaurant_id = ?', (restaurant_id,)).fetchone()
+            if not count:
+                continue
+            counts = {}
+            for (comment,) in conn.execute(
+                    "SELECT comment FROM records WHERE restaurant_id = ? AND comment <> ''", (restaurant_id,)):
+                for term, n in comment_terms(comment).items():
+                    counts[term] = counts.get(term, 0) + n
+            conn.executemany('INSERT INTO similarity_terms (restaurant_id, term, weight) VALUES (?, ?, ?)',
+                             ((restaurant_id, term, 1 + math.log(n)) for term, n in counts.items()))
+            conn.executemany('''
+                INSERT INTO similarity_df (term, df) VALUES (?, 1)
+                ON CONFLICT (term) DO UPDATE SET df = df + 1
+            ''', ((term,) for term in counts))
+            # 向量长度先记为 0，下面统一计算
+            conn.execute('INSERT INTO similarity_docs (restaurant_id, count, average, norm) VALUES (?, ?, ?, 0)',
+                         (restaurant_id, count, average))
+        conn.execute('DELETE FROM similarity_df WHERE df <= 0')
+    
+    def _refresh_norms(self, restaurant_ids, docs):
+        """按 docs 篇文档的 IDF 计算向量长度（restaurant_ids 为 None 时计算全部）"""
+        if restaurant_ids is None:
+            rows = self.conn.execute('''
+                SELECT similarity_terms.restaurant_id, similarity_terms.weight, similarity_df.df
+                FROM similarity_terms JOIN similarity_df USING (term)
+            ''')
+        else:
+            rows = self.conn.execute(f'''
+                SELECT similarity_terms.restaurant_id, similarity_terms.weight, similarity_df.df
+                FROM similarity_terms JOIN similarity_df USING (term)
+                WHERE similarity_terms.restaurant_id IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(list(restaurant_ids)),))
+        squares = {}
+        for restaurant_id, weight, df in rows:
+            value = weight * self._idf(df, docs)
+            squares[restaurant_id] = squares.get(restaurant_id, 0.0) + value * value
+        self.conn.executemany('UPDATE similarity_docs SET norm = ? WHERE restaurant_id = ?',
+                              ((math.sqrt(square), restaurant_id) for restaurant_id, square in squares.items()))
+    
+    def similar(self, restaurant_name, k=5):
+        """
+        与 restaurant_name 最相似的 k 家餐厅（已合并的别名按规范餐厅查询）
+        返回 [(餐厅名称, 相似度, 平均评分, 打卡次数), ...]，按相似度从高到低排序
+        """
+        conn = self.conn
+        row = conn.execute('''
+            SELECT IFNULL((SELECT canonical_id FROM restaurant_aliases WHERE alias_id = restaurants.id), restaurants.id)
+            FROM restaurants WHERE name = ?
+        ''', (restaurant_name,)).fetchone()
+        if row is None:
+            return []
+        restaurant_id = row[0]
+        doc = conn.execute('SELECT average, norm FROM similarity_docs WHERE restaurant_id = ?', (restaurant_id,)).fetchone()
+        if doc is None or not doc[1]:
+            return []
+        average, norm = doc
+        docs = self._state('norm_docs') or 1
+        
+        query = [(weight * self._idf(df, docs), term, df) for term, weight, df in conn.execute('''
+            SELECT similarity_terms.term, similarity_terms.weight, similarity_df.df
+            FROM similarity_terms JOIN similarity_df USING (term)
+            WHERE similarity_terms.restaurant_id = ?
+        ''', (restaurant_id,))]
+        query.sort(reverse=True)
+        # 全部词项都很常见时只用权重最高的几个
+        selected = [item for item in query if item[2] <= MAX_POSTING][:QUERY_TERMS] or query[:3]
+        
+        # 只累加选中词项的倒排表：得到与查询共有这些词项的餐厅的点积
+        dots = {}
+        for value, term, df in selected:
+            idf = self._idf(df, docs)
+            for other_id, weight in conn.execute(
+                    'SELECT restaurant_id, weight FROM similarity_terms WHERE term = ?', (term,)):
+                dots[other_id] = dots.get(other_id, 0.0) + value * weight * idf
+        dots.pop(restaurant_id, None)
+        if not dots:
+            return []
+        
+        results = []
+        for other_id, name, count, other_average, other_norm in conn.execute('''
+            SELECT similarity_docs.restaurant_id, restaurants.name, similarity_docs.count,
+                   similarity_docs.average, similarity_docs.norm
+            FROM similarity_docs JOIN restaurants ON restaurants.id = similarity_docs.restaurant_id
+            WHERE similarity_docs.restaurant_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(list(dots)),)):
+            if not other_norm:
+                continue
+            text = dots[other_id] / (norm * other_norm)
+            score = 1 - abs(average - other_average) / 10
+            results.append((name, TEXT_WEIGHT * text + (1 - TEXT_WEIGHT) * score, other_average, count))
+        results.sort(key=lambda item: -item[1])
+        return results[:k]
+
+def _benchmark(restaurants, records_per_restaurant):
+    """生成测试数据库，测量建立索引、增量更新和查询的耗时，并与逐一比较的结果对照"""
+    import os
+    import random
+    import tempfile
+    import time
+    from database import DakaDatabase
+    
+    # 由常用字随机组成的词表，每家餐厅的短评偏好其中一部分词
+    chars = ("汤底麻辣鲜香服务热情排队太久环境干净价格实惠偏贵牛肉毛肚寿司刺身拉面烤鸭酥脆甜点咖啡披萨"
+             "芝士清淡分量很足上菜快装修好看停车方便适合聚餐约会一般酸菜鱼羊肉串火锅底料海鲜粥包子饺子")
+    random.seed(1)
+    words = list({"".join(random.sample(chars, 2)) for _ in range(3000)})
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "similarity.db")
+        db = DakaDatabase(db_path)
+        batch = []
+        for i in range(restaurants):
+            # 每家餐厅偏好一部分词
+            favourites = random.sample(words, 8)
+            for _ in range(records_per_restaurant):
+                comment = "，".join("".join(random.sample(favourites, 2)) for _ in range(3))
+                batch.append((f"餐厅{i}", "其他", "2024-01-01", random.randint(5, 10), comment, None))
+        db.add_records(batch)
+        
+        index = SimilarityIndex(db_path)
+        start = time.perf_counter()
+        index.update()
+        build = time.perf_counter() - start
+        
+        db.add_records([("餐厅0", "其他", "2024-02-01", 9, "汤底麻辣，毛肚鲜香", None),
+                        ("新餐厅", "其他", "2024-02-01", 8, "汤底麻辣，服务热情", None)])
+        start = time.perf_counter()
+        updated = index.update()
+        incremental = time.perf_counter() - start
+        
+        names = [f"餐厅{i}" for i in random.sample(range(restaurants), 50)]
+        start = time.perf_counter()
+        for name in names:
+            index.similar(name)
+        lookup = (time.perf_counter() - start) / len(names)
+        
+        print(f"{restaurants} 家餐厅，每家 {records_per_restaurant} 条短评")
+        print(f"建立索引 {build:.2f}s，增量更新 {updated} 家餐厅 {incremental * 1000:.1f}ms，"
+              f"平均每次查询 {lookup * 1000:.1f}ms")
+        print(f"餐厅0 的相似餐厅: {[(name, round(similarity, 3)) for name, similarity, _, _ in index.similar('餐厅0')]}")
+        index.close()
+        db.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="相似餐厅索引")
+    parser.add_argument("--db", default="daka_records.db", help="数据库文件")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    subparsers.add_parser("update", help="增量更新索引")
+    subparsers.add_parser("rebuild", help="重新建立索引")
+    
+    similar_parser = subparsers.add_parser("similar", help="查找相似的餐厅")
+    similar_parser.add_argument("name")
+    similar_parser.add_argument("-k", type=int, default=5, help="返回的餐厅数")
+    
+    bench_parser = subparsers.add_parser("bench", help="用生成的数据测试性能")
+    bench_parser.add_argument("--restaurants", type=int, default=20000, help="餐厅数量")
+    bench_parser.add_argument("--records", type=int, default=5, help="每家餐厅的记录数")
+    args = parser.parse_args(argv)
+    
+    if args.command == "bench":
+        _benchmark(args.restaurants, args.records)
+        return 0
+    
+    index = SimilarityIndex(args.db)
+    try:
+        if args.command == "rebuild":
+            print(f"已为 {index.rebuild()} 家餐厅建立索引")
+        elif args.command == "update":
+            updated = index.update()
+            if updated is None:
+                return 1
+            print(f"已更新 {updated} 家餐厅")
+        else:
+            index.update()
+            for name, similarity, average, count in index.similar(args.name, args.k):
+                print(f"{similarity:.3f}  {name}  (平均 {average:.1f} 分, {count} 次)")
+    finally:
+        index.close()
+    return 0
+
+# 命令行：python similarity_index.py [--db 数据库文件] update | rebuild | similar 名称 | bench
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,4 +1,27 @@
 # 保持原有功能不变，但添加更多统计函数
+import heapq
+import math
+
+# add_exact 中未压缩的数值达到该数量时压缩为精确和的若干项
+_EXACT_BUFFER_SIZE = 256
+
+def _exact_terms(values):
+    """把一组浮点数的精确和表示为若干个互不重叠的浮点数（通常只有一两项）"""
+    terms = []
+    while True:
+        term = math.fsum(values + [-t for t in terms])
+        if term == 0.0:
+            return terms
+        terms.append(term)
+
+def add_exact(partials, value):
+    """
+    把 value 累加到精确和 partials 中，math.fsum(partials) 即全部数值的精确舍入和，与累加顺序无关
+    partials 最多保存 _EXACT_BUFFER_SIZE 个数，可以像 (次数, 总分) 一样逐条累加和跨进程合并
+    """
+    partials.append(value)
+    if len(partials) >= _EXACT_BUFFER_SIZE:
+        partials[:] = _exact_terms(partials)
 
 def calculate_average_score(records, restaurant_name=None, type_=None, start_date=None, end_date=None):
     """
@@ -26,7 +49,8 @@ def calculate_average_score(records, restaurant_name=None, type_=None, start_dat
     if not filtered_records:
         return 0.0
     
-    total_score = sum(record[4] for record in filtered_records)
+    # 使用精确求和，结果与记录顺序无关（便于与并行统计结果保持一致）
+    total_score = math.fsum(record[4] for record in filtered_records)
     return total_score / len(filtered_records)
 
 def calculate_restaurant_average_scores(records):
@@ -37,21 +61,21 @@ def calculate_restaurant_average_scores(records):
     if not records:
         return []
     
-    # 按餐厅名称分组，计算平均分
+    # 按餐厅名称分组，累加精确和（结果与记录顺序无关）
     restaurant_scores = {}
     for record in records:
         name = record[1]
         score = record[4]
         if name not in restaurant_scores:
-            restaurant_scores[name] = {"total": score, "count": 1}
+            restaurant_scores[name] = {"total": [score], "count": 1}
         else:
-            restaurant_scores[name]["total"] += score
+            add_exact(restaurant_scores[name]["total"], score)
             restaurant_scores[name]["count"] += 1
     
     # 计算平均分
     restaurant_averages = []
     for name, data in restaurant_scores.items():
-        avg = data["total"] / data["count"]
+        avg = math.fsum(data["total"]) / data["count"]
         restaurant_averages.append((name, avg))
     
     # 按评分从高到低排序
@@ -86,10 +110,78 @@ def find_most_common_type(records, start_date=None, end_date=None):
     most_common = max(type_count.items(), key=lambda x: x[1])
     return f"{most_common[0]} ({most_common[1]}次)"
 
-def get_top_restaurants(records, limit=5, type_=None):
+def bayesian_average(total, count, prior_mean, prior_weight):
+    """
+    计算贝叶斯加权平均分
+    prior_weight 相当于先验的"虚拟打卡次数"，打卡次数越少，结果越接近 prior_mean
+    """
+    if count + prior_weight <= 0:
+        return 0.0
+    return (total + prior_mean * prior_weight) / (count + prior_weight)
+
+def _rank_partition(restaurant_scores, limit, prior_weight, prior_mean):
+    """
+    对一个分区内的餐厅使用堆进行有界选取，返回前 limit 个
+    restaurant_scores: {餐厅名称: [总分, 次数]}
+    """
+    if prior_mean is None:
+        # 默认使用分区自身的平均分作为先验
+        total = sum(data[0] for data in restaurant_scores.values())
+        count = sum(data[1] for data in restaurant_scores.values())
+        prior_mean = total / count if count else 0.0
+    
+    ranked = (
+        (name, bayesian_average(data[0], data[1], prior_mean, prior_weight), data[1])
+        for name, data in restaurant_scores.items()
+    )
+    # heapq.nlargest 只维护大小为 limit 的堆，且与 sorted(..., reverse=True)[:limit] 结果一致
+    return heapq.nlargest(limit, ranked, key=lambda x: x[1])
+
+def get_top_restaurants_by_type(records, limit=5, prior_weight=0, prior_mean=None):
+    """
+    一次遍历同时计算总体和每个类型分区的高分餐厅
+    prior_weight 为先验权重（0 表示普通平均分），prior_mean 为先验平均分（默认取分区平均分）
+    返回字典：键 None 表示总体排名，其余键为类型，
+    值为 [(餐厅名称, 排名评分, 打卡次数), ...]
+    """
+    if not records:
+        return {None: []}
+    
+    # 一次遍历，同时累加总体和各类型的餐厅分数
+    overall = {}
+    partitions = {}
+    for record in records:
+        name = record[1]
+        type_ = record[2]
+        score = record[4]
+        
+        data = overall.get(name)
+        if data is None:
+            overall[name] = [score, 1]
+        else:
+            data[0] += score
+            data[1] += 1
+        
+        type_scores = partitions.get(type_)
+        if type_scores is None:
+            type_scores = partitions[type_] = {}
+        data = type_scores.get(name)
+        if data is None:
+            type_scores[name] = [score, 1]
+        else:
+            data[0] += score
+            data[1] += 1
+    
+    result = {None: _rank_partition(overall, limit, prior_weight, prior_mean)}
+    for type_, type_scores in partitions.items():
+        result[type_] = _rank_partition(type_scores, limit, prior_weight, prior_mean)
+    
+    return result
+
+def get_top_restaurants(records, limit=5, type_=None, prior_weight=0, prior_mean=None):
     """
     获取评分最高的餐厅
-    可以按类型筛选
+    可以按类型筛选，prior_weight > 0 时使用贝叶斯加权平均分排名
     """
     if not records:
         return []
@@ -104,29 +196,93 @@ def get_top_restaurants(records, limit=5, type_=None):
     if not filtered_records:
         return []
     
-    # 按餐厅名称分组，计算平均分
-    restaurant_scores = {}
-    for record in filtered_records:
-        name = record[1]
-        score = record[4]
-        if name not in restaurant_scores:
-            restaurant_scores[name] = {"total": score, "count": 1}
+    top_restaurants = get_top_restaurants_by_type(
+        filtered_records, limit=limit, prior_weight=prior_weight, prior_mean=prior_mean
+    )[None]
+    
+    return [(name, score) for name, score, _ in top_restaurants]
+
+def get_top_restaurants_from_summary(summary, limit=5, prior_weight=0, prior_mean=None):
+    """
+    按已经汇总好的 [(餐厅名称, 打卡次数, 平均评分), ...]（例如 DakaDatabase.get_restaurant_stats）排名，
+    不需要遍历记录；参数与 get_top_restaurants_by_type 相同
+    返回 [(餐厅名称, 排名评分, 打卡次数), ...]
+    """
+    restaurant_scores = {name: [count * average, count] for name, count, average in summary}
+    return _rank_partition(restaurant_scores, limit, prior_weight, prior_mean)
+
+def calculate_growth_rates(series):
+    """
+    计算时间序列中打卡次数的环比增长率
+    series 为 DakaDatabase.get_checkin_series 的返回值
+    返回 [(时间段, 增长率%), ...]，上一期没有打卡时增长率为 None
+    """
+    rates = []
+    previous = None
+    for bucket, count, _ in series:
+        if previous:
+            rates.append((bucket, (count - previous) / previous * 100))
         else:
-            restaurant_scores[name]["total"] += score
-            restaurant_scores[name]["count"] += 1
+            rates.append((bucket, None))
+        previous = count
+    return rates
+
+def calculate_type_mix_changes(type_mix_series):
+    """
+    计算每个时间段的类型占比及环比变化
+    type_mix_series 为 DakaDatabase.get_type_mix_series 的返回值
+    返回 [(时间段, [(类型, 次数, 占比%, 较上期变化的百分点), ...]), ...]，类型按次数从多到少排列
+    """
+    result = []
+    previous_shares = {}
+    for bucket, mix in type_mix_series:
+        total = sum(mix.values())
+        shares = {type_: count / total * 100 for type_, count in mix.items()} if total else {}
+        
+        rows = []
+        for type_, count in sorted(mix.items(), key=lambda x: x[1], reverse=True):
+            share = shares[type_]
+            rows.append((type_, count, share, share - previous_shares.get(type_, 0.0)))
+        
+        result.append((bucket, rows))
+        previous_shares = shares
     
-    # 计算平均分
-    for name in restaurant_scores:
-        restaurant_scores[name]["average"] = restaurant_scores[name]["total"] / restaurant_scores[name]["count"]
-    
-    # 排序并返回前N个
-    top_restaurants = sorted(
-        [(name, data["average"]) for name, data in restaurant_scores.items()],
-        key=lambda x: x[1],
-        reverse=True
-    )
+    return result
+
+def get_score_distribution(db, bin_width=1.0, restaurant_name=None, type_=None):
+    """
+    获取评分分布（直方图由数据库计算）
+    返回 [(区间标签, 记录数, 占比%, 累计占比%), ...]
+    """
+    histogram = db.get_score_histogram(bin_width, restaurant_name=restaurant_name, type_=type_)
+    total = sum(count for _, _, count in histogram)
     
-    return top_restaurants[:limit]
+    distribution = []
+    cumulative = 0
+    for low, high, count in histogram:
+        cumulative += count
+        percentage = count / total * 100 if total else 0.0
+        cumulative_percentage = cumulative / total * 100 if total else 0.0
+        distribution.append((f"{low:g}-{high:g}", count, percentage, cumulative_percentage))
+    return distribution
+
+def get_percentile_summary(db, group_by='name', min_count=1):
+    """
+    获取每个餐厅或类型的评分中位数和 P90（由数据库窗口函数计算）
+    可以用 min_count 过滤掉打卡次数太少的分组
+    返回 [(名称, 记录数, 中位数, P90), ...]，按中位数从高到低排序
+    """
+    return [row for row in db.get_score_percentiles(group_by) if row[1] >= min_count]
+
+def get_visit_percentile_rank(db, record_id, restaurant_name):
+    """
+    获取某次打卡在所属餐厅内的百分位排名
+    返回 (百分位排名 0-100, 四分位档次 1-4)，找不到记录时返回 None
+    """
+    for row in db.get_visit_percentiles(restaurant_name):
+        if str(row[0]) == str(record_id):
+            return row[4] * 100, row[5]
+    return None
 
 # 测试代码
 if __name__ == "__main__":
@@ -141,4 +297,5 @@ if __name__ == "__main__":
     print("总体平均评分:", calculate_average_score(test_records))
     print("火锅类平均评分:", calculate_average_score(test_records, type_="火锅"))
     print("最常打卡的类型:", find_most_common_type(test_records))
-    print("评分最高的餐厅:", get_top_restaurants(test_records, limit=3))
\ No newline at end of file
+    print("评分最高的餐厅:", get_top_restaurants(test_records, limit=3))
+    print("各类型高分餐厅(贝叶斯加权):", get_top_restaurants_by_type(test_records, limit=3, prior_weight=5))
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+多个数据库之间的增量同步
+每条记录有全局唯一的 uuid，每次修改都会推进本库的逻辑时钟并写入 change_log（每条记录只保留最新的一次）。
+导出时只取上次导出给对方之后的变更，写成 gzip 压缩的 JSON 文件；
+应用时按 (时钟, 节点) 比较先后，后写者胜，重复应用同一个文件不会产生变化。
+"""
+import argparse
+import gzip
+import json
+from database import DakaDatabase
+
+FORMAT_VERSION = 1
+
+def export_changes(db, path, peer=None, full=False):
+    """
+    把上次导出给 peer 之后的变更写入文件，返回导出的变更数
+    peer 为对方的节点 ID（不会把对方自己产生的变更发回去），full=True 时导出全部变更
+    """
+    since = 0 if full or peer is None else db.get_peer_mark(peer)
+    max_seq, changes = db.get_changes_since(since, exclude_node=peer)
+    data = {'format': FORMAT_VERSION, 'node': db.get_node_id(), 'changes': changes}
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    if peer is not None:
+        db.set_peer_mark(peer, max_seq)
+    return len(changes)
+
+def read_changes_file(path):
+    """读取变更文件，返回 (来源节点 ID, 变更列表)"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('format') != FORMAT_VERSION:
+        raise ValueError(f"不支持的同步文件格式: {data.get('format')}")
+    return data['node'], [tuple(change) for change in data['changes']]
+
+def apply_changes_file(db, path):
+    """应用变更文件，返回 (应用的条数, 跳过的条数)，失败时返回 None"""
+    try:
+        _, changes = read_changes_file(path)
+    except Exception as e:
+        print(f"读取同步文件失败: {e}")
+        return None
+    return db.apply_changes(changes)
+
+def sync_databases(db_a, db_b):
+    """
+    在两个数据库之间双向同步，只传输上次同步之后的变更
+    返回 ((A 应用, 跳过), (B 应用, 跳过))
+    """
+    node_a, node_b = db_a.get_node_id(), db_b.get_node_id()
+    seq_a, changes_a = db_a.get_changes_since(db_a.get_peer_mark(node_b), exclude_node=node_b)
+    seq_b, changes_b = db_b.get_changes_since(db_b.get_peer_mark(node_a), exclude_node=node_a)
+    result_b = db_b.apply_changes(changes_a)
+    result_a = db_a.apply_changes(changes_b)
+    if result_b is not None:
+        db_a.set_peer_mark(node_b, seq_a)
+    if result_a is not None:
+        db_b.set_peer_mark(node_a, seq_b)
+    return result_a, result_b
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在多个打卡数据库之间增量同步")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    export_parser = subparsers.add_parser("export", help="导出上次同步之后的变更")
+    export_parser.add_argument("--db", default="daka_records.db", help="数据库文件")
+    export_parser.add_argument("--peer", help="对方的节点 ID（用 node 命令查看），记录导出进度")
+    export_parser.add_argument("--full", action="store_true", help="导出全部变更")
+    export_parser.add_argument("output", help="变更文件（.json.gz）")
+    
+    apply_parser = subparsers.add_parser("apply", help="应用其他数据库导出的变更文件")
+    apply_parser.add_argument("--db", default="daka_records.db", help="数据库文件")
+    apply_parser.add_argument("input", nargs="+", help="变更文件")
+    
+    sync_parser = subparsers.add_parser("sync", help="直接在两个数据库文件之间双向同步")
+    sync_parser.add_argument("db_a")
+    sync_parser.add_argument("db_b")
+    
+    node_parser = subparsers.add_parser("node", help="显示数据库的节点 ID")
+    node_parser.add_argument("--db", default="daka_records.db", help="数据库文件")
+    args = parser.parse_args(argv)
+    
+    if args.command == "sync":
+        db_a, db_b = DakaDatabase(args.db_a), DakaDatabase(args.db_b)
+        try:
+            result_a, result_b = sync_databases(db_a, db_b)
+        finally:
+            db_a.close()
+            db_b.close()
+        if result_a is None or result_b is None:
+            return 1
+        print(f"{args.db_a}: 应用 {result_a[0]} 条, 跳过 {result_a[1]} 条")
+        print(f"{args.db_b}: 应用 {result_b[0]} 条, 跳过 {result_b[1]} 条")
+        return 0
+    
+    db = DakaDatabase(args.db)
+    try:
+        if args.command == "node":
+            print(db.get_node_id())
+        elif args.command == "export":
+            count = export_changes(db, args.output, args.peer, args.full)
+            print(f"导出 {count} 条变更到 {args.output}")
+        else:
+            for path in args.input:
+                result = apply_changes_file(db, path)
+                if result is None:
+                    return 1
+                print(f"{path}: 应用 {result[0]} 条, 跳过 {result[1]} 条")
+    finally:
+        db.close()
+    return 0
+
+# 命令行：python sync.py export --peer 对方节点ID changes.json.gz | apply changes.json.gz | sync a.db b.db | node
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,124 @@
+"""
+记录表格的多列排序
+每一列的排序键在第一次按该列排序时计算并缓存，之后切换升降序或组合多列排序都不需要重新计算，
+也不需要查询数据库。排序结果是记录的下标顺序，由界面按这个顺序重新排列表格中的行。
+"""
+from record_store import RecordStore
+
+# 表格列 -> get_all_records 元组中的下标
+SORT_COLUMNS = {'id': 0, 'name': 1, 'type': 2, 'date': 3, 'score': 4, 'comment': 5, 'has_image': 6}
+
+# RecordStore 中没有紧凑保存的列：记录数超过 IN_MEMORY_LIMIT 时改用数据库的 ORDER BY，
+# 避免为了排序把全部短评和图片路径加载到内存
+TEXT_COLUMNS = ('comment', 'has_image')
+IN_MEMORY_LIMIT = 50000
+
+class ColumnSorter:
+    """对一组已加载的记录（RecordStore 或元组列表）按多列排序"""
+    
+    def __init__(self, records):
+        self.records = records
+        self._keys = {}  # 列 -> 每条记录的排序键
+    
+    def keys(self, column):
+        """获取某一列的排序键（缓存）"""
+        keys = self._keys.get(column)
+        if keys is None:
+            keys = self._keys[column] = self._compute_keys(column)
+        return keys
+    
+    def _compute_keys(self, column):
+        index = SORT_COLUMNS[column]
+        records = self.records
+        if isinstance(records, RecordStore):
+            # 直接使用紧凑存储中的数组；名称和类型先把编码换成按名称排序的名次
+            if column == 'id':
+                return records.ids
+            if column == 'score':
+                return records.scores
+            if column == 'date':
+                return records.days
+            if column == 'name':
+                return _ranked_codes(records.name_codes, records.restaurant_names)
+            if column == 'type':
+                return _ranked_codes(records.type_codes, records.type_names)
+        
+        if column == 'has_image':
+            return [bool(record[index]) for record in records]
+        if column == 'comment':
+            return [record[index] or "" for record in records]
+        return [record[index] for record in records]
+    
+    def needs_query(self, sort_keys):
+        """是否应该改用数据库排序"""
+        return (isinstance(self.records, RecordStore) and len(self.records) > IN_MEMORY_LIMIT
+                and not self.records.details_loaded()
+                and any(column in TEXT_COLUMNS for column, _ in sort_keys))
+    
+    def order(self, sort_keys):
+        """
+        按 [(列, 是否降序), ...] 排序，第一个为主排序列，其余依次为次要排序列
+        返回记录下标的列表
+        """
+        order = list(range(len(self.records)))
+        # 稳定排序：从最次要的列开始依次排序，结果等价于按多列组合排序
+        for column, descending in reversed(sort_keys):
+            keys = self.keys(column)
+            order.sort(key=keys.__getitem__, reverse=descending)
+        return order
+
+def _ranked_codes(codes, names):
+    """把维度编码换成名称排序后的名次"""
+    rank = {code: i for i, (code, _) in enumerate(sorted(names.items(), key=lambda item: item[1]))}
+    return [rank[code] for code in codes]
+
+def update_sort_keys(sort_keys, column, add=False):
+    """
+    点击列标题后新的排序列：
+    普通点击只按该列排序（已经是主排序列时切换升降序），
+    add=True（Shift+点击）时把该列加为次要排序列（已在排序列中时切换它的升降序）
+    """
+    if add:
+        for i, (existing, descending) in enumerate(sort_keys):
+            if existing == column:
+                return list(sort_keys[:i]) + [(column, not descending)] + list(sort_keys[i + 1:])
+        return list(sort_keys) + [(column, False)]
+    if sort_keys and sort_keys[0][0] == column:
+        return [(column, not sort_keys[0][1])] + list(sort_keys[1:])
+    return [(column, False)]
+
+# 性能测试：python table_sort.py [记录数]
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+    import time
+    from database import DakaDatabase
+    from parallel_statistics import _create_benchmark_database
+    
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "sort.db")
+        _create_benchmark_database(db_path, rows)
+        db = DakaDatabase(db_path)
+        store = RecordStore(db)
+        store.load()
+        sorter = ColumnSorter(store)
+        
+        sort_keys = [('name', False), ('score', True)]
+        start = time.perf_counter()
+        order = sorter.order(sort_keys)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        sorter.order([('name', True), ('score', False)])
+        cached = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = db.get_records_ordered(sort_keys)
+        query = time.perf_counter() - start
+        
+        print(f"{rows} 条记录，按名称升序 + 评分降序")
+        print(f"第一次排序（计算排序键）: {first * 1000:.0f}ms，再次排序（使用缓存）: {cached * 1000:.0f}ms，"
+              f"数据库 ORDER BY: {query * 1000:.0f}ms")
+        same = [store[i][1:5:3] for i in order] == [row[1:5:3] for row in expected]
+        print(f"与数据库排序结果一致: {same}")
+        db.close()
@@ -0,0 +1,188 @@
+"""
+分组提交的写入队列
+高峰期多个终端同时打卡时，逐条 commit 的吞吐量受磁盘同步（fsync）延迟限制。
+DakaDatabase(write_queue=True) 的 add_record 只把记录放入队列并返回 Future，
+由 GroupCommitWriter 的后台线程每隔几毫秒或攒够 N 条记录写入一个事务，
+事务提交（数据已经同步到磁盘）后 Future 才返回结果。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class GroupCommitWriter:
+    """后台写入线程：使用独立的数据库连接，把队列中的记录分组提交"""
+    
+    def __init__(self, db_name, max_batch=500, max_delay=0.001):
+        self.db_name = db_name
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.commits = 0  # 已提交的事务数
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._error = None  # 后台线程打开数据库失败时的异常
+        self._thread = threading.Thread(target=self._run, name="GroupCommitWriter", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            raise self._error
+    
+    def submit(self, record):
+        """提交一条记录 (名称, 类型, 日期, 评分, 短评, 图片路径)，返回 Future，提交成功后结果为 True"""
+        future = Future()
+        self._queue.put((record, future))
+        return future
+    
+    def flush(self, timeout=None):
+        """等待此前提交的记录全部写入，成功返回 True"""
+        done = Future()
+        self._queue.put((None, done))
+        return done.result(timeout)
+    
+    def close(self):
+        """写入剩余的记录并停止后台线程"""
+        result = self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        return result
+    
+    def _next_batch(self):
+        """
+        取出一批队列项：收到第一条记录后取走队列中已有的记录，并最多再等 max_delay 秒，
+        攒够 max_batch 条或遇到 flush / 停止请求时立即写入
+        """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while batch[-1] is not None and batch[-1][0] is not None and len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def _write(self, db, items):
+        """写入一组记录；整组失败时逐条重试，只让出错的记录失败"""
+        if not items:
+            return True
+        if db.add_records([record for record, _ in items]):
+            results = [True] * len(items)
+        else:
+            results = [db.add_record(*record) for record, _ in items]
+        self.commits += 1
+        for (_, future), result in zip(items, results):
+            future.set_result(result)
+        return all(results)
+    
+    def _run(self):
+        """后台线程：数据库连接只在该线程中使用"""
+        from database import DakaDatabase
+        
+        db = None
+        try:
+            db = DakaDatabase(self.db_name)
+            # WAL 模式下主连接的查询不会阻塞写入
+            db.cursor.execute('PRAGMA journal_mode = WAL').fetchone()
+        except Exception as e:
+            self._error = e
+            if db is not None:
+                db.close()
+            return
+        finally:
+            self._ready.set()
+        ok = True
+        try:
+            running = True
+            while running:
+                items = []
+                for item in self._next_batch():
+                    if item is None:
+                        running = False
+                    elif item[0] is None:
+                        # flush 请求：先写入它之前的记录
+                        ok = self._write(db, items) and ok
+                        items = []
+                        item[1].set_result(ok)
+                        ok = True
+                    else:
+                        items.append(item)
+                ok = self._write(db, items) and ok
+        finally:
+            db.close()
+
+def _benchmark_per_row(db_path, records, terminals, wal=False):
+    """当前方式：每个终端一个连接，每条记录提交一次"""
+    from database import DakaDatabase
+    
+    def terminal(part):
+        db = DakaDatabase(db_path)
+        db.cursor.execute('PRAGMA busy_timeout = 30000')
+        if wal:
+            db.cursor.execute('PRAGMA journal_mode = WAL').fetchone()
+        for record in part:
+            db.add_record(*record)
+        db.close()
+    
+    threads = [threading.Thread(target=terminal, args=(records[i::terminals],)) for i in range(terminals)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+def _benchmark_group_commit(db_path, records, terminals):
+    """写入队列：每个终端等待自己的记录提交后再录入下一条"""
+    from database import DakaDatabase
+    
+    db = DakaDatabase(db_path, write_queue=True)
+    
+    def terminal(part):
+        for record in part:
+            db.add_record(*record).result()
+    
+    threads = [threading.Thread(target=terminal, args=(records[i::terminals],)) for i in range(terminals)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    commits = db.write_queue.commits
+    db.close()
+    return elapsed, commits
+
+# 性能对比：python write_queue.py [记录数] [终端数]
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+    from database import DakaDatabase
+    
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    terminals = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    records = [(f"餐厅{i % 50}", "火锅", f"2024-01-{i % 28 + 1:02d}", i % 11, f"打卡{i}", None) for i in range(count)]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        per_row_path = os.path.join(tmp, "per_row.db")
+        per_row_wal_path = os.path.join(tmp, "per_row_wal.db")
+        queue_path = os.path.join(tmp, "group_commit.db")
+        for path in (per_row_path, per_row_wal_path, queue_path):
+            DakaDatabase(path).close()
+        
+        per_row = _benchmark_per_row(per_row_path, records, terminals)
+        per_row_wal = _benchmark_per_row(per_row_wal_path, records, terminals, wal=True)
+        grouped, commits = _benchmark_group_commit(queue_path, records, terminals)
+        print(f"{count} 条记录, {terminals} 个终端")
+        print(f"逐条提交: {per_row:.3f}s ({count / per_row:.0f} 条/秒, {count} 次提交)")
+        print(f"逐条提交 (WAL): {per_row_wal:.3f}s ({count / per_row_wal:.0f} 条/秒, {count} 次提交)")
+        print(f"分组提交 (WAL): {grouped:.3f}s ({count / grouped:.0f} 条/秒, {commits} 次提交)")
+        
+        for path in (per_row_path, per_row_wal_path, queue_path):
+            db = DakaDatabase(path)
+            print(f"{os.path.basename(path)}: {len(db.get_all_records())} 条记录")
+            db.close()